@@ -0,0 +1,80 @@
+"""
+Benchmark and self-check of the DDS frame decoder.
+
+Decodes synthetic BC1/BC2/BC3 and uncompressed DDS blobs, checks the
+vectorized decoder against the scalar reference implementation
+and prints throughput in megapixels per second.
+
+Usage: python benchmarks/bench_dds.py [texture side in pixels]
+"""
+
+import os
+import random
+import sys
+import timeit
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_dds
+
+
+def random_bytes(rnd, size):
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(size)))
+
+
+def make_dds(rnd, width, height, fourcc=None, bit_count=32, masks=(0xff0000, 0xff00, 0xff, 0xff000000)):
+    if fourcc:
+        pf = (spr_dds.DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0)
+    else:
+        pf = (spr_dds.DDPF_RGB | spr_dds.DDPF_ALPHAPIXELS, b'\0' * 4, bit_count) + masks
+    header_data = pack(spr_dds.HEADER_STRUCT, spr_dds.MAGIC, 124, 0x1007, height, width, 0, 0, 1,
+                       32, *(pf + (0x1000, 0, 0, 0, 0)))
+    header = spr_dds.read_header(header_data)[0]
+    return header_data + random_bytes(rnd, spr_dds.frame_size(header) - spr_dds.HEADER_SIZE)
+
+
+def make_corpus(rnd):
+    corpus = []
+    for fourcc in (b'DXT1', b'DXT3', b'DXT5'):
+        for width, height in ((1, 1), (4, 4), (13, 7), (64, 32), (100, 3)):
+            corpus.append(make_dds(rnd, width, height, fourcc))
+    corpus.append(make_dds(rnd, 9, 5))
+    corpus.append(make_dds(rnd, 6, 2, bit_count=16, masks=(0xf800, 0x7e0, 0x1f, 0)))
+    corpus.append(make_dds(rnd, 3, 3, bit_count=24, masks=(0xff0000, 0xff00, 0xff, 0)))
+    return corpus
+
+
+def decode_reference(data):
+    numpy, spr_dds.numpy = spr_dds.numpy, None
+    try:
+        return spr_dds.decode(data)
+    finally:
+        spr_dds.numpy = numpy
+
+
+def main():
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    rnd = random.Random(0)
+
+    corpus = make_corpus(rnd)
+    if spr_dds.numpy is not None:
+        for i, data in enumerate(corpus):
+            if spr_dds.decode(data) != decode_reference(data):
+                raise AssertionError('Decoded pixels of blob %d do not match the reference' % i)
+        print('vectorized decoder matches reference on %d blobs' % len(corpus))
+    else:
+        print('numpy is not installed, only the reference decoder is measured')
+
+    print('texture %dx%d' % (side, side))
+    print('%-8s %14s %14s' % ('format', 'reference MP/s', 'current MP/s'))
+    for name, fourcc in (('BC1', b'DXT1'), ('BC2', b'DXT3'), ('BC3', b'DXT5'), ('RGBA', None)):
+        data = make_dds(rnd, side, side, fourcc)
+        megapixels = side * side / 1e6
+        reference = megapixels / min(timeit.repeat(lambda: decode_reference(data), number=1, repeat=1))
+        current = megapixels / min(timeit.repeat(lambda: spr_dds.decode(data), number=1, repeat=3))
+        print('%-8s %14.2f %14.2f' % (name, reference, current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark and round trip check of the BC1/BC3 encoder.
+
+Synthetic frames with gradients, noise and an alpha ramp are encoded at every quality,
+decoded back and compared with the source pixels. The check fails if the root mean square
+error of any channel exceeds the tolerance of the quality, or if the vectorized encoder is
+noticeably worse than the scalar reference. Throughput is printed in megapixels per second,
+also for frames encoded across a worker pool.
+
+Usage: python benchmarks/bench_dds_encode.py [texture side in pixels] [workers]
+"""
+
+from __future__ import print_function
+
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_dds
+import spr_workers
+
+QUALITY_NAMES = ('fast', 'normal', 'high')
+
+# Largest RMS error per channel allowed after the round trip, by quality
+TOLERANCES = {
+    spr_dds.QUALITY_FAST: 12.0,
+    spr_dds.QUALITY_NORMAL: 9.0,
+    spr_dds.QUALITY_HIGH: 8.0,
+}
+
+# The vectorized encoder may round a few endpoints differently than the reference
+REFERENCE_MARGIN = 0.05
+
+
+def make_frame(rnd, width, height, alpha):
+    pixels = bytearray(width * height * 4)
+    for y in range(height):
+        for x in range(width):
+            pos = (y * width + x) * 4
+            noise = rnd.randint(-6, 6)
+            pixels[pos] = min(max(x * 4 % 256 + noise, 0), 255)
+            pixels[pos + 1] = min(max(y * 3 % 256 - noise, 0), 255)
+            pixels[pos + 2] = (x + y) % 256 if (x // 8 + y // 8) % 2 else 40
+            pixels[pos + 3] = (x * 5 + 16) % 256 if alpha else 255
+    return bytes(pixels)
+
+
+def rms_errors(source, decoded):
+    source, decoded = bytearray(source), bytearray(decoded)
+    errors = []
+    for channel in range(4):
+        pairs = zip(source[channel::4], decoded[channel::4])
+        errors.append(math.sqrt(sum((a - b) ** 2 for a, b in pairs) / float(len(source) // 4)))
+    return errors
+
+
+def encode_reference(width, height, rgba, quality):
+    numpy, spr_dds.numpy = spr_dds.numpy, None
+    try:
+        return spr_dds.encode(width, height, rgba, quality=quality)
+    finally:
+        spr_dds.numpy = numpy
+
+
+def check_round_trip(rnd):
+    failures = []
+    for alpha in (False, True):
+        for width, height in ((1, 1), (13, 7), (64, 48)):
+            rgba = make_frame(rnd, width, height, alpha)
+            for quality in sorted(TOLERANCES):
+                errors = rms_errors(rgba, spr_dds.decode(spr_dds.encode(width, height, rgba, quality=quality))[2])
+                name = '%s %dx%d %s' % ('BC3' if alpha else 'BC1', width, height, QUALITY_NAMES[quality])
+                if max(errors) > TOLERANCES[quality]:
+                    failures.append('%s: RMS error %.2f exceeds %.2f' % (name, max(errors), TOLERANCES[quality]))
+
+                if spr_dds.numpy is not None:
+                    reference = encode_reference(width, height, rgba, quality)
+                    reference_errors = rms_errors(rgba, spr_dds.decode(reference)[2])
+                    if sum(errors) > sum(reference_errors) * (1 + REFERENCE_MARGIN) + 0.01:
+                        failures.append('%s: RMS errors %s, reference %s' % (
+                            name, ['%.2f' % e for e in errors], ['%.2f' % e for e in reference_errors]))
+    return failures
+
+
+def main():
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rnd = random.Random(0)
+
+    failures = check_round_trip(rnd)
+    for message in failures:
+        print('FAILED %s' % message)
+    if failures:
+        return 1
+    print('round trip within tolerance%s' % ('' if spr_dds.numpy is None else ', vectorized encoder matches reference'))
+
+    frames = [make_frame(rnd, side, side, i % 2 == 1) for i in range(4)]
+    megapixels = len(frames) * side * side / 1e6
+    print('%d frames %dx%d' % (len(frames), side, side))
+    print('%-8s %10s %10s %14s' % ('quality', 'RMS error', 'MP/s', '%d workers MP/s' % workers))
+    for quality in sorted(TOLERANCES):
+        jobs = [(side, side, rgba, None, quality) for rgba in frames]
+        timings = []
+        for pool_size in (1, workers):
+            start = time.time()
+            encoded = list(spr_workers.imap(spr_dds.encode, jobs, pool_size))
+            timings.append(megapixels / max(time.time() - start, 1e-9))
+        error = max(max(rms_errors(rgba, spr_dds.decode(data)[2])) for rgba, data in zip(frames, encoded))
+        print('%-8s %10.2f %10.2f %14.2f' % (QUALITY_NAMES[quality], error, timings[0], timings[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Benchmark of frame decoding in worker processes.
+
+Decodes a large synthetic sprite (palette expansion) and a large synthetic
+version 3 sprite (BC3 decompression) with 1, 2, 4 and 8 workers.
+
+Usage: python benchmarks/bench_parallel.py [frames] [frame side in pixels]
+"""
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_dds
+import spr_pixels
+import spr_workers
+from spr_codec import SpriteCodec
+from bench_dds import make_dds
+
+WORKERS = (1, 2, 4, 8)
+
+
+def measure(func, jobs, workers, megapixels):
+    start = time.time()
+    results = list(spr_workers.imap(func, jobs, workers))
+    return megapixels / (time.time() - start), results
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    rnd = random.Random(0)
+    megapixels = frames * side * side / 1e6
+
+    frame = bytes(bytearray(rnd.getrandbits(8) for _ in range(side * side)))
+    expand_jobs = [(frame, SpriteCodec.TEXTURE_FORMAT_ALPHATEST, 256)] * frames
+    dds_frame = make_dds(rnd, side, side, b'DXT5')
+    decode_jobs = [(dds_frame,)] * frames
+
+    print('%d frames %dx%d, numpy: %s, cpus: %d' % (frames, side, side,
+                                                   'yes' if spr_pixels.numpy is not None else 'no',
+                                                   multiprocessing.cpu_count()))
+    print('%-8s %18s %18s' % ('workers', 'alphatest MP/s', 'BC3 MP/s'))
+    expected = None
+    for workers in WORKERS:
+        expand_rate, expanded = measure(spr_pixels.expand_indices, expand_jobs, workers, megapixels)
+        decode_rate, decoded = measure(spr_dds.decode, decode_jobs, workers, megapixels)
+        if expected is None:
+            expected = expanded, decoded
+        elif (expanded, decoded) != expected:
+            raise AssertionError('Results of %d workers differ from sequential decoding' % workers)
+        print('%-8d %18.2f %18.2f' % (workers, expand_rate, decode_rate))
+
+
+if __name__ == '__main__':
+    main()
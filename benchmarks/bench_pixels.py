@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of palette index expansion.
+
+Compares spr_pixels.expand_indices with the per-pixel implementation it replaced
+and prints throughput in megapixels per second for every texture format.
+
+Usage: python benchmarks/bench_pixels.py [frame side in pixels]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_pixels
+from spr_codec import SpriteCodec
+
+FORMATS = (
+    ('normal', SpriteCodec.TEXTURE_FORMAT_NORMAL),
+    ('additive', SpriteCodec.TEXTURE_FORMAT_ADDITIVE),
+    ('indexalpha', SpriteCodec.TEXTURE_FORMAT_INDEXALPHA),
+    ('alphatest', SpriteCodec.TEXTURE_FORMAT_ALPHATEST),
+)
+
+
+def legacy_expand_indices(indices, texture_format, palette_size):
+    last_index = palette_size - 1
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_INDEXALPHA:
+        return b''.join(bytes(bytearray((i, i))) for i in bytearray(indices))
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_ALPHATEST:
+        return b''.join(bytes(bytearray((i, 0xff - (i // last_index * 0xff)))) for i in bytearray(indices))
+
+    return indices
+
+
+def measure(func, indices, texture_format, repeat):
+    best = min(timeit.repeat(lambda: func(indices, texture_format, 256), number=1, repeat=repeat))
+    return len(indices) / 1e6 / best
+
+
+def main():
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    rnd = random.Random(0)
+    indices = bytes(bytearray(rnd.randrange(256) for _ in range(side * side)))
+
+    print('frame %dx%d, numpy: %s' % (side, side, 'yes' if spr_pixels.numpy is not None else 'no'))
+    print('%-12s %14s %14s %9s' % ('format', 'legacy MP/s', 'current MP/s', 'speedup'))
+    for name, texture_format in FORMATS:
+        if legacy_expand_indices(indices, texture_format, 256) != \
+                spr_pixels.expand_indices(indices, texture_format, 256):
+            raise AssertionError('Pixel data mismatch for %s format' % name)
+
+        legacy = measure(legacy_expand_indices, indices, texture_format, 1)
+        current = measure(spr_pixels.expand_indices, indices, texture_format, 5)
+        print('%-12s %14.2f %14.2f %8.1fx' % (name, legacy, current, current / legacy))
+
+
+if __name__ == '__main__':
+    main()
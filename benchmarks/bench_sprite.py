@@ -0,0 +1,269 @@
+"""
+Benchmark of the GIMP adapter on synthetic sprites.
+
+GIMP is replaced with the stand-in from benchmarks/fake_gimp. Sprites are generated for
+every combination of version, texture format, frame type, frame count and frame size, then
+loading, saving, thumbnail creation, pixel conversion and preview rendering are timed. Peak memory is measured
+with tracemalloc where it is available.
+
+Results can be stored as a baseline and later runs compared against it:
+
+    python benchmarks/bench_sprite.py --quick --save-baseline baseline.json
+    python benchmarks/bench_sprite.py --quick --baseline baseline.json
+
+Comparison exits with status 1 if any measurement is slower or larger than the baseline
+by more than the tolerance.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fake_gimp'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'file-spr'))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from gimpfu import pdb
+from spr import Sprite
+from spr_codec import SpriteCodec, SpriteReader, SpriteWriter
+import spr_dds
+import spr_pixels
+import spr_preview
+from bench_dds import make_dds, random_bytes
+
+FORMATS = (
+    ('normal', SpriteCodec.TEXTURE_FORMAT_NORMAL),
+    ('additive', SpriteCodec.TEXTURE_FORMAT_ADDITIVE),
+    ('indexalpha', SpriteCodec.TEXTURE_FORMAT_INDEXALPHA),
+    ('alphatest', SpriteCodec.TEXTURE_FORMAT_ALPHATEST),
+)
+FRAME_TYPES = ('single', 'group')
+GROUP_LEN = 4
+THUMB_SIZE = 128
+
+# Measurements faster than this are not compared, they are mostly timer noise
+MIN_COMPARED_SECONDS = 0.005
+
+
+class Case(object):
+
+    def __init__(self, version, format_name, texture_format, frame_type, frames_num, side):
+        self.version = version
+        self.texture_format = texture_format
+        self.frame_type = frame_type
+        self.frames_num = frames_num
+        self.side = side
+        self.name = 'v%d-%s-%s-%dx%d' % (version, format_name, frame_type, frames_num, side)
+
+    @property
+    def megapixels(self):
+        sub_frames = GROUP_LEN if self.frame_type == 'group' else 1
+        return self.frames_num * sub_frames * self.side * self.side / 1e6
+
+
+def make_cases(frame_counts, sides):
+    cases = []
+    for frames_num in frame_counts:
+        for side in sides:
+            for format_name, texture_format in FORMATS:
+                for frame_type in FRAME_TYPES:
+                    cases.append(Case(SpriteCodec.VERSION_BMP, format_name, texture_format, frame_type,
+                                      frames_num, side))
+            cases.append(Case(SpriteCodec.VERSION_DDS, 'dxt5', 0, 'single', frames_num, side))
+    return cases
+
+
+def make_sprite(path, case, rnd):
+    """
+    Write synthetic sprite of the benchmark case.
+    """
+
+    header = SpriteCodec.make_header(case.side, case.side, case.frames_num, 0, case.texture_format, case.version)
+
+    if case.version == SpriteCodec.VERSION_DDS:
+        frame = make_dds(rnd, case.side, case.side, b'DXT5')
+        with open(path, 'wb') as fd:
+            fd.write(struct.pack(SpriteCodec.HEADER_STRUCT, *header))
+            for _ in range(case.frames_num):
+                fd.write(frame)
+        return
+
+    def make_params():
+        return SpriteCodec.FrameParams(-case.side // 2, case.side // 2, case.side, case.side)
+
+    with SpriteWriter(path, header, random_bytes(rnd, 768)) as writer:
+        for _ in range(case.frames_num):
+            if case.frame_type == 'single':
+                frame = SpriteCodec.FrameData(SpriteCodec.FRAME_TYPE_SINGLE, 0, None, make_params(),
+                                              random_bytes(rnd, case.side * case.side))
+            else:
+                frame = SpriteCodec.FrameData(SpriteCodec.FRAME_TYPE_GROUP, GROUP_LEN,
+                                              [(i + 1) * 0.1 for i in range(GROUP_LEN)],
+                                              [make_params() for _ in range(GROUP_LEN)],
+                                              [random_bytes(rnd, case.side * case.side) for _ in range(GROUP_LEN)])
+            writer.write_frame(frame)
+
+
+def grouped_layers(image):
+    groups = []
+    for layer in reversed(image.layers):
+        if pdb.gimp_item_is_group(layer):
+            groups.append([layer] + list(reversed(layer.layers)))
+        else:
+            groups.append([layer])
+    return groups
+
+
+def convert_pixels(path):
+    with SpriteReader(path) as reader:
+        if reader.header.version == SpriteCodec.VERSION_DDS:
+            for data in reader.dds_frames():
+                spr_dds.decode(data)
+            return
+
+        palette_size = len(reader.palette) // 3
+        for i in range(reader.header.frames_number):
+            fr = reader.frame(i)
+            for indices in [fr.indices] if fr.type == SpriteCodec.FRAME_TYPE_SINGLE else fr.indices:
+                spr_pixels.expand_indices(indices, reader.header.format, palette_size)
+            del fr
+
+
+def render_preview(path):
+    with SpriteReader(path) as reader:
+        for _ in spr_preview.render(reader)[3]:
+            pass
+
+
+def make_operations(case, path, out_path):
+    operations = [
+        ('load', lambda: Sprite.load_from_file(path)),
+        ('thumbnail', lambda: Sprite.load_thumbnail(path, THUMB_SIZE)),
+        ('pixels', lambda: convert_pixels(path)),
+        ('preview', lambda: render_preview(path)),
+    ]
+
+    if case.version == SpriteCodec.VERSION_BMP:
+        image = Sprite.load_from_file(path)[0]
+        layers = grouped_layers(image)
+        operations.append(('save', lambda: Sprite.save_to_file(image, out_path, layers, 0, case.texture_format)))
+    else:
+        # Version 3 sprites are loaded as one image per frame, the first one is encoded again
+        image = Sprite.load_from_file(path)[0]
+        layers = grouped_layers(image)
+        operations.append(('save', lambda: Sprite.save_to_file(image, out_path, layers, version=case.version)))
+
+    return operations
+
+
+def measure(func, repeat):
+    seconds = min(_timed(func) for _ in range(repeat))
+
+    peak_kb = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_kb
+
+
+def _timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find measurements worse than the baseline.
+    :return: list of messages
+    """
+
+    regressions = []
+    for case_name, operations in sorted(results.items()):
+        for op_name, result in sorted(operations.items()):
+            base = baseline.get(case_name, {}).get(op_name)
+            if base is None:
+                continue
+            if result['seconds'] > MIN_COMPARED_SECONDS and result['seconds'] > base['seconds'] * (1 + tolerance):
+                regressions.append('%s %s: %.4fs, baseline %.4fs' % (case_name, op_name, result['seconds'],
+                                                                    base['seconds']))
+            if result['peak_kb'] is not None and base.get('peak_kb') is not None \
+                    and result['peak_kb'] > base['peak_kb'] * (1 + tolerance) + 64:
+                regressions.append('%s %s: peak %d KiB, baseline %d KiB' % (case_name, op_name, result['peak_kb'],
+                                                                           base['peak_kb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark sprite loading and saving on synthetic sprites.')
+    parser.add_argument('--quick', action='store_true', help='small matrix for a fast check')
+    parser.add_argument('-k', dest='filter', default='', help='run only cases with this substring in the name')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per measurement, the best is kept')
+    parser.add_argument('--baseline', help='compare with results stored in this JSON file')
+    parser.add_argument('--save-baseline', help='store results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown and memory growth relative to the baseline (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        cases = make_cases((4,), (64,))
+    else:
+        cases = make_cases((1, 16), (64, 256))
+    cases = [case for case in cases if args.filter in case.name]
+
+    print('numpy: %s, tracemalloc: %s' % ('yes' if spr_pixels.numpy is not None else 'no',
+                                         'yes' if tracemalloc is not None else 'no'))
+    print('%-32s %-10s %10s %10s %12s' % ('case', 'operation', 'seconds', 'MP/s', 'peak KiB'))
+
+    temp_dir = tempfile.mkdtemp(prefix='bench_sprite.')
+    results = {}
+    try:
+        rnd = random.Random(0)
+        for case in cases:
+            path = os.path.join(temp_dir, case.name + '.spr')
+            make_sprite(path, case, rnd)
+
+            results[case.name] = {}
+            for op_name, func in make_operations(case, path, os.path.join(temp_dir, 'out.spr')):
+                seconds, peak_kb = measure(func, args.repeat)
+                results[case.name][op_name] = {'seconds': round(seconds, 6), 'peak_kb': peak_kb}
+                print('%-32s %-10s %10.4f %10.2f %12s' % (case.name, op_name, seconds,
+                                                          case.megapixels / max(seconds, 1e-9),
+                                                          '-' if peak_kb is None else peak_kb))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+        print('baseline saved to %s' % args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            regressions = compare(results, json.load(fd), args.tolerance)
+        for message in regressions:
+            print('REGRESSION %s' % message)
+        print('%d regressions against %s' % (len(regressions), args.baseline))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Minimal stand-in for GIMP's gimpfu module.
+
+Provides images, layers, pixel regions, parasites and the pdb procedures the plug-in
+calls, so the GIMP adapter can be benchmarked without GIMP. Pixels are kept in
+bytearrays; procedures that would need GIMP's image processing do nearest neighbour
+scaling or raise RuntimeError.
+"""
+
+import gettext
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'file-spr'))
+
+import spr_pixels
+
+RGB, GRAY, INDEXED = range(3)
+RGB_IMAGE, RGBA_IMAGE, GRAY_IMAGE, GRAYA_IMAGE, INDEXED_IMAGE, INDEXEDA_IMAGE = range(6)
+NORMAL_MODE, ADDITION_MODE = 0, 7
+RUN_INTERACTIVE, RUN_NONINTERACTIVE, RUN_WITH_LAST_VALS = range(3)
+PARASITE_PERSISTENT = 1
+NO_DITHER, MAKE_PALETTE = 0, 0
+
+PF_INT, PF_FLOAT, PF_STRING, PF_BOOL, PF_IMAGE, PF_DRAWABLE = 0, 3, 4, 0, 13, 16
+
+BYTES_PER_PIXEL = {RGB_IMAGE: 3, RGBA_IMAGE: 4, GRAY_IMAGE: 1, GRAYA_IMAGE: 2, INDEXED_IMAGE: 1, INDEXEDA_IMAGE: 2}
+
+
+class Parasite(object):
+
+    def __init__(self, name, flags, data):
+        self.name = name
+        self.flags = flags
+        self.data = data
+
+
+class _ParasiteOwner(object):
+
+    def __init__(self):
+        self._parasites = {}
+
+    def attach_new_parasite(self, name, flags, data):
+        self._parasites[name] = Parasite(name, flags, data)
+
+    def parasite_attach(self, parasite):
+        self._parasites[parasite.name] = parasite
+
+    def parasite_find(self, name):
+        return self._parasites.get(name)
+
+    def parasite_detach(self, name):
+        del self._parasites[name]
+
+    def parasite_list(self):
+        return tuple(self._parasites)
+
+
+class PixelRgn(object):
+
+    def __init__(self, drawable, x, y, width, height):
+        self.drawable = drawable
+        self.x, self.y, self.w, self.h = x, y, width, height
+
+    def _rect(self, key):
+        # Slices are in drawable coordinates and must be inside the region, like in GIMP
+        xs, ys = key
+        x0 = self.x if xs.start is None else xs.start
+        x1 = self.x + self.w if xs.stop is None else xs.stop
+        y0 = self.y if ys.start is None else ys.start
+        y1 = self.y + self.h if ys.stop is None else ys.stop
+        if x0 < self.x or y0 < self.y or x1 > self.x + self.w or y1 > self.y + self.h:
+            raise IndexError('slice is out of the pixel region')
+        return x0, y0, x1 - x0, y1 - y0
+
+    def __getitem__(self, key):
+        x, y, width, height = self._rect(key)
+        layer = self.drawable
+        if (x, width) == (0, layer.width):
+            row_size = layer.width * layer.bpp
+            return bytes(layer.pixels[y * row_size:(y + height) * row_size])
+        return spr_pixels.crop(layer.pixels, layer.width, x, y, width, height, layer.bpp)
+
+    def __setitem__(self, key, data):
+        x, y, width, height = self._rect(key)
+        layer, bpp = self.drawable, self.drawable.bpp
+        data = bytes(data)
+        if len(data) != width * height * bpp:
+            raise ValueError('pixel data has wrong size')
+        row_size, src_row = layer.width * bpp, width * bpp
+        for row in range(height):
+            pos = (y + row) * row_size + x * bpp
+            layer.pixels[pos:pos + src_row] = data[row * src_row:(row + 1) * src_row]
+
+
+class Layer(_ParasiteOwner):
+    _next_id = 1
+
+    def __init__(self, image, name, width, height, layer_type=RGBA_IMAGE, opacity=100, mode=NORMAL_MODE):
+        _ParasiteOwner.__init__(self)
+        self.image = image
+        self.name = name
+        self.width, self.height = width, height
+        self.type = layer_type
+        self.bpp = BYTES_PER_PIXEL[layer_type]
+        self.has_alpha = layer_type in (RGBA_IMAGE, GRAYA_IMAGE, INDEXEDA_IMAGE)
+        self.opacity = opacity
+        self.mode = mode
+        self.visible = True
+        self.offsets = (0, 0)
+        self.parent = None
+        self.pixels = bytearray(width * height * self.bpp)
+        self.ID = Layer._next_id
+        Layer._next_id += 1
+
+    def get_pixel_rgn(self, x, y, width, height, dirty=True, shadow=False):
+        return PixelRgn(self, x, y, width, height)
+
+    def set_offsets(self, x, y):
+        self.offsets = (x, y)
+
+    def flush(self):
+        pass
+
+    def scale(self, width, height):
+        self.pixels = bytearray(spr_pixels.scale_nearest(self.pixels, self.width, self.height, width, height, self.bpp))
+        self.width, self.height = width, height
+
+
+class GroupLayer(Layer):
+
+    def __init__(self, image):
+        Layer.__init__(self, image, 'Group', 0, 0)
+        self.layers = []
+
+
+class Image(_ParasiteOwner):
+
+    def __init__(self, width, height, base_type=RGB):
+        _ParasiteOwner.__init__(self)
+        self.width, self.height = width, height
+        self.base_type = base_type
+        self.colormap = b''
+        self.layers = []
+        self.filename = None
+
+    def insert_layer(self, layer, parent=None, position=0):
+        pdb.gimp_image_insert_layer(self, layer, parent, position)
+
+    def duplicate(self):
+        raise RuntimeError('Image.duplicate is not supported by the stand-in')
+
+    def clean_all(self):
+        pass
+
+
+class _Pdb(object):
+
+    @staticmethod
+    def gimp_image_insert_layer(image, layer, parent, position):
+        siblings = image.layers if parent is None else parent.layers
+        siblings.insert(max(position, 0), layer)
+        layer.parent = parent
+
+    @staticmethod
+    def gimp_item_is_group(item):
+        return isinstance(item, GroupLayer)
+
+    @staticmethod
+    def gimp_image_scale(image, width, height):
+        for layer in image.layers:
+            layer.scale(layer.width * width // image.width, layer.height * height // image.height)
+        image.width, image.height = width, height
+
+    @staticmethod
+    def gimp_image_delete(image):
+        pass
+
+    def __getattr__(self, name):
+        def procedure(*args):
+            raise RuntimeError('Procedure %s is not supported by the stand-in' % name)
+        return procedure
+
+
+class _Gimp(object):
+    Image = Image
+    Layer = Layer
+    GroupLayer = GroupLayer
+    Parasite = Parasite
+    locale_directory = ''
+
+    @staticmethod
+    def tile_width():
+        return 64
+
+    @staticmethod
+    def tile_height():
+        return 64
+
+    @staticmethod
+    def progress_init(message=None):
+        pass
+
+    @staticmethod
+    def progress_update(fraction):
+        pass
+
+    @staticmethod
+    def message(message):
+        sys.stderr.write('%s\n' % message)
+
+
+gimp = _Gimp()
+pdb = _Pdb()
+
+
+def fail(message):
+    gimp.message(message)
+    raise RuntimeError(message)
+
+
+def register(*args, **kwargs):
+    pass
+
+
+def main():
+    pass
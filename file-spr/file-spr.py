@@ -11,6 +11,12 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from struct import pack, unpack
 from spr import Sprite
+from spr_cache import LRUCache, PaletteCache, ThumbnailCache
+import spr_atlas
+import spr_dds
+import spr_pixels
+import spr_profile
+import spr_workers
 
 t = gettext.translation('gimp20-python', gimp.locale_directory, fallback=True)
 ugettext = t.ugettext
@@ -23,23 +29,38 @@ EDITOR_PROC = 'hl-spr-export-dialog'
 LOAD_PROC = 'file-hl-spr-load'
 LOAD_THUMB_PROC  = 'file-hl-spr-load-thumb'
 SAVE_PROC = 'file-hl-spr-save'
+SHEET_PROC = 'file-hl-spr-save-sheet'
 
+# Number of processes decoding frames on import and encoding DDS frames on export. Worker processes
+# are forked from the plug-in, so the pool is not used on Windows where they would have to start
+# the plug-in script again. Values that are not numbers fall back to 1, so they never break registration.
+WORKERS = 1 if sys.platform == 'win32' else spr_workers.env_workers('HL_SPR_WORKERS')
 
-def load_spr_thumbnail(file_path, thumb_size):
-    img = Sprite.load_from_file(file_path, True)[0]
-    width, height = img.width, img.height
-    scale = float(thumb_size) / max(width, height)
-    if scale and scale != 1.0:
-        width = int(width * scale)
-        height = int(height * scale)
-        pdb.gimp_image_scale(img, width, height)
 
-    return (img, width, height)
+thumbnail_cache = ThumbnailCache()
+palette_cache = PaletteCache()
+
 
+def load_spr_thumbnail(file_path, thumb_size):
+    cached = thumbnail_cache.lookup(file_path, thumb_size)
+    if cached:
+        thumb_path, width, height = cached
+        try:
+            return pdb.file_png_load(thumb_path, thumb_path), width, height
+        except RuntimeError:
+            pass
+    return Sprite.load_thumbnail(file_path, thumb_size, thumbnail_cache)
 
-def load_spr(file_path, raw_filename):
+
+def load_spr(file_path, raw_filename, first_frame=0, frames_count=0, frame_step=0, metadata_only=False):
     try:
-        images = Sprite.load_from_file(file_path)
+        if first_frame < 0 or frames_count < 0 or frame_step < 0:
+            raise ValueError('Frame range must not be negative')
+        # GIMP opens files with the extra arguments set to zero, which loads every frame
+        frame_step = max(frame_step, 1)
+        stop = first_frame + frames_count * frame_step if frames_count else None
+        frames = slice(first_frame, stop, frame_step)
+        images = Sprite.load_from_file(file_path, workers=WORKERS, frames=frames, metadata_only=metadata_only)
         for img in images[:-1]:
             gimp.Display(img)
             gimp.displays_flush()
@@ -48,72 +69,238 @@ def load_spr(file_path, raw_filename):
         fail('Error loading sprite file:\n\n%s!' % e.message)
 
 
-def save_spr(img, drawable, filename, raw_filename):
-    from array import array
+@spr_profile.profiled('make_indexed_copy')
+def make_indexed_copy(img):
+    if img.base_type != INDEXED:
+        return Sprite.make_indexed_image(img, palette_cache)
+    return img.duplicate()
+
+
+def list_frames(img):
+    """
+    Get frame layers in sprite order.
+    :param img: indexed image
+    :return: list of layers with their origins
+    """
+
+    frames = []
+    for l in reversed(img.layers):
+        for f in reversed(l.layers) if pdb.gimp_item_is_group(l) else [l]:
+            parasite_origins = f.parasite_find('spr_origins')
+            if parasite_origins:
+                origin_x, origin_y = unpack('<2i', parasite_origins.data[:8])
+            else:
+                origin_x, origin_y = -f.width // 2, f.height // 2
+            frames.append((f, origin_x, origin_y))
+    return frames
+
+
+def parse_frame_selection(selection, frames_num):
+    """
+    Parse frame selection such as '0-3,5,7-'.
+    :param selection: comma separated frame numbers and ranges, empty selects all frames
+    :param frames_num: number of frames
+    :return: sorted list of frame numbers
+    """
+
+    if not selection or not selection.strip():
+        return list(range(frames_num))
+
+    selected = set()
+    for part in selection.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                first, last = part.split('-', 1)
+                first = int(first) if first.strip() else 0
+                last = int(last) if last.strip() else frames_num - 1
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise ValueError('Invalid frame selection \'%s\'' % part)
+        if first < 0 or last >= frames_num or first > last:
+            raise ValueError('Frame selection \'%s\' is out of range 0-%d' % (part, frames_num - 1))
+        selected.update(range(first, last + 1))
+    return sorted(selected)
+
+
+def export_frames(spr_img, filename, frames, spr_type, texture_format, autocrop=False,
+                  version=Sprite.VERSION_BMP, dds_quality=spr_dds.QUALITY_NORMAL):
+    """
+    Save frame layers to sprite file.
+    :param spr_img: indexed image, any image for version 3 sprites
+    :param filename: sprite file path
+    :param frames: list of layers with their origins
+    :param spr_type: sprite type
+    :param texture_format: sprite texture format
+    :param autocrop: crop frames to their visible pixels
+    :param version: Sprite.VERSION_BMP or Sprite.VERSION_DDS
+    :param dds_quality: encoder quality of version 3 frames
+    """
+
+    layers = []
+    for layer, origin_x, origin_y in frames:
+        origins_data = pack('<2i', origin_x, origin_y)
+        if layer.parasite_find('spr_origins'):
+            layer.parasite_detach('spr_origins')
+        layer.attach_new_parasite('spr_origins', 0, origins_data)
+
+        layers.append(layer)
+
+    # Make grouped layers with parasites
+    grouped_layers, added_layers = [], []
+    for layer in layers:
+        if layer in added_layers:
+            continue
+
+        added_layers.append(layer)
+
+        parent = layer.parent
+        if not parent:
+            grouped_layers.append([layer])
+            continue
+
+        if not parent.parasite_find('spr_type'):
+            parent.attach_new_parasite('spr_type', 1, '')
+
+        group_lst = [ll for ll in layers if ll.parent == parent]
+        for i, ll in enumerate(group_lst):
+            interval = ll.parasite_find('spr_interval')
+            if not interval:
+                ll.attach_new_parasite('spr_interval', 0, pack('<f', (i + 1) * 0.1))
+
+            added_layers.append(ll)
+        grouped_layers.append([parent] + group_lst)
+
+    # Export to file
+    if grouped_layers:
+        Sprite.save_to_file(spr_img, filename, grouped_layers, spr_type, texture_format, autocrop,
+                            version, dds_quality, WORKERS)
+
+
+def image_setting(img, parasite_name, value):
+    """
+    Get sprite type or texture format from the argument of a save procedure.
+    GIMP sets the arguments a caller leaves out to zero, so 0 keeps the value stored in the image
+    and other values are the setting plus one.
+    :param img: image
+    :param parasite_name: 'spr_type' or 'spr_format'
+    :param value: argument value
+    :return: setting value
+    """
+
+    if value > 0:
+        return value - 1
+    parasite = img.parasite_find(parasite_name)
+    return parasite.flags if parasite else 0
+
+
+def save_spr_noninteractive(img, filename, spr_type, texture_format, origin_x, origin_y, frames_selection, autocrop,
+                            version, dds_quality):
+    # DDS frames are encoded from the original colors
+    spr_img = img.duplicate() if version == Sprite.VERSION_DDS else make_indexed_copy(img)
+    try:
+        spr_type = image_setting(spr_img, 'spr_type', spr_type)
+        texture_format = image_setting(spr_img, 'spr_format', texture_format)
+
+        frames = list_frames(spr_img)
+        frames = [(frames[i][0], frames[i][1] + origin_x, frames[i][2] + origin_y)
+                  for i in parse_frame_selection(frames_selection, len(frames))]
+        if not frames:
+            raise ValueError('No frames to export')
+
+        export_frames(spr_img, filename, frames, spr_type, texture_format, autocrop, version, dds_quality)
+    except Exception as e:
+        fail('Error saving sprite file:\n\n%s!' % e)
+    finally:
+        pdb.gimp_image_delete(spr_img)
+
+
+def save_spr_sheet(img, drawable, filename, frame_width, frame_height, frames_count=0, description='',
+                   spr_type=0, texture_format=0):
+    try:
+        spr_type = image_setting(img, 'spr_type', spr_type)
+        texture_format = image_setting(img, 'spr_format', texture_format)
+
+        if description:
+            frames = spr_atlas.json_frames(spr_atlas.load_json(description), drawable.width, drawable.height)
+        else:
+            frames = spr_atlas.grid_frames(drawable.width, drawable.height, frame_width, frame_height, frames_count)
+        Sprite.save_sheet(drawable, filename, frames, spr_type, texture_format)
+    except Exception as e:
+        fail('Error saving sprite sheet:\n\n%s!' % e)
+
+
+def save_spr(run_mode, img, drawable, filename, raw_filename, spr_type=0, texture_format=0,
+             origin_x=0, origin_y=0, frames_selection='', autocrop=False, version=Sprite.VERSION_BMP, dds_quality=0):
+    # Batch runs have no display, so the dialog and thumbnails are skipped
+    if run_mode == RUN_NONINTERACTIVE:
+        version = Sprite.VERSION_DDS if version == Sprite.VERSION_DDS else Sprite.VERSION_BMP
+        # Quality is shifted like the type and format, so the zero GIMP passes for a missing argument is the default
+        dds_quality = dds_quality - 1 if dds_quality > 0 else spr_dds.QUALITY_NORMAL
+        save_spr_noninteractive(img, filename, spr_type, texture_format, origin_x, origin_y, frames_selection,
+                                autocrop, version, dds_quality)
+        return
+
+    import time
     import pygtk
     import gtk
+    import gobject
     pygtk.require('2.0')
 
     THUMB_MAXSIZE = 128
+    THUMB_CACHE_SIZE = 1024
+    THUMB_IDLE_TIME = 0.02
     RESPONSE_EXPORT = 1
     MIN_FRAME_ORIGIN = -8192
     MAX_FRAME_ORIGIN = 8192
     LS_LAYER, LS_PIXBUF, LS_SIZE_INFO, LS_EXPORT, LS_ORIGIN_X, LS_ORIGIN_Y, LS_THUMBDATA = range(7)
 
-    spr_img = img.duplicate()
+    spr_img = make_indexed_copy(img)
     gimpui.gimp_ui_init()
 
-    if spr_img.base_type != INDEXED:
-        try:
-            pdb.gimp_convert_indexed(spr_img, NO_DITHER, MAKE_PALETTE, 256, 0, 0, '')
-        except RuntimeError:
-            # Gimp does not support indexed mode if the image contains layer groups, so delete them
-            for layer in spr_img.layers:
-                if pdb.gimp_item_is_group(layer):
-                    pdb.gimp_image_merge_layer_group(spr_img, layer)
-            pdb.gimp_convert_indexed(spr_img, NO_DITHER, MAKE_PALETTE, 256, 0, 0, '')
-
+    @spr_profile.profiled('make_thumbnail_data')
     def make_thumbnail_data(layer):
         width = layer.width
         height = layer.height
-
-        indices = layer.get_pixel_rgn(0, 0, width, height)[:, :]
-        if layer.type == INDEXEDA_IMAGE:
-            indices = indices[::2]
-        indices = ''.join(i + i for i in indices)
-
-        thumbnail_layer = gimp.Layer(spr_img, layer.name + '_temp', width, height, INDEXEDA_IMAGE, 100, NORMAL_MODE)
-        thumbnail_rgn = thumbnail_layer.get_pixel_rgn(0, 0, width, height)
-        thumbnail_rgn[:, :] = indices
-        pdb.gimp_image_insert_layer(spr_img, thumbnail_layer, None, 0)
-
-        scale = float(THUMB_MAXSIZE) / max(width, height)
-        if scale < 1.0:
-            width = max(int(width * scale), 1)
-            height = max(int(height * scale), 1)
-            pdb.gimp_layer_scale_full(thumbnail_layer, width, height, False, 0)
-
-        width, height, bpp, unused_, tn_data = pdb.gimp_drawable_thumbnail(thumbnail_layer, width, height)
-        spr_img.remove_layer(thumbnail_layer)
-        return str(bytearray(tn_data)), width, height, bpp
-
-    def get_thumbnail(thumbnail_data, texture_format):
-        tn_data, width, height, bpp = thumbnail_data
-
-        last_index = len(spr_img.colormap) // 3 - 1
-
-        if texture_format != Sprite.TEXTURE_FORMAT_INDEXALPHA:
-            tn_data = array('B', tn_data)
-            if texture_format == Sprite.TEXTURE_FORMAT_ADDITIVE:
-                for i in xrange(0, len(tn_data), 4):
-                    tn_data[i + 3] = sum(tn_data[i:i + 3]) // 3
-            elif texture_format == Sprite.TEXTURE_FORMAT_ALPHATEST:
-                for i in xrange(0, len(tn_data), 4):
-                    tn_data[i + 3] = 0xff - (tn_data[i + 3] // last_index * 0xff)
-            else:
-                for i in xrange(0, len(tn_data), 4):
-                    tn_data[i + 3] = 0xff
-            tn_data = tn_data.tostring()
+        tn_width, tn_height = spr_pixels.fit_size(width, height, THUMB_MAXSIZE)
+
+        # Only rows picked by nearest neighbour sampling are read from the layer
+        rgn = layer.get_pixel_rgn(0, 0, width, height, False, False)
+        rows = []
+        for y in range(tn_height):
+            row = rgn[0:width, y * height // tn_height:y * height // tn_height + 1]
+            rows.append(row[::2] if layer.type == INDEXEDA_IMAGE else row)
+
+        indices = spr_pixels.scale_nearest(b''.join(rows), width, tn_height, tn_width, tn_height)
+        return indices, tn_width, tn_height
+
+    thumbnail_cache = LRUCache(THUMB_CACHE_SIZE)
+
+    def get_thumbnail(layer, thumbnail_data, texture_format):
+        key = (layer.ID, texture_format)
+        pixbuf = thumbnail_cache.get(key)
+        if pixbuf is None:
+            pixbuf = make_thumbnail_pixbuf(thumbnail_data, texture_format)
+            thumbnail_cache.put(key, pixbuf)
+        return pixbuf
+
+    placeholders = {}
+
+    def get_placeholder(layer):
+        size = spr_pixels.fit_size(layer.width, layer.height, THUMB_MAXSIZE)
+        pixbuf = placeholders.get(size)
+        if pixbuf is None:
+            pixbuf = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, size[0], size[1])
+            pixbuf.fill(0)
+            placeholders[size] = pixbuf
+        return pixbuf
+
+    def make_thumbnail_pixbuf(thumbnail_data, texture_format):
+        indices, width, height = thumbnail_data
+        tn_data = spr_pixels.render_rgba(indices, texture_format, spr_img.colormap)
 
         return gtk.gdk.pixbuf_new_from_data(
             tn_data,
@@ -121,7 +308,7 @@ def save_spr(img, drawable, filename, raw_filename):
             True,
             8,
             width, height,
-            width * bpp)
+            width * 4)
 
     class ExportDialog(gimpui.Dialog):
 
@@ -136,7 +323,7 @@ def save_spr(img, drawable, filename, raw_filename):
             self.connect('destroy', self.on_destroy)
 
             export_opt_box = self.make_export_options_box()
-            self.img_view_frame = self.make_frames_view(reversed(spr_img.layers))
+            self.img_view_frame = self.make_frames_view(list_frames(spr_img))
 
             hbox = gtk.HBox()
             hbox.pack_start(export_opt_box, True, True, 20)
@@ -151,7 +338,38 @@ def save_spr(img, drawable, filename, raw_filename):
         def update_thumbnails(self):
             texture_format = self.cb_tf.get_active()
             for ls in self.liststore:
-                ls[LS_PIXBUF] = get_thumbnail(ls[LS_THUMBDATA], texture_format)
+                if ls[LS_THUMBDATA] is not None:
+                    ls[LS_PIXBUF] = get_thumbnail(ls[LS_LAYER], ls[LS_THUMBDATA], texture_format)
+
+        def populate_thumbnails(self):
+            deadline = time.time() + THUMB_IDLE_TIME
+            texture_format = self.cb_tf.get_active()
+            while self.pending_thumbnails:
+                path = self.pop_pending_thumbnail().get_path()
+                if path is None:
+                    continue
+
+                row = self.liststore[path]
+                thumbnail_data = make_thumbnail_data(row[LS_LAYER])
+                row[LS_THUMBDATA] = thumbnail_data
+                row[LS_PIXBUF] = get_thumbnail(row[LS_LAYER], thumbnail_data, texture_format)
+
+                if time.time() >= deadline:
+                    return True
+
+            self.thumbnail_source_id = None
+            return False
+
+        def pop_pending_thumbnail(self):
+            # Visible rows first
+            visible_range = self.iconview.get_visible_range()
+            if visible_range:
+                first, last = visible_range
+                for i, row_ref in enumerate(self.pending_thumbnails):
+                    path = row_ref.get_path()
+                    if path is not None and first <= path <= last:
+                        return self.pending_thumbnails.pop(i)
+            return self.pending_thumbnails.pop(0)
 
         def make_export_options_box(self):
             # Sprite type
@@ -234,12 +452,50 @@ def save_spr(img, drawable, filename, raw_filename):
             oo_frame.set_shadow_type(gtk.SHADOW_IN)
             oo_frame.add(box)
 
+            # Auto-crop
+            self.chk_autocrop = gtk.CheckButton('Crop frames')
+            self.chk_autocrop.set_tooltip_text(ugettext('Crop frames to their visible pixels, '
+                                                        'origins are moved so the frames stay in place'))
+
+            # Version and DDS encoder quality
+            self.cb_ver = gtk.combo_box_new_text()
+            self.cb_ver.append_text('Half-Life')
+            self.cb_ver.append_text('CSO (DDS)')
+            self.cb_ver.set_tooltip_text(ugettext('Half-Life sprites have indexed frames, '
+                                                  'Counter-Strike Online sprites have DDS frames'))
+            self.cb_ver.set_active(0)
+
+            self.cb_dq = gtk.combo_box_new_text()
+            self.cb_dq.append_text('Fast')
+            self.cb_dq.append_text('Normal')
+            self.cb_dq.append_text('High')
+            self.cb_dq.set_tooltip_text(ugettext('DDS encoder quality'))
+            self.cb_dq.set_active(spr_dds.QUALITY_NORMAL)
+            self.cb_dq.set_sensitive(False)
+
+            def cb_ver_changed(cb):
+                dds = cb.get_active() == 1
+                self.cb_dq.set_sensitive(dds)
+                self.chk_autocrop.set_sensitive(not dds)
+
+            self.cb_ver.connect('changed', cb_ver_changed)
+
+            box = gtk.VBox(True, 5)
+            box.pack_start(self.cb_ver, False, False)
+            box.pack_start(self.cb_dq, False, False)
+
+            ver_frame = gimpui.Frame('Version:')
+            ver_frame.set_shadow_type(gtk.SHADOW_IN)
+            ver_frame.add(box)
+
             # Main option frame
             o_box = gtk.VBox()
             o_box.set_size_request(110, -1)
+            o_box.pack_start(ver_frame, False, False, 10)
             o_box.pack_start(st_frame, False, False, 10)
             o_box.pack_start(tf_frame, False, False, 10)
             o_box.pack_start(oo_frame, False, False, 10)
+            o_box.pack_start(self.chk_autocrop, False, False, 10)
 
             box = gtk.VBox()
             box.set_size_request(140, -1)
@@ -247,24 +503,15 @@ def save_spr(img, drawable, filename, raw_filename):
 
             return box
 
-        def make_frames_view(self, layers):
-            import gobject
-
-            texture_format = self.cb_tf.get_active()
+        def make_frames_view(self, frames):
             self.liststore = gtk.ListStore(gobject.TYPE_PYOBJECT, gtk.gdk.Pixbuf, str, gobject.TYPE_BOOLEAN,
                                            gobject.TYPE_INT, gobject.TYPE_INT, gobject.TYPE_PYOBJECT)
-            for l in layers:
-                frames = [gl for gl in reversed(l.layers)] if pdb.gimp_item_is_group(l) else [l]
-                for f in frames:
-                    thumbnail_data = make_thumbnail_data(f)
-                    pixbuf = get_thumbnail(thumbnail_data, texture_format)
-                    size_info = '<b>Size</b>: %d x %d' % (f.width, f.height)
-                    parasite_origins = f.parasite_find('spr_origins')
-                    if parasite_origins:
-                        origin_x, origin_y = unpack('<2i', parasite_origins.data[:8])
-                    else:
-                        origin_x, origin_y = -f.width // 2, f.height // 2
-                    self.liststore.append([f, pixbuf, size_info, True, origin_x, origin_y, thumbnail_data])
+            self.pending_thumbnails = []
+            for f, origin_x, origin_y in frames:
+                pixbuf = get_placeholder(f)
+                size_info = '<b>Size</b>: %d x %d' % (f.width, f.height)
+                row = self.liststore.append([f, pixbuf, size_info, True, origin_x, origin_y, None])
+                self.pending_thumbnails.append(gtk.TreeRowReference(self.liststore, self.liststore.get_path(row)))
 
             self.export_frames_num = len(self.liststore)
             self.iconview = gtk.TreeView(self.liststore)
@@ -376,52 +623,30 @@ def save_spr(img, drawable, filename, raw_filename):
             frame_imgs.add(scrl_win)
             frame_imgs.set_size_request(535, -1)
 
+            # Thumbnails are made while the dialog is idle
+            self.thumbnail_source_id = gobject.idle_add(self.populate_thumbnails)
+
             return frame_imgs
 
         def export_selected_frames(self):
-            layers = []
-            for row in self.liststore:
-                if not row[LS_EXPORT]:
-                    continue
-
-                layer = row[LS_LAYER]
-                origins_data = pack('<2i', row[LS_ORIGIN_X], row[LS_ORIGIN_Y])
-                if layer.parasite_find('spr_origins'):
-                    layer.parasite_detach('spr_origins')
-                layer.attach_new_parasite('spr_origins', 0, origins_data)
-
-                layers.append(layer)
-
-            # Make grouped layers with parasites
-            grouped_layers, added_layers = [], []
-            for layer in layers:
-                if layer in added_layers:
-                    continue
-
-                added_layers.append(layer)
-
-                parent = layer.parent
-                if not parent:
-                    grouped_layers.append([layer])
-                    continue
-
-                if not parent.parasite_find('spr_type'):
-                    parent.attach_new_parasite('spr_type', 1, '')
-
-                group_lst = [ll for ll in layers if ll.parent == parent]
-                for i, ll in enumerate(group_lst):
-                    interval = ll.parasite_find('spr_interval')
-                    if not interval:
-                        ll.attach_new_parasite('spr_interval', 0, pack('<f', (i + 1) * 0.1))
-
-                    added_layers.append(ll)
-                grouped_layers.append([parent] + group_lst)
-
-            # Export to file
-            if grouped_layers:
-                Sprite.save_to_file(spr_img, filename, grouped_layers,
-                                    self.cb_st.get_active(),
-                                    self.cb_tf.get_active())
+            frames = [(row[LS_LAYER], row[LS_ORIGIN_X], row[LS_ORIGIN_Y]) for row in self.liststore if row[LS_EXPORT]]
+            if self.cb_ver.get_active() != 1:
+                export_frames(spr_img, filename, frames, self.cb_st.get_active(), self.cb_tf.get_active(),
+                              self.chk_autocrop.get_active())
+                return
+
+            # DDS frames are encoded from the original colors, the layers of the indexed copy
+            # are matched to the layers of an image copy by their position
+            export_img = spr_img if img.base_type == INDEXED else img.duplicate()
+            try:
+                positions = dict((f.ID, i) for i, (f, _, _) in enumerate(list_frames(spr_img)))
+                layers = [f for f, _, _ in list_frames(export_img)]
+                frames = [(layers[positions[f.ID]], origin_x, origin_y) for f, origin_x, origin_y in frames]
+                export_frames(export_img, filename, frames, self.cb_st.get_active(), self.cb_tf.get_active(),
+                              version=Sprite.VERSION_DDS, dds_quality=self.cb_dq.get_active())
+            finally:
+                if export_img is not spr_img:
+                    pdb.gimp_image_delete(export_img)
 
         def set_btn_export_sensitive(self, sensitive):
             self.get_widget_for_response(RESPONSE_EXPORT).set_sensitive(sensitive)
@@ -435,13 +660,19 @@ def save_spr(img, drawable, filename, raw_filename):
                 self.export_selected_frames()
                 
         def on_destroy(self, widget):
+            if self.thumbnail_source_id is not None:
+                gobject.source_remove(self.thumbnail_source_id)
+                self.thumbnail_source_id = None
             gtk.main_quit()
 
         def run(self):
             self.show()
             gtk.main()
 
-    ExportDialog().run()
+    with spr_profile.phase('export_dialog'):
+        with spr_profile.phase('construct', frames=len(spr_img.layers)):
+            dialog = ExportDialog()
+        dialog.run()
     pdb.gimp_image_delete(spr_img)
 
 
@@ -488,6 +719,11 @@ register(
     [
         (PF_STRING, 'filename', 'The name of the file to load', None),
         (PF_STRING, 'raw-filename', 'The name entered', None),
+        (PF_INT, 'first-frame', 'First frame to load', 0),
+        (PF_INT, 'frames-count', 'Number of frames to load, every n-th frame counts once, 0 for all frames', 0),
+        (PF_INT, 'frame-step', 'Load every n-th frame, 0 or 1 for every frame', 0),
+        (PF_BOOL, 'metadata-only', 'Make empty layers with frame origins and intervals, pixels are not loaded; '
+                                   'the sprite file is kept and its pixels are used on export', False),
     ],
     [(PF_IMAGE, 'image', 'Output image')],
     load_spr,
@@ -505,15 +741,56 @@ register(
     'Half-Life sprite',
     '*',
     [
+        (PF_INT, 'run-mode', 'The run mode { RUN-INTERACTIVE (0), RUN-NONINTERACTIVE (1) }', None),
         (PF_IMAGE, 'image', 'Input image', None),
         (PF_DRAWABLE, 'drawable', 'Input drawable', None),
         (PF_STRING, 'filename', 'The name of the file', None),
         (PF_STRING, 'raw-filename', 'The name of the file', None),
+        (PF_INT, 'spr-type', 'Sprite type { KEEP (0), VP-PARALLEL-UPRIGHT (1), FACING-UPRIGHT (2), VP-PARALLEL (3), '
+                             'ORIENTED (4), VP-PARALLEL-ORIENTED (5) }, 0 keeps the type of the image', 0),
+        (PF_INT, 'texture-format', 'Texture format { KEEP (0), NORMAL (1), ADDITIVE (2), INDEXALPHA (3), '
+                                   'ALPHATEST (4) }, 0 keeps the format of the image', 0),
+        (PF_INT, 'origin-x', 'Offset added to origin X of every frame', 0),
+        (PF_INT, 'origin-y', 'Offset added to origin Y of every frame', 0),
+        (PF_STRING, 'frames', 'Frames to export, such as "0-3,5,7-", empty for all frames', ''),
+        (PF_BOOL, 'autocrop', 'Crop frames to their visible pixels', False),
+        (PF_INT, 'version', 'Sprite version { HALF-LIFE (2), COUNTER-STRIKE-ONLINE-DDS (3) }', 2),
+        (PF_INT, 'dds-quality', 'Encoder quality of version 3 frames { DEFAULT (0), FAST (1), NORMAL (2), HIGH (3) }, '
+                                '0 is normal', 0),
     ],
     [],
     save_spr,
     on_query=register_save_handlers,
-    menu='<Save>'
+    menu='<Save>',
+    run_mode_param = False
+)
+
+register(
+    SHEET_PROC,
+    'Saves sprite sheet layer as Half-Life sprite (.spr)',
+    'Cuts the active layer into frames by a grid or by a JSON description of the sheet '
+    'and writes them to a sprite without making a layer per frame.',
+    AUTHOR,
+    COPYRIGHT,
+    COPYRIGHT_YEAR,
+    'Half-Life sprite from sheet...',
+    '*',
+    [
+        (PF_IMAGE, 'image', 'Input image', None),
+        (PF_DRAWABLE, 'drawable', 'Sprite sheet layer', None),
+        (PF_STRING, 'filename', 'The name of the sprite file', 'sprite.spr'),
+        (PF_INT, 'frame-width', 'Width of grid cells', 64),
+        (PF_INT, 'frame-height', 'Height of grid cells', 64),
+        (PF_INT, 'frames-count', 'Number of grid frames, 0 for all cells', 0),
+        (PF_STRING, 'description', 'JSON description of the frames, empty to cut the sheet by the grid', ''),
+        (PF_INT, 'spr-type', 'Sprite type { KEEP (0), VP-PARALLEL-UPRIGHT (1), FACING-UPRIGHT (2), VP-PARALLEL (3), '
+                             'ORIENTED (4), VP-PARALLEL-ORIENTED (5) }, 0 keeps the type of the image', 0),
+        (PF_INT, 'texture-format', 'Texture format { KEEP (0), NORMAL (1), ADDITIVE (2), INDEXALPHA (3), '
+                                   'ALPHATEST (4) }, 0 keeps the format of the image', 0),
+    ],
+    [],
+    save_spr_sheet,
+    menu='<Image>/File/Export'
 )
 
 main()
@@ -2,262 +2,601 @@ from gimpfu import *
 
 from collections import namedtuple
 from struct import pack, unpack
-from math import sqrt
+import hashlib
 import os
 
+from spr_codec import SpriteCodec, SpriteReader, SpriteWriter, _PATH_TYPES
+import spr_atlas
+import spr_dds
+import spr_pixels
+import spr_png
+import spr_profile
+import spr_quantize
+import spr_workers
 
-class Sprite:
-    MAGIC = 'IDSP'
-    VERSION_BMP, VERSION_DDS = 0x2, 0x3
-    VERSIONS = (VERSION_BMP, VERSION_DDS)
-
-    HEADER_STRUCT = '<4s3If3IfI'
-    FRAME_PARAMS_STRUCT = '<2i2I'
-
-    TEXTURE_FORMAT_NORMAL, TEXTURE_FORMAT_ADDITIVE, TEXTURE_FORMAT_INDEXALPHA, TEXTURE_FORMAT_ALPHATEST = range(4)
-    FRAME_TYPE_SINGLE, FRAME_TYPE_GROUP, FRAME_TYPE_ANGLED = range(3)
-
-    SprHeader = namedtuple('SprHeader', [
-        'magic',
-        'version',
-        'type',
-        'format',
-        'radius',
-        'max_width',
-        'max_height',
-        'frames_number',
-        'beam_length',
-        'synch_type'
-    ])
-
-    FrameData = namedtuple('FrameData', [
-        'type',
-        'group_len',
-        'intervals',
-        'params',
-        'indices'
-    ])
-
-    FrameParams = namedtuple('FrameParams', [
-        'origin_x',
-        'origin_y',
-        'width',
-        'height'
-    ])
+
+class Sprite(SpriteCodec):
+    """
+    GIMP adapter for SpriteCodec: builds images and layers from sprite frames and back.
+    """
+
+    PALETTE_PARASITE = 'spr_palette'
+    FRAME_PARASITE = 'spr_frame'
+    PARTIAL_PARASITE = 'spr_partial'
+
+    PARTIAL_STRUCT = '<2I3i'
+    PARTIAL_SIZE = 20
+
+    PartialSource = namedtuple('PartialSource', ['path', 'frames_number', 'metadata_only', 'loaded'])
 
     @staticmethod
-    def load_from_file(file_path, last_dds_frame=False):
+    def load_from_file(source, last_dds_frame=False, workers=1, frames=None, metadata_only=False):
         """
         Load Sprite from file.
-        :param file_path: path to the sprite file
+        Every frame layer gets its frame number in a parasite. Images with a part of the frames or
+        without pixels remember the sprite file and the loaded range, so the frames that were not loaded
+        are merged back on export.
+        :param source: path to the sprite file, bytes-like object or seekable binary file object
         :param last_dds_frame: load only last dds frame if available
+        :param workers: number of processes decoding frames
+        :param frames: slice of frame numbers to load, all frames if None
+        :param metadata_only: make empty layers with frame parasites instead of decoding pixels
         :return: gimp images
         """
 
-        fd = open(file_path, 'rb')
-        header = Sprite._read_header(fd)
+        with spr_profile.phase('load_from_file') as load_phase, SpriteReader(source) as reader:
+            header = reader.header
+
+            if header.version == Sprite.VERSION_BMP:
+                numbers = Sprite._select_frames(header.frames_number, frames)
+                load_phase.add(frames=len(numbers), bytes=reader.size)
+                with spr_profile.phase('parse', frames=len(numbers)):
+                    frame_data = [reader.frame(i) for i in numbers]
+                image = Sprite._make_image(header, reader.palette, frame_data, workers, numbers, metadata_only)
+
+                if len(numbers) < header.frames_number or metadata_only:
+                    path = os.path.abspath(source) if isinstance(source, _PATH_TYPES) else ''
+                    if not isinstance(path, bytes):
+                        path = path.encode('utf-8')
+                    loaded_range = (frames or slice(None)).indices(header.frames_number)
+                    image.attach_new_parasite(Sprite.PARTIAL_PARASITE, PARASITE_PERSISTENT,
+                                              pack(Sprite.PARTIAL_STRUCT, header.frames_number, metadata_only,
+                                                   *loaded_range) + path)
+                image.clean_all()
+                images = [image]
+
+            elif header.version == Sprite.VERSION_DDS:
+                dds_frames = reader.dds_frames()
+                if last_dds_frame:
+                    numbers = [len(dds_frames) - 1]
+                else:
+                    numbers = Sprite._select_frames(len(dds_frames), frames)
+                load_phase.add(frames=len(numbers), bytes=reader.size)
+
+                images = Sprite._load_dds_frames([dds_frames[i] for i in numbers], workers, numbers, metadata_only)
+                for img in images:
+                    img.attach_new_parasite('spr_type', header.type, '')
+                    img.attach_new_parasite('spr_format', header.format, '')
+
+        return images
+
+    @staticmethod
+    def partial_source(image):
+        """
+        Get the sprite file frames missing in a partially loaded image come from.
+        :param image: gimp image
+        :return: PartialSource or None if the image was loaded with every frame
+        """
 
-        if header.version == Sprite.VERSION_BMP:
-            palette = Sprite._read_palette(fd)
-            frames = [Sprite._read_frame(fd) for _ in range(header.frames_number)]
-            image = Sprite._make_image(header, palette, frames)
-            # image.filename = os.path.basename(file_path)
-            image.clean_all()
-            images = [image]
+        parasite = image.parasite_find(Sprite.PARTIAL_PARASITE)
+        if not parasite:
+            return None
+        frames_number, metadata_only, start, stop, step = unpack(Sprite.PARTIAL_STRUCT,
+                                                                 parasite.data[:Sprite.PARTIAL_SIZE])
+        path = parasite.data[Sprite.PARTIAL_SIZE:]
+        if str is not bytes:
+            path = path.decode('utf-8')
+        return Sprite.PartialSource(path, frames_number, bool(metadata_only), set(range(start, stop, step)))
 
-        elif header.version == Sprite.VERSION_DDS:
-            dds_frames = Sprite._read_dds_frames(fd, header.frames_number)
+    @staticmethod
+    def _select_frames(frames_num, frames):
+        numbers = list(range(frames_num))
+        if frames is not None:
+            numbers = numbers[frames]
+        if not numbers:
+            raise ValueError('No frames are selected of %d' % frames_num)
+        return numbers
 
-            if last_dds_frame:
-                dds_frames = dds_frames[-1:]
+    @staticmethod
+    @spr_profile.profiled('load_thumbnail')
+    def load_thumbnail(file_path, thumb_size, cache=None):
+        """
+        Load a single frame of Sprite scaled down to thumbnail size.
+        :param file_path: path to the sprite file
+        :param thumb_size: preferred thumbnail size
+        :param cache: ThumbnailCache the thumbnail is stored to
+        :return: gimp image, sprite width and height
+        """
 
-            images = Sprite._load_dds_frames(dds_frames)
-            for img in images:
-                img.attach_new_parasite('spr_type', header.type, '')
-                img.attach_new_parasite('spr_format', header.format, '')
+        with SpriteReader(file_path) as reader:
+            header = reader.header
 
-        return images
+            if header.version == Sprite.VERSION_DDS:
+                img = Sprite._load_dds_frames([reader.dds_frame(-1)])[0]
+                width, height = spr_pixels.fit_size(img.width, img.height, thumb_size)
+                if (width, height) != (img.width, img.height):
+                    pdb.gimp_image_scale(img, width, height)
+
+                layer = img.layers[0]
+                if cache is not None and layer.bpp in (3, 4):
+                    color_type = spr_png.COLOR_TYPE_RGB if layer.bpp == 3 else spr_png.COLOR_TYPE_RGBA
+                    rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height)
+                    cache.store(file_path, thumb_size, header.max_width, header.max_height,
+                                layer.width, layer.height, rgn[:, :], color_type=color_type)
+                return img, header.max_width, header.max_height
+
+            fr = reader.frame(0)
+            if fr.type == Sprite.FRAME_TYPE_SINGLE:
+                params, indices = fr.params, fr.indices
+            else:
+                params, indices = fr.params[0], fr.indices[0]
+
+            width, height = spr_pixels.fit_size(params.width, params.height, thumb_size)
+            indices = spr_pixels.scale_nearest(indices, params.width, params.height, width, height)
+            del fr
+
+        if cache is not None:
+            palette_size = len(reader.palette) // 3
+            transparency = spr_pixels.alpha_table(header.format, palette_size)
+            if transparency is not None:
+                transparency = transparency[:palette_size]
+            cache.store(file_path, thumb_size, header.max_width, header.max_height, width, height, indices,
+                        palette=reader.palette, transparency=transparency)
+
+        thumb_header = header._replace(max_width=width, max_height=height, frames_number=1)
+        thumb_frame = Sprite.FrameData(Sprite.FRAME_TYPE_SINGLE, 0, None,
+                                       params._replace(width=width, height=height), indices)
+        img = Sprite._make_image(thumb_header, reader.palette, [thumb_frame])
+        return img, header.max_width, header.max_height
 
     @staticmethod
     def save_to_file(image, file_path, grouped_layers,
-                     spr_type=0, texture_format=0):
+                     spr_type=0, texture_format=0, autocrop=False,
+                     version=SpriteCodec.VERSION_BMP, dds_quality=spr_dds.QUALITY_NORMAL, workers=1):
         """
         Save Sprite to file.
+        Frames that were not loaded into a partially loaded image are copied from its sprite file to their
+        places between the selected frames, loaded frames that are not selected are left out.
         :param image: gimp image
         :param file_path: path to the output file
         :param grouped_layers: selected list of grouped layers with parasites
         :param spr_type: sprite type
         :param texture_format: sprite texture format
+        :param autocrop: crop frames to their visible pixels
+        :param version: VERSION_BMP or VERSION_DDS
+        :param dds_quality: encoder quality of VERSION_DDS frames, one of spr_dds.QUALITY_*
+        :param workers: number of processes encoding VERSION_DDS frames
         """
 
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        fd = open(file_path, 'wb')
-
-        frames_num = len(grouped_layers)
-        max_width = image.width
-        max_height = image.height
-        radius = sqrt((max_width >> 1) * (max_width >> 1) + (max_height >> 1) * (max_height >> 1))
-
-        header = Sprite.SprHeader(Sprite.MAGIC, Sprite.VERSION_BMP, spr_type, texture_format,
-                                  radius, max_width, max_height, frames_num, 0, 1)
-
-        gimp.progress_init('Preparing %d %s' % (frames_num, 'frame' if frames_num == 1 else 'frames'))
-        frames = []
-        for i, gl in enumerate(grouped_layers):
-            gl_len = len(gl)
-            if gl_len > 1:
-                frame_type = gl[0].parasite_find('spr_type').flags
-                group_len = gl_len - 1
-                intervals, params, indices = [], [], []
-                for sub_l in gl[1:]:
-                    intervals.append(unpack('<f', sub_l.parasite_find('spr_interval').data[:4])[0])
-                    params.append(Sprite._make_frame_params(sub_l))
-                    indices.append(Sprite._make_frame_indices(sub_l))
+        if version == Sprite.VERSION_DDS:
+            Sprite._save_dds_frames(image, file_path, grouped_layers, spr_type, texture_format, dds_quality, workers)
+            return
+
+        partial = Sprite.partial_source(image)
+        reader = Sprite._open_partial_source(image, partial) if partial else None
+        try:
+            if reader is None:
+                frames = [(gl, None) for gl in grouped_layers]
             else:
-                frame_type = Sprite.FRAME_TYPE_SINGLE
-                group_len = 0
-                intervals = None
-                params = Sprite._make_frame_params(gl[0])
-                indices = Sprite._make_frame_indices(gl[0])
+                frames = Sprite._merge_frames(grouped_layers, partial)
+
+            frames_num = len(frames)
+            header = Sprite.make_header(image.width, image.height, frames_num, spr_type, texture_format)
+
+            opacity_table = spr_pixels.opacity_table(texture_format, image.colormap) if autocrop else None
+
+            gimp.progress_init('Writing %d %s' % (frames_num, 'frame' if frames_num == 1 else 'frames'))
+            with spr_profile.phase('save_to_file', frames=frames_num) as save_phase:
+                writer = SpriteWriter(file_path, header, image.colormap)
+                try:
+                    for i, (gl, number) in enumerate(frames):
+                        with spr_profile.phase('read_pixels', frames=max(len(gl or ()) - 1, 1)):
+                            if gl is None:
+                                frame = Sprite._crop_frame(reader.frame(number), opacity_table)
+                            elif number is not None and partial.metadata_only:
+                                frame = Sprite._make_frame_from_metadata(gl, reader.frame(number))
+                                frame = Sprite._crop_frame(frame, opacity_table)
+                            else:
+                                frame = Sprite._make_frame(gl, opacity_table)
+                        with spr_profile.phase('write'):
+                            writer.write_frame(frame)
+                        del frame
+                        gimp.progress_update(i / float(frames_num))
+                except Exception:
+                    writer.abort()
+                    raise
+
+                # The sprite may replace its own source, which must not stay mapped then
+                if reader is not None:
+                    reader.close()
+                writer.commit()
+                save_phase.add(bytes=os.path.getsize(file_path))
+        finally:
+            if reader is not None:
+                reader.close()
 
-            frames.append(Sprite.FrameData(frame_type, group_len, intervals, params, indices))
-            gimp.progress_update(i / float(frames_num))
+    @staticmethod
+    def save_sheet(drawable, file_path, frames, spr_type=0, texture_format=0):
+        """
+        Save frames cut from a sprite sheet layer to file, no layer is made per frame.
+        The layer is read once, RGB and grayscale sheets are converted to one palette.
+        :param drawable: gimp layer with the sheet
+        :param file_path: path to the output file
+        :param frames: list of spr_atlas.AtlasFrame, rects are relative to the layer
+        :param spr_type: sprite type
+        :param texture_format: sprite texture format
+        """
 
-        gimp.progress_update(0.0)
-        gimp.progress_init('Writing header')
-        Sprite._write_header(fd, header)
+        width, height = drawable.width, drawable.height
+        with spr_profile.phase('save_sheet', frames=len(frames)) as save_phase:
+            with spr_profile.phase('read_pixels', bytes=width * height * drawable.bpp):
+                data = drawable.get_pixel_rgn(0, 0, width, height, False, False)[:, :]
 
-        gimp.progress_init('Writing palette')
-        Sprite._write_palette(fd, image.colormap)
+            if drawable.type in (INDEXED_IMAGE, INDEXEDA_IMAGE):
+                indices = data[::2] if drawable.type == INDEXEDA_IMAGE else data
+                palette = drawable.image.colormap
+            else:
+                with spr_profile.phase('quantize'):
+                    rgb, alpha = spr_quantize.split_alpha(data, drawable.bpp)
+                    step = spr_quantize.sample_step(width * height)
+                    palette = spr_quantize.median_cut(spr_quantize.color_histogram(rgb, alpha, step))
+                    indices = spr_quantize.map_colors(rgb, palette)
+            del data
 
-        gimp.progress_init('Writing %d %s' % (frames_num, 'frame' if frames_num == 1 else 'frames'))
-        for i, fr in enumerate(frames):
-            Sprite._write_frame(fd, fr)
-            gimp.progress_update(i / float(frames_num))
+            with spr_profile.phase('write'):
+                spr_atlas.write_sprite(file_path, width, indices, palette, frames, spr_type, texture_format)
+            save_phase.add(bytes=os.path.getsize(file_path))
 
     @staticmethod
-    def _read_header(fd):
-        header = Sprite.SprHeader(*unpack(Sprite.HEADER_STRUCT, fd.read(40)))
-        if header.magic != Sprite.MAGIC:
-            raise ImportError('Invalid spr file')
-        if header.version not in Sprite.VERSIONS:
-            raise ImportError('Invalid spr version: %d' % header.version)
-        if header.frames_number < 1:
-            raise ImportError('Invalid number of frames: %d' % header.frames_number)
-        return header
+    def _open_partial_source(image, partial):
+        if not partial.path or not os.path.isfile(partial.path):
+            raise ValueError('Frames that were not loaded can not be copied, the sprite file %s is missing'
+                             % partial.path)
+
+        reader = SpriteReader(partial.path)
+        header = reader.header
+        if header.version != Sprite.VERSION_BMP or header.frames_number != partial.frames_number:
+            reader.close()
+            raise ValueError('Frames that were not loaded can not be copied, %s was changed' % partial.path)
+        if image.colormap != reader.palette:
+            reader.close()
+            raise ValueError('Frames that were not loaded can not be copied, the palette was changed')
+        return reader
 
     @staticmethod
-    def _write_header(fd, header):
-        fd.write(pack(Sprite.HEADER_STRUCT, *header[:]))
+    def _merge_frames(grouped_layers, partial):
+        # Selected frames keep their order, frames that were not loaded are put back before the next loaded frame
+        # that follows them in the sprite, which is possible only while loaded frames keep the sprite order
+        def missing_frames(stop):
+            return [(None, number) for number in range(next_number, stop) if number not in partial.loaded]
+
+        frames, seen, next_number = [], set(), 0
+        for gl in grouped_layers:
+            parasite = gl[0].parasite_find(Sprite.FRAME_PARASITE)
+            number = unpack('<I', parasite.data[:4])[0] if parasite else None
+            if number is None or number not in partial.loaded or number in seen:
+                if partial.metadata_only:
+                    raise ValueError('Frames can not be added to a sprite loaded without pixels')
+                frames.append((gl, None))
+                continue
+            if number < next_number:
+                raise ValueError('%s is moved before frames that follow it in the sprite, frames that were not '
+                                 'loaded can not be placed, load every frame to reorder them' % gl[0].name)
+
+            frames.extend(missing_frames(number))
+            frames.append((gl, number))
+            seen.add(number)
+            next_number = number + 1
+
+        frames.extend(missing_frames(partial.frames_number))
+        return frames
 
     @staticmethod
-    def _read_palette(fd):
-        pal_size = unpack('<H', fd.read(2))[0]
-        return fd.read(pal_size * 3)
+    def _crop_frame(fr, opacity_table):
+        if opacity_table is None:
+            return fr
+        if fr.type == Sprite.FRAME_TYPE_SINGLE:
+            params, indices = spr_pixels.crop_frame(fr.params, fr.indices, opacity_table)
+            return fr._replace(params=params, indices=indices)
 
-    @staticmethod
-    def _write_palette(fd, palette):
-        fd.write(pack('<H', len(palette) // 3))
-        fd.write(palette)
+        cropped = [spr_pixels.crop_frame(p, i, opacity_table) for p, i in zip(fr.params, fr.indices)]
+        return fr._replace(params=[p for p, _ in cropped], indices=[i for _, i in cropped])
 
     @staticmethod
-    def _read_frame(fd):
-        frame_type = unpack('<I', fd.read(4))[0]
-        if frame_type == Sprite.FRAME_TYPE_SINGLE:
-            group_len = 0
-            intervals = None
-            params = Sprite._read_frame_params(fd)
-            indices = fd.read(params.width * params.height)
+    def _make_frame_from_metadata(gl, fr):
+        # Pixels were not loaded, so they are kept and only origins and intervals are taken from the layers
+        if fr.type == Sprite.FRAME_TYPE_SINGLE:
+            layers = gl[:1]
         else:
-            group_len = unpack('<I', fd.read(4))[0]
-            intervals = unpack('<%df' % group_len, fd.read(group_len * 4))
-            params, indices = [], []
-            for _ in range(group_len):
-                p = Sprite._read_frame_params(fd)
-                params.append(p)
-                indices.append(fd.read(p.width * p.height))
+            layers = gl[1:]
+            if len(layers) != fr.group_len:
+                raise ValueError('%s has %d sub-frames, the group in the sprite has %d'
+                                 % (gl[0].name, len(layers), fr.group_len))
 
-        return Sprite.FrameData(frame_type, group_len, intervals, params, indices)
+        params = []
+        for layer, frame_params in zip(layers, [fr.params] if fr.type == Sprite.FRAME_TYPE_SINGLE else fr.params):
+            origin_x, origin_y = unpack('<2i', layer.parasite_find('spr_origins').data[:8])
+            params.append(frame_params._replace(origin_x=origin_x, origin_y=origin_y))
 
-    @staticmethod
-    def _write_frame(fd, frame):
-        fd.write(pack('<I', frame.type))
-        if frame.type == Sprite.FRAME_TYPE_SINGLE:
-            Sprite._write_frame_params(fd, frame.params)
-            fd.write(frame.indices)
-        else:
-            fd.write(pack('<I', frame.group_len))
-            fd.write(pack('<%df' % len(frame.intervals), *frame.intervals))
-            for i in range(frame.group_len):
-                Sprite._write_frame_params(fd, frame.params[i])
-                fd.write(frame.indices[i])
+        if fr.type == Sprite.FRAME_TYPE_SINGLE:
+            return fr._replace(params=params[0])
+        intervals = [unpack('<f', layer.parasite_find('spr_interval').data[:4])[0] for layer in layers]
+        return fr._replace(params=params, intervals=intervals)
 
     @staticmethod
-    def _read_frame_params(fd):
-        return Sprite.FrameParams(*unpack(Sprite.FRAME_PARAMS_STRUCT, fd.read(16)))
+    def _save_dds_frames(image, file_path, grouped_layers, spr_type, texture_format, quality, workers):
+        # Version 3 frames have no origins and groups, every layer of a group becomes a frame
+        layers = [layer for gl in grouped_layers for layer in (gl[1:] or gl)]
+        frames_num = len(layers)
+        header = Sprite.make_header(image.width, image.height, frames_num, spr_type, texture_format,
+                                    Sprite.VERSION_DDS)
+        palette = image.colormap if image.base_type == INDEXED else None
+
+        def read_layer(layer):
+            data = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)[:, :]
+            return layer.width, layer.height, spr_pixels.layer_rgba(data, layer.bpp, palette), None, quality
+
+        jobs = (read_layer(layer) for layer in layers)
+        if workers > 1:
+            # The pool takes jobs in another thread, but GIMP may be called only from this one
+            jobs = list(jobs)
+        encoded = spr_workers.imap(spr_dds.encode, jobs, workers)
+
+        gimp.progress_init('Encoding %d %s' % (frames_num, 'frame' if frames_num == 1 else 'frames'))
+        try:
+            with spr_profile.phase('save_to_file', frames=frames_num) as save_phase:
+                with SpriteWriter(file_path, header) as writer:
+                    for i in range(frames_num):
+                        with spr_profile.phase('encode', frames=1):
+                            data = next(encoded)
+                        with spr_profile.phase('write', bytes=len(data)):
+                            writer.write_dds_frame(data)
+                        gimp.progress_update(i / float(frames_num))
+                save_phase.add(bytes=os.path.getsize(file_path))
+        finally:
+            encoded.close()
 
     @staticmethod
-    def _write_frame_params(fd, params):
-        fd.write(pack(Sprite.FRAME_PARAMS_STRUCT, *params[:]))
-
-    @staticmethod
-    def _make_image(header, palette, frames):
+    def make_indexed_image(image, palette_cache=None):
+        """
+        Make indexed copy of RGB or grayscale image with one palette for all frames, layer groups are kept.
+        Layers are read in strips of tile height, once for the palette and once for mapping the colors.
+        The palette is kept in a parasite of the copy and in the palette cache, so it is made again only
+        if pixels are changed.
+        :param image: gimp image
+        :param palette_cache: PaletteCache or None
+        :return: indexed gimp image
+        """
 
-        def make_pixel_data(indices):
-            if header.format == Sprite.TEXTURE_FORMAT_INDEXALPHA:
-                return ''.join(i + i for i in indices)
+        def iter_layers(layers):
+            for layer in layers:
+                if pdb.gimp_item_is_group(layer):
+                    for sub_layer in iter_layers(layer.layers):
+                        yield sub_layer
+                else:
+                    yield layer
+
+        def copy_props(layer, new_layer):
+            new_layer.name = layer.name
+            new_layer.opacity = layer.opacity
+            new_layer.mode = layer.mode
+            new_layer.visible = layer.visible
+            new_layer.set_offsets(*layer.offsets)
+            for name in layer.parasite_list():
+                new_layer.parasite_attach(layer.parasite_find(name))
+
+        def copy_layers(items, parent):
+            for position, layer in enumerate(items):
+                if pdb.gimp_item_is_group(layer):
+                    new_layer = gimp.GroupLayer(indexed)
+                    pdb.gimp_image_insert_layer(indexed, new_layer, parent, position)
+                    copy_layers(layer.layers, new_layer)
+                else:
+                    layer_type = INDEXEDA_IMAGE if layer.bpp in (2, 4) else INDEXED_IMAGE
+                    new_layer = gimp.Layer(indexed, layer.name, layer.width, layer.height, layer_type, 100,
+                                           NORMAL_MODE)
+                    rgn = new_layer.get_pixel_rgn(0, 0, layer.width, layer.height)
+                    for top, rows, data in Sprite.iter_layer_pixels(layer):
+                        rgb, alpha = spr_quantize.split_alpha(data, layer.bpp)
+                        indices = spr_quantize.map_colors(rgb, palette)
+                        rgn[0:layer.width, top:top + rows] = \
+                            indices if alpha is None else spr_pixels.interleave(indices, alpha)
+                    new_layer.flush()
+                    pdb.gimp_image_insert_layer(indexed, new_layer, parent, position)
+
+                    copied.append(layer)
+                    gimp.progress_update(len(copied) / float(len(layers)))
+                copy_props(layer, new_layer)
+
+        layers = list(iter_layers(image.layers))
+
+        # Pixels are sampled in the pass that hashes them, so a changed image is not read again for its colors.
+        # Samples are only counted if the palette is not cached.
+        gimp.progress_init('Making palette')
+        step = spr_quantize.sample_step(sum(l.width * l.height for l in layers))
+        digest, sampled_rgb, sampled_alpha = hashlib.sha1(), [], []
+        for layer in layers:
+            digest.update(pack('<3I', layer.width, layer.height, layer.bpp))
+            for top, rows, data in Sprite.iter_layer_pixels(layer):
+                digest.update(data)
+                rgb, alpha = spr_quantize.split_alpha(data, layer.bpp)
+                # Samples continue from the previous strip as if the layer was read at once
+                skip = -top * layer.width % step
+                rgb, alpha = spr_quantize.sample_pixels(rgb[skip * 3:], alpha[skip:] if alpha is not None else None,
+                                                        step)
+                sampled_rgb.append(rgb)
+                sampled_alpha.append(alpha if alpha is not None else b'\xff' * (len(rgb) // 3))
+        digest = digest.digest()
+
+        palette = palette_cache.lookup(digest) if palette_cache is not None else None
+        if palette is None:
+            histogram = spr_quantize.color_histogram(b''.join(sampled_rgb), b''.join(sampled_alpha))
+            palette = spr_quantize.median_cut(histogram)
+            if palette_cache is not None:
+                palette_cache.store(digest, palette)
+
+        indexed = gimp.Image(image.width, image.height, INDEXED)
+        indexed.colormap = palette
+        for name in image.parasite_list():
+            if name != Sprite.PALETTE_PARASITE:
+                indexed.parasite_attach(image.parasite_find(name))
+        indexed.attach_new_parasite(Sprite.PALETTE_PARASITE, PARASITE_PERSISTENT, digest + palette)
+
+        gimp.progress_init('Mapping colors')
+        copied = []
+        copy_layers(image.layers, None)
+        return indexed
 
-            if header.format == Sprite.TEXTURE_FORMAT_ALPHATEST:
-                return ''.join(i + chr(0xff - (ord(i) // last_index * 0xff)) for i in indices)
+    @staticmethod
+    def _make_frame(gl, opacity_table=None):
+
+        def make_frame_data(layer):
+            params = Sprite._make_frame_params(layer)
+            if opacity_table is None:
+                return params, Sprite._make_frame_indices(layer)
+
+            # Bounds are found in a first pass over the tiles, cropped rows are read in the second one
+            bounds = None
+            for y, rows, indices in Sprite.iter_layer_indices(layer):
+                strip_bounds = spr_pixels.opaque_bounds(indices, layer.width, rows, opacity_table)
+                if strip_bounds is not None:
+                    x, strip_y, width, height = strip_bounds
+                    bounds = spr_pixels.union_bounds(bounds, (x, y + strip_y, width, height))
+            if bounds is None:
+                bounds = 0, 0, 1, 1
+            if bounds == (0, 0, layer.width, layer.height):
+                return params, Sprite._make_frame_indices(layer)
+
+            x, y, width, height = bounds
+            return spr_pixels.crop_params(params, bounds), (
+                spr_pixels.crop(indices, layer.width, x, 0, width, rows)
+                for _, rows, indices in Sprite.iter_layer_indices(layer, y, height))
+
+        if len(gl) > 1:
+            frame_type = gl[0].parasite_find('spr_type').flags
+            group_len = len(gl) - 1
+            intervals, params, indices = [], [], []
+            for sub_l in gl[1:]:
+                intervals.append(unpack('<f', sub_l.parasite_find('spr_interval').data[:4])[0])
+                sub_params, sub_indices = make_frame_data(sub_l)
+                params.append(sub_params)
+                indices.append(sub_indices)
+        else:
+            frame_type = Sprite.FRAME_TYPE_SINGLE
+            group_len = 0
+            intervals = None
+            params, indices = make_frame_data(gl[0])
 
-            return indices
+        return Sprite.FrameData(frame_type, group_len, intervals, params, indices)
 
-        def make_layer(layer_name, params, indices):
-            layer = gimp.Layer(img, layer_name, params.width, params.height, layer_type, 100, NORMAL_MODE)
-            rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height)
-            rgn[:, :] = make_pixel_data(indices)
-            layer.flush()
+    @staticmethod
+    @spr_profile.profiled('make_image')
+    def _make_image(header, palette, frames, workers=1, numbers=None, metadata_only=False):
+
+        def make_layer(layer_name, params):
+            with spr_profile.phase('layers', frames=1):
+                layer = gimp.Layer(img, layer_name, params.width, params.height, layer_type, 100, NORMAL_MODE)
+                if metadata_only:
+                    return layer
+                rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height)
+
+            # Pixels are written one strip of tiles at a time, workers expand whole frames
+            row_size, frame_data = params.width * pixel_size, None
+            for y in range(0, params.height, tile_height):
+                rows = min(tile_height, params.height - y)
+                if workers <= 1:
+                    with spr_profile.phase('expand', bytes=params.width * rows):
+                        data = next(pixel_data)
+                else:
+                    if frame_data is None:
+                        with spr_profile.phase('expand', bytes=params.width * params.height):
+                            frame_data = next(pixel_data)
+                    data = frame_data[y * row_size:(y + rows) * row_size]
+                with spr_profile.phase('layers', bytes=len(data)):
+                    rgn[0:params.width, y:y + rows] = data
+
+            with spr_profile.phase('layers'):
+                layer.flush()
             return layer
 
+        def iter_indices():
+            for fr in frames:
+                if fr.type == Sprite.FRAME_TYPE_SINGLE:
+                    group = [(fr.params, fr.indices)]
+                else:
+                    group = zip(fr.params, fr.indices)
+                for params, indices in group:
+                    # A job sent to a worker pickles its pixels both ways, so workers get whole frames
+                    if workers > 1:
+                        yield bytes(indices), header.format, palette_size
+                        continue
+                    for y in range(0, params.height, tile_height):
+                        strip = indices[y * params.width:(y + tile_height) * params.width]
+                        yield bytes(strip), header.format, palette_size
+
         img = gimp.Image(header.max_width, header.max_height, INDEXED)
         img.colormap = palette
 
         img.attach_new_parasite('spr_type', header.type, '')
         img.attach_new_parasite('spr_format', header.format, '')
 
-        last_index = len(palette) // 3 - 1
+        palette_size = len(palette) // 3
+        tile_height = gimp.tile_height()
 
         layer_mode = ADDITION_MODE if header.format == Sprite.TEXTURE_FORMAT_ADDITIVE else NORMAL_MODE
         if header.format in (Sprite.TEXTURE_FORMAT_INDEXALPHA, Sprite.TEXTURE_FORMAT_ALPHATEST):
-            layer_type = INDEXEDA_IMAGE
+            layer_type, pixel_size = INDEXEDA_IMAGE, 2
         else:
-            layer_type = INDEXED_IMAGE
+            layer_type, pixel_size = INDEXED_IMAGE, 1
+
+        if numbers is None:
+            numbers = range(len(frames))
+
+        # Frames are expanded in order, so layers are made as results arrive
+        jobs = iter(()) if metadata_only else iter_indices()
+        pixel_data = spr_workers.imap(spr_pixels.expand_indices, jobs, workers)
 
-        for i, fr in enumerate(frames):
+        for i, fr in zip(numbers, frames):
             if fr.type == Sprite.FRAME_TYPE_SINGLE:
                 layer_name = 'Frame %d' % i
-                layer = make_layer(layer_name, fr.params, fr.indices)
-                layer.attach_new_parasite('spr_origins', 0, pack('<2i', fr.params.origin_x, fr.params.origin_y))
-                pdb.gimp_image_insert_layer(img, layer, None, 0)
+                layer = make_layer(layer_name, fr.params)
+                with spr_profile.phase('parasites'):
+                    layer.attach_new_parasite('spr_origins', 0, pack('<2i', fr.params.origin_x, fr.params.origin_y))
+                with spr_profile.phase('pdb'):
+                    pdb.gimp_image_insert_layer(img, layer, None, 0)
             else:
                 layer = gimp.GroupLayer(img)
                 layer.name = 'Group %d' % i
-                pdb.gimp_image_insert_layer(img, layer, None, 0)
+                with spr_profile.phase('pdb'):
+                    pdb.gimp_image_insert_layer(img, layer, None, 0)
 
                 for j in range(fr.group_len):
                     sub_layer_name = 'Frame %d.%d' % (i, j)
                     params = fr.params[j]
-                    sub_layer = make_layer(sub_layer_name, params, fr.indices[j])
-                    sub_layer.attach_new_parasite('spr_interval', 0, pack('<f', fr.intervals[j]))
-                    sub_layer.attach_new_parasite('spr_origins', 0, pack('<2i', params.origin_x, params.origin_y))
-                    img.insert_layer(sub_layer, layer)
+                    sub_layer = make_layer(sub_layer_name, params)
+                    with spr_profile.phase('parasites'):
+                        sub_layer.attach_new_parasite('spr_interval', 0, pack('<f', fr.intervals[j]))
+                        sub_layer.attach_new_parasite('spr_origins', 0, pack('<2i', params.origin_x, params.origin_y))
+                    with spr_profile.phase('pdb'):
+                        img.insert_layer(sub_layer, layer)
 
             layer.mode = layer_mode
 
-            layer.attach_new_parasite('spr_type', fr.type, '')
+            with spr_profile.phase('parasites'):
+                layer.attach_new_parasite('spr_type', fr.type, '')
+                layer.attach_new_parasite(Sprite.FRAME_PARASITE, PARASITE_PERSISTENT, pack('<I', i))
 
+        pixel_data.close()
         return img
 
     @staticmethod
@@ -267,45 +606,100 @@ class Sprite:
 
     @staticmethod
     def _make_frame_indices(layer):
-        indices = layer.get_pixel_rgn(0, 0, layer.width, layer.height)[:, :]
-        if layer.type == INDEXEDA_IMAGE:
-            indices = indices[::2]
-        return indices
+        return (indices for _, _, indices in Sprite.iter_layer_indices(layer))
 
     @staticmethod
-    def _read_dds_frames(fd, num):
-        data = fd.read()
-        dds_pos, dds_bounds = 0, []
-        while num > 0:
-            begin, end = dds_pos, data.find('DDS', dds_pos + 3)
-            if end == -1:
-                end, num = None, 0
-            dds_bounds.append((begin, end))
-            dds_pos = end
-            num -= 1
-        return [data[begin:end] for begin, end in dds_bounds]
+    def iter_layer_pixels(layer, y=0, height=None):
+        """
+        Read pixels of a layer in strips of tile height, only one strip is held in memory.
+        :param layer: gimp layer
+        :param y: first row
+        :param height: number of rows, all rows from y if None
+        :return: iterator of (strip top, strip height, pixel data)
+        """
+
+        end = layer.height if height is None else y + height
+        rgn = layer.get_pixel_rgn(0, y, layer.width, end - y, False, False)
+        tile_height = gimp.tile_height()
+        for top in range(y, end, tile_height):
+            rows = min(tile_height, end - top)
+            yield top, rows, rgn[0:layer.width, top:top + rows]
 
     @staticmethod
-    def _load_dds_frames(dds_frames):
-        import tempfile
+    def iter_layer_indices(layer, y=0, height=None):
+        """
+        Read palette indices of an indexed layer in strips of tile height.
+        Only one strip is held in memory, the alpha channel of INDEXEDA layers is dropped per strip.
+        :param layer: indexed gimp layer
+        :param y: first row
+        :param height: number of rows, all rows from y if None
+        :return: iterator of (strip top, strip height, indices)
+        """
+
+        for top, rows, indices in Sprite.iter_layer_pixels(layer, y, height):
+            yield top, rows, indices[::2] if layer.type == INDEXEDA_IMAGE else indices
+
+    @staticmethod
+    @spr_profile.profiled('load_dds_frames')
+    def _load_dds_frames(dds_frames, workers=1, numbers=None, metadata_only=False):
+        if numbers is None:
+            numbers = range(len(dds_frames))
+        if metadata_only:
+            supported = [False] * len(dds_frames)
+        else:
+            supported = [spr_dds.pixel_format(*spr_dds.read_header(data)) is not None for data in dds_frames]
+        jobs = ((bytes(data),) for data, sup in zip(dds_frames, supported) if sup)
+        decoded = spr_workers.imap(spr_dds.decode, jobs, workers)
 
         images = []
-        for i, data in enumerate(dds_frames):
-            tempfd, temppath = tempfile.mkstemp(suffix='.dds')
+        for i, number, data in zip(range(len(dds_frames)), numbers, dds_frames):
+            if metadata_only:
+                # Only the size is read from the header, the layer is left empty
+                dds_header = spr_dds.read_header(data)[0]
+                width, height = dds_header.width, dds_header.height
+                rgba = None
+            elif not supported[i]:
+                with spr_profile.phase('pdb', frames=1, bytes=len(data)):
+                    images.append(Sprite._load_dds_frame_with_pdb(number, data))
+                continue
+            else:
+                with spr_profile.phase('decode', frames=1, bytes=len(data)):
+                    width, height, rgba = next(decoded)
+
+            with spr_profile.phase('layers', frames=1, bytes=len(rgba or b'')):
+                img = gimp.Image(width, height, RGB)
+                layer = gimp.Layer(img, 'Frame %d' % number, width, height, RGBA_IMAGE, 100, NORMAL_MODE)
+                if rgba is not None:
+                    rgn = layer.get_pixel_rgn(0, 0, width, height)
+                    rgn[:, :] = rgba
+                layer.flush()
+                layer.attach_new_parasite(Sprite.FRAME_PARASITE, PARASITE_PERSISTENT, pack('<I', number))
+            with spr_profile.phase('pdb'):
+                pdb.gimp_image_insert_layer(img, layer, None, 0)
+            images.append(img)
+
+        decoded.close()
+        return images
+
+    @staticmethod
+    def _load_dds_frame_with_pdb(i, data):
+        import tempfile
 
-            with open(temppath, 'wb') as fd:
-                fd.write(data)
+        tempfd, temppath = tempfile.mkstemp(suffix='.dds')
 
-            exception = None
-            try:
-                images.append(pdb.file_dds_load(temppath, temppath, 0, 1))
-            except RuntimeError as e:
-                exception = e
+        with open(temppath, 'wb') as fd:
+            fd.write(bytes(data))
 
-            os.close(tempfd)
-            os.unlink(temppath)
+        exception = None
+        try:
+            image = pdb.file_dds_load(temppath, temppath, 0, 1)
+        except RuntimeError as e:
+            exception = e
 
-            if exception:
-                fail('Error loading DDS frame_%d:\n\n%s!' % (i, e.message))
+        os.close(tempfd)
+        os.unlink(temppath)
 
-        return images
+        if exception:
+            fail('Error loading DDS frame_%d:\n\n%s!' % (i, exception.message))
+
+        return image
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Sprite sheet (atlas) slicing, works without GIMP.
+
+A sheet is decoded once into one pixel buffer and cut into frames by a grid or by a JSON
+description. Frames are handed to SpriteWriter as views of the sheet rows, so no frame is
+copied before it is written.
+
+Usage:
+    python spr_atlas.py sheet.png out.spr --grid 64x64 [--count N] [--margin M] [--spacing S]
+    python spr_atlas.py sheet.png out.spr --json sheet.json
+"""
+
+from collections import namedtuple, OrderedDict
+import argparse
+import json
+import math
+import sys
+
+from spr_codec import SpriteCodec, SpriteWriter, data_view
+import spr_png
+
+AtlasFrame = namedtuple('AtlasFrame', ['x', 'y', 'width', 'height', 'origin_x', 'origin_y'])
+
+
+def default_origin(width, height):
+    """
+    Get origin of a frame centered on the sprite origin, as the export dialog does.
+    """
+
+    return -width // 2, height // 2
+
+
+def grid_frames(sheet_width, sheet_height, frame_width, frame_height, count=0, margin=0, spacing=0):
+    """
+    Cut sheet into cells of a grid, row by row.
+    :param frame_width: cell width
+    :param frame_height: cell height
+    :param count: number of frames, 0 for all cells
+    :param margin: pixels around the grid
+    :param spacing: pixels between cells
+    :return: list of AtlasFrame
+    """
+
+    if frame_width <= 0 or frame_height <= 0:
+        raise ValueError('Frame size must be positive')
+    if margin < 0 or spacing < 0 or count < 0:
+        raise ValueError('Margin, spacing and frame count must not be negative')
+
+    columns = (sheet_width - 2 * margin + spacing) // (frame_width + spacing)
+    rows = (sheet_height - 2 * margin + spacing) // (frame_height + spacing)
+    if columns <= 0 or rows <= 0:
+        raise ValueError('Frame %dx%d does not fit the %dx%d sheet' % (frame_width, frame_height,
+                                                                       sheet_width, sheet_height))
+    if count > columns * rows:
+        raise ValueError('Sheet has %d cells, %d frames requested' % (columns * rows, count))
+
+    origin_x, origin_y = default_origin(frame_width, frame_height)
+    frames = []
+    for i in range(count or columns * rows):
+        x = margin + i % columns * (frame_width + spacing)
+        y = margin + i // columns * (frame_height + spacing)
+        frames.append(AtlasFrame(x, y, frame_width, frame_height, origin_x, origin_y))
+    return frames
+
+
+def load_json(path):
+    """
+    Read JSON description of a sheet, frames described by an object keep their order.
+    """
+
+    with open(path) as fd:
+        return json.load(fd, object_pairs_hook=OrderedDict)
+
+
+def json_frames(meta, sheet_width, sheet_height):
+    """
+    Read frames from JSON description of a sheet.
+    Both the sheet metadata of spr_convert.py (frames with rect and origin) and the JSON hash and
+    JSON array layouts of sprite sheet packers (frames with frame rect, trim and pivot) are read.
+    :param meta: parsed JSON
+    :param sheet_width: sheet width
+    :param sheet_height: sheet height
+    :return: list of AtlasFrame
+    """
+
+    entries = meta.get('frames') if isinstance(meta, dict) else None
+    if isinstance(entries, dict):
+        entries = list(entries.values())
+    if not entries:
+        raise ValueError('No frames in the sheet description')
+
+    frames = []
+    for entry in entries:
+        if 'group' in entry:
+            raise ValueError('Frame groups are packed by spr_convert.py')
+
+        if 'rect' in entry:
+            x, y, width, height = entry['rect']
+            origin_x, origin_y = entry.get('origin') or default_origin(width, height)
+        elif 'frame' in entry:
+            if entry.get('rotated'):
+                raise ValueError('Rotated frames are not supported')
+            rect = entry['frame']
+            x, y, width, height = rect['x'], rect['y'], rect['w'], rect['h']
+
+            # Trimmed frames are placed where they were in the untrimmed source frame
+            trim = entry.get('spriteSourceSize', {}) if entry.get('trimmed') else {}
+            source = entry.get('sourceSize', {}) if trim else {}
+            trim_x, trim_y = trim.get('x', 0), trim.get('y', 0)
+            source_width, source_height = source.get('w', width), source.get('h', height)
+
+            pivot = entry.get('pivot')
+            if pivot is None:
+                origin_x, origin_y = default_origin(source_width, source_height)
+            else:
+                # Halves are rounded up on both Python 2 and 3
+                origin_x = -int(math.floor(pivot['x'] * source_width + 0.5))
+                origin_y = int(math.floor(pivot['y'] * source_height + 0.5))
+            origin_x, origin_y = origin_x + trim_x, origin_y - trim_y
+        else:
+            raise ValueError('Frame %r has no rect' % (entry,))
+
+        if width <= 0 or height <= 0 or x < 0 or y < 0 or x + width > sheet_width or y + height > sheet_height:
+            raise ValueError('Frame rect %r is out of the sheet' % ([x, y, width, height],))
+        frames.append(AtlasFrame(x, y, width, height, origin_x, origin_y))
+    return frames
+
+
+def frame_rows(data, sheet_width, x, y, width, height, bpp=1):
+    """
+    Get pixels of a frame as zero-copy views of the sheet buffer.
+    :param data: bytes-like sheet pixels
+    :param sheet_width: sheet width
+    :param bpp: bytes per pixel
+    :return: one view if the frame spans whole sheet rows, list of row views otherwise
+    """
+
+    row_size = sheet_width * bpp
+    if x == 0 and width == sheet_width:
+        return data_view(data, y * row_size, height * row_size)
+
+    start, frame_row_size = y * row_size + x * bpp, width * bpp
+    return [data_view(data, start + row * row_size, frame_row_size) for row in range(height)]
+
+
+def write_sprite(path, sheet_width, indices, palette, frames, spr_type=0, texture_format=0):
+    """
+    Write frames of a sheet as sprite of single frames.
+    :param path: path to the output sprite
+    :param sheet_width: sheet width
+    :param indices: palette indices of the sheet, 1 byte per pixel
+    :param palette: palette, 3 bytes per color
+    :param frames: list of AtlasFrame
+    :param spr_type: sprite type
+    :param texture_format: sprite texture format
+    """
+
+    if not frames:
+        raise ValueError('No frames to write')
+
+    width, height = max(f.width for f in frames), max(f.height for f in frames)
+    header = SpriteCodec.make_header(width, height, len(frames), spr_type, texture_format)
+    with SpriteWriter(path, header, palette) as writer:
+        for f in frames:
+            params = SpriteCodec.FrameParams(f.origin_x, f.origin_y, f.width, f.height)
+            writer.write_frame(SpriteCodec.FrameData(SpriteCodec.FRAME_TYPE_SINGLE, 0, None, params,
+                                                     frame_rows(indices, sheet_width, f.x, f.y, f.width, f.height)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cut an indexed PNG sprite sheet into a Half-Life sprite.')
+    parser.add_argument('sheet', help='indexed PNG image')
+    parser.add_argument('dst', help='output sprite')
+    layout = parser.add_mutually_exclusive_group(required=True)
+    layout.add_argument('--grid', help='frame size of a grid, such as 64x64')
+    layout.add_argument('--json', help='JSON description of the frames')
+    parser.add_argument('--count', type=int, default=0, help='number of grid frames (default: all cells)')
+    parser.add_argument('--margin', type=int, default=0, help='pixels around the grid')
+    parser.add_argument('--spacing', type=int, default=0, help='pixels between grid cells')
+    parser.add_argument('--type', type=int, default=0, help='sprite type (default: 0)')
+    parser.add_argument('--format', type=int, default=0, help='texture format (default: 0)')
+    args = parser.parse_args(argv)
+
+    with open(args.sheet, 'rb') as fd:
+        image = spr_png.read_png(fd.read())
+    if image.color_type != spr_png.COLOR_TYPE_P:
+        parser.error('%s is not an indexed image' % args.sheet)
+
+    try:
+        if args.grid:
+            frame_width, frame_height = [int(v) for v in args.grid.lower().split('x')]
+            frames = grid_frames(image.width, image.height, frame_width, frame_height,
+                                 args.count, args.margin, args.spacing)
+        else:
+            frames = json_frames(load_json(args.json), image.width, image.height)
+    except ValueError as e:
+        parser.error(str(e))
+
+    write_sprite(args.dst, image.width, image.data, image.palette, frames, args.type, args.format)
+    print('%d frames written to %s' % (len(frames), args.dst))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
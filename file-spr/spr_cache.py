@@ -0,0 +1,301 @@
+"""
+Caches used by the sprite plug-in.
+"""
+
+from collections import OrderedDict
+import binascii
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+
+try:
+    from urllib import pathname2url
+except ImportError:
+    from urllib.request import pathname2url
+
+import spr_png
+
+
+def default_cache_dir(name):
+    """
+    Get directory of a plug-in cache in the XDG cache directory, ~/.cache by default.
+    """
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'hl-spr-plugin', name)
+
+
+class LRUCache:
+    """
+    Dictionary-like cache that keeps only the most recently used items.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+class ThumbnailCache:
+    """
+    On-disk cache of sprite thumbnails.
+    Thumbnails are PNG files named by MD5 of the sprite URI in a directory per thumbnail size,
+    like the freedesktop.org thumbnail spec, and are valid while the modification time and size
+    of the sprite stored in their tEXt chunks match. The least recently used files are removed
+    when the cache grows over its size limit, at most once per eviction interval and only the
+    thumbnails written by this plug-in. Errors of the cache are never raised to the caller.
+    """
+
+    SIZE_NAMES = {128: 'normal', 256: 'large', 512: 'x-large', 1024: 'xx-large'}
+    SOFTWARE = 'GIMP Half-Life sprite plugin'
+    THUMB_NAME = re.compile(r'^[0-9a-f]{32}\.png$')
+    EVICT_STAMP = '.evicted'
+    EVICT_INTERVAL = 3600
+    TEXT_PEEK_SIZE = 4096
+
+    def __init__(self, cache_dir=None, max_bytes=64 << 20):
+        self.cache_dir = cache_dir or default_cache_dir('thumbnails')
+        self.max_bytes = max_bytes
+
+    def lookup(self, file_path, thumb_size):
+        """
+        Find valid thumbnail of the sprite.
+        :param file_path: path to the sprite
+        :param thumb_size: thumbnail size
+        :return: path to the PNG thumbnail, sprite width and height, or None if there is no valid thumbnail
+        """
+
+        thumb_path = self._thumb_path(file_path, thumb_size)
+        try:
+            st = os.stat(file_path)
+            with open(thumb_path, 'rb') as fd:
+                text = spr_png.read_text(fd.read())
+            if text.get('Thumb::MTime') != str(int(st.st_mtime)) or text.get('Thumb::Size') != str(st.st_size):
+                return None
+            width, height = int(text['Thumb::Image::Width']), int(text['Thumb::Image::Height'])
+            # Recently used thumbnails are kept on eviction
+            os.utime(thumb_path, None)
+        except Exception:
+            return None
+        return thumb_path, width, height
+
+    def store(self, file_path, thumb_size, image_width, image_height, width, height, data, **png_options):
+        """
+        Save thumbnail of the sprite.
+        :param file_path: path to the sprite
+        :param thumb_size: thumbnail size
+        :param image_width: sprite width
+        :param image_height: sprite height
+        :param width: thumbnail width
+        :param height: thumbnail height
+        :param data: thumbnail pixel data
+        :param png_options: color type, palette and transparency passed to spr_png.write_png
+        """
+
+        thumb_path = self._thumb_path(file_path, thumb_size)
+        try:
+            st = os.stat(file_path)
+            text = {
+                'Software': ThumbnailCache.SOFTWARE,
+                'Thumb::URI': self._uri(file_path),
+                'Thumb::MTime': str(int(st.st_mtime)),
+                'Thumb::Size': str(st.st_size),
+                'Thumb::Image::Width': str(image_width),
+                'Thumb::Image::Height': str(image_height),
+            }
+
+            thumb_dir = os.path.dirname(thumb_path)
+            if not os.path.isdir(thumb_dir):
+                os.makedirs(thumb_dir, 0o700)
+            fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.png', dir=thumb_dir)
+            try:
+                with os.fdopen(fd, 'wb') as thumb_file:
+                    spr_png.write_png(thumb_file, width, height, data, text=text, **png_options)
+                if os.path.exists(thumb_path) and sys.platform == 'win32':
+                    os.remove(thumb_path)
+                os.rename(temp_path, thumb_path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+
+            if self._eviction_due():
+                self.evict()
+        except Exception:
+            # The cache is optional, thumbnails are just made again
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used thumbnails until the cache fits its size limit.
+        Only PNG files named like thumbnails in the size directories whose tEXt chunks say this plug-in
+        wrote them are counted and removed.
+        """
+
+        entries = []
+        size_dirs = set(ThumbnailCache.SIZE_NAMES.values())
+        for size_dir in os.listdir(self.cache_dir):
+            if size_dir not in size_dirs and not size_dir.isdigit():
+                continue
+            dir_path = os.path.join(self.cache_dir, size_dir)
+            try:
+                file_names = os.listdir(dir_path)
+            except EnvironmentError:
+                continue
+            for file_name in file_names:
+                if not ThumbnailCache.THUMB_NAME.match(file_name):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if not self._is_own_thumbnail(path):
+                        continue
+                    st = os.stat(path)
+                except Exception:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                continue
+            total -= size
+
+    @staticmethod
+    def _is_own_thumbnail(path):
+        # Text chunks are written before pixel data, so the start of the file is enough
+        with open(path, 'rb') as fd:
+            return spr_png.read_text(fd.read(ThumbnailCache.TEXT_PEEK_SIZE)).get('Software') == ThumbnailCache.SOFTWARE
+
+    def _eviction_due(self):
+        # Thumbnails are loaded in a new plug-in process every time, so the time of the last eviction
+        # is kept as modification time of a stamp file in the cache
+        stamp_path = os.path.join(self.cache_dir, ThumbnailCache.EVICT_STAMP)
+        try:
+            if time.time() - os.stat(stamp_path).st_mtime < ThumbnailCache.EVICT_INTERVAL:
+                return False
+            os.utime(stamp_path, None)
+        except EnvironmentError:
+            open(stamp_path, 'wb').close()
+        return True
+
+    def _thumb_path(self, file_path, thumb_size):
+        size_name = ThumbnailCache.SIZE_NAMES.get(thumb_size, str(thumb_size))
+        name = hashlib.md5(self._uri(file_path).encode('utf-8')).hexdigest() + '.png'
+        return os.path.join(self.cache_dir, size_name, name)
+
+    @staticmethod
+    def _uri(file_path):
+        return 'file://' + pathname2url(os.path.abspath(file_path))
+
+
+class PaletteCache:
+    """
+    On-disk cache of palettes made for RGB and grayscale images.
+    Palettes are stored in files named by the digest of the layer pixels, so an image gets its palette
+    back while its pixels are not changed. The least recently used palettes are removed when there are
+    more than max_files of them. Errors of the cache are never raised to the caller.
+    """
+
+    PALETTE_NAME = re.compile(r'^[0-9a-f]{40}\.pal$')
+
+    def __init__(self, cache_dir=None, max_files=256):
+        self.cache_dir = cache_dir or default_cache_dir('palettes')
+        self.max_files = max_files
+
+    def lookup(self, digest):
+        """
+        Find palette of the pixels.
+        :param digest: SHA-1 digest of the layer pixels
+        :return: palette, 3 bytes per color, or None if it is not cached
+        """
+
+        path = self._palette_path(digest)
+        try:
+            with open(path, 'rb') as fd:
+                palette = fd.read()
+            if not palette or len(palette) % 3 or len(palette) > 768:
+                return None
+            # Recently used palettes are kept on eviction
+            os.utime(path, None)
+        except Exception:
+            return None
+        return palette
+
+    def store(self, digest, palette):
+        """
+        Save palette of the pixels.
+        :param digest: SHA-1 digest of the layer pixels
+        :param palette: palette, 3 bytes per color
+        """
+
+        path = self._palette_path(digest)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.pal', dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as palette_file:
+                    palette_file.write(palette)
+                if os.path.exists(path) and sys.platform == 'win32':
+                    os.remove(path)
+                os.rename(temp_path, path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+
+            self.evict()
+        except Exception:
+            # The cache is optional, palettes are just made again
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used palettes until there are at most max_files of them.
+        """
+
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not PaletteCache.PALETTE_NAME.match(file_name):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except EnvironmentError:
+                continue
+
+        for _, path in sorted(entries)[:max(len(entries) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                continue
+
+    def _palette_path(self, digest):
+        return os.path.join(self.cache_dir, binascii.hexlify(digest).decode('ascii') + '.pal')
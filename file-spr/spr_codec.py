@@ -0,0 +1,476 @@
+"""
+Half-Life sprite (.spr) codec.
+
+Plain Python reader/writer for the sprite file structures. It does not depend on
+GIMP and can be used from batch scripts, the GIMP plug-in builds its layers on top of it.
+"""
+
+from collections import namedtuple
+from struct import pack, unpack, unpack_from
+from math import sqrt
+import io
+import mmap
+import os
+import sys
+import tempfile
+
+import spr_dds
+
+try:
+    _buffer = buffer
+except NameError:
+    def _buffer(obj, offset, size):
+        return memoryview(obj)[offset:offset + size]
+
+
+_BYTES_TYPES = (bytes, bytearray, memoryview, type(_buffer(b'', 0, 0)))
+
+# Python 2 file paths are str, so in-memory sprites have to be passed as buffers or bytearrays there
+try:
+    _PATH_TYPES = (str, unicode)
+except NameError:
+    _PATH_TYPES = (str, os.PathLike)
+
+
+def data_view(data, offset, size):
+    """
+    Zero-copy slice of a bytes-like object, bytes(view) makes a copy when it is actually needed.
+    """
+    return _buffer(data, offset, size)
+
+
+def replace_file(temp_path, file_path):
+    """
+    Replace file with a finished temporary file, the file keeps its permissions.
+    New files get the permissions open() would give them.
+    """
+
+    try:
+        mode = os.stat(file_path).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(temp_path, mode)
+
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, file_path)
+    elif sys.platform == 'win32' and os.path.exists(file_path):
+        # Python 2 can not rename over an existing file on Windows
+        os.remove(file_path)
+        os.rename(temp_path, file_path)
+    else:
+        os.rename(temp_path, file_path)
+
+
+class SpriteCodec:
+    MAGIC = b'IDSP'
+    VERSION_BMP, VERSION_DDS = 0x2, 0x3
+    VERSIONS = (VERSION_BMP, VERSION_DDS)
+
+    HEADER_STRUCT = '<4s3If3IfI'
+    FRAME_PARAMS_STRUCT = '<2i2I'
+
+    TEXTURE_FORMAT_NORMAL, TEXTURE_FORMAT_ADDITIVE, TEXTURE_FORMAT_INDEXALPHA, TEXTURE_FORMAT_ALPHATEST = range(4)
+    FRAME_TYPE_SINGLE, FRAME_TYPE_GROUP, FRAME_TYPE_ANGLED = range(3)
+
+    SprHeader = namedtuple('SprHeader', [
+        'magic',
+        'version',
+        'type',
+        'format',
+        'radius',
+        'max_width',
+        'max_height',
+        'frames_number',
+        'beam_length',
+        'synch_type'
+    ])
+
+    FrameData = namedtuple('FrameData', [
+        'type',
+        'group_len',
+        'intervals',
+        'params',
+        'indices'
+    ])
+
+    FrameIndex = namedtuple('FrameIndex', [
+        'type',
+        'group_len',
+        'intervals',
+        'params',
+        'offsets'
+    ])
+
+    FrameParams = namedtuple('FrameParams', [
+        'origin_x',
+        'origin_y',
+        'width',
+        'height'
+    ])
+
+    @staticmethod
+    def read(fd):
+        """
+        Read sprite structures from file.
+        :param fd: binary file object
+        :return: header, palette and list of FrameData (palette and frames are None for dds sprites)
+        """
+
+        header = SpriteCodec._read_header(fd)
+        if header.version != SpriteCodec.VERSION_BMP:
+            return header, None, None
+
+        palette = SpriteCodec._read_palette(fd)
+        frames = [SpriteCodec._read_frame(fd) for _ in range(header.frames_number)]
+        return header, palette, frames
+
+    @staticmethod
+    def write(fd, header, palette, frames):
+        """
+        Write sprite structures to file.
+        :param fd: binary file object
+        :param header: SprHeader
+        :param palette: palette data, 3 bytes per color
+        :param frames: iterable of FrameData
+        """
+
+        SpriteCodec._write_header(fd, header)
+        SpriteCodec._write_palette(fd, palette)
+        for fr in frames:
+            SpriteCodec._write_frame(fd, fr)
+
+    @staticmethod
+    def make_header(width, height, frames_num, spr_type=0, texture_format=0, version=VERSION_BMP):
+        radius = sqrt((width >> 1) * (width >> 1) + (height >> 1) * (height >> 1))
+        return SpriteCodec.SprHeader(SpriteCodec.MAGIC, version, spr_type, texture_format,
+                                     radius, width, height, frames_num, 0, 1)
+
+    @staticmethod
+    def _read_header(fd):
+        return SpriteCodec._unpack_header(fd.read(40))
+
+    @staticmethod
+    def _unpack_header(data):
+        if len(data) < 40:
+            raise ImportError('Invalid spr file')
+        header = SpriteCodec.SprHeader(*unpack(SpriteCodec.HEADER_STRUCT, data))
+        if header.magic != SpriteCodec.MAGIC:
+            raise ImportError('Invalid spr file')
+        if header.version not in SpriteCodec.VERSIONS:
+            raise ImportError('Invalid spr version: %d' % header.version)
+        if header.frames_number < 1:
+            raise ImportError('Invalid number of frames: %d' % header.frames_number)
+        return header
+
+    @staticmethod
+    def _write_header(fd, header):
+        fd.write(pack(SpriteCodec.HEADER_STRUCT, *header[:]))
+
+    @staticmethod
+    def _read_palette(fd):
+        pal_size = unpack('<H', fd.read(2))[0]
+        return fd.read(pal_size * 3)
+
+    @staticmethod
+    def _write_palette(fd, palette):
+        fd.write(pack('<H', len(palette) // 3))
+        fd.write(palette)
+
+    @staticmethod
+    def _read_frame(fd):
+        frame_type = unpack('<I', fd.read(4))[0]
+        if frame_type == SpriteCodec.FRAME_TYPE_SINGLE:
+            group_len = 0
+            intervals = None
+            params = SpriteCodec._read_frame_params(fd)
+            indices = fd.read(params.width * params.height)
+        else:
+            group_len = unpack('<I', fd.read(4))[0]
+            intervals = unpack('<%df' % group_len, fd.read(group_len * 4))
+            params, indices = [], []
+            for _ in range(group_len):
+                p = SpriteCodec._read_frame_params(fd)
+                params.append(p)
+                indices.append(fd.read(p.width * p.height))
+
+        return SpriteCodec.FrameData(frame_type, group_len, intervals, params, indices)
+
+    @staticmethod
+    def _write_frame(fd, frame):
+        fd.write(pack('<I', frame.type))
+        if frame.type == SpriteCodec.FRAME_TYPE_SINGLE:
+            SpriteCodec._write_frame_params(fd, frame.params)
+            SpriteCodec._write_indices(fd, frame.indices)
+        else:
+            fd.write(pack('<I', frame.group_len))
+            fd.write(pack('<%df' % len(frame.intervals), *frame.intervals))
+            for i in range(frame.group_len):
+                SpriteCodec._write_frame_params(fd, frame.params[i])
+                SpriteCodec._write_indices(fd, frame.indices[i])
+
+    @staticmethod
+    def _write_indices(fd, indices):
+        # Indices are bytes-like or an iterable of bytes-like chunks, such as rows read tile by tile
+        if isinstance(indices, _BYTES_TYPES):
+            fd.write(indices)
+        else:
+            for chunk in indices:
+                fd.write(chunk)
+
+    @staticmethod
+    def _read_frame_params(fd):
+        return SpriteCodec.FrameParams(*unpack(SpriteCodec.FRAME_PARAMS_STRUCT, fd.read(16)))
+
+    @staticmethod
+    def _write_frame_params(fd, params):
+        fd.write(pack(SpriteCodec.FRAME_PARAMS_STRUCT, *params[:]))
+
+    @staticmethod
+    def _read_dds_frames(fd, num):
+        data = fd.read()
+        return [data[begin:end] for begin, end in SpriteCodec._find_dds_bounds(data, 0, num)]
+
+    @staticmethod
+    def _find_dds_bounds(data, dds_pos, num):
+        return spr_dds.split_frames(data, dds_pos, num)
+
+
+class SpriteReader:
+    """
+    Random access sprite reader.
+    The file is memory-mapped and only the frame table is parsed on open,
+    pixel data of a frame is sliced without copying when the frame is requested.
+    Sprites already in memory, such as entries of a PAK archive, are read in place.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: file path, bytes-like object or seekable binary file object positioned at the sprite
+        """
+
+        self._fd = None
+        self._mmap = None
+        if isinstance(source, mmap.mmap) or not isinstance(source, _PATH_TYPES) and not hasattr(source, 'read'):
+            self._data = source
+        else:
+            try:
+                if isinstance(source, _PATH_TYPES):
+                    self._fd = open(source, 'rb')
+                    self._data = self._mmap = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self._data = self._map_file(source)
+            except (ValueError, EnvironmentError):
+                self.close()
+                raise ImportError('Invalid spr file')
+        self.size = len(self._data)
+
+        try:
+            self.header = SpriteCodec._unpack_header(self._data[:40])
+            if self.header.version == SpriteCodec.VERSION_BMP:
+                self._read_index()
+            else:
+                self.palette = None
+                self.frames = None
+                self._dds_bounds = SpriteCodec._find_dds_bounds(self._data, 40, self.header.frames_number)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Frame views are still alive, the mapping is released along with them
+                pass
+        if self._fd is not None:
+            self._fd.close()
+
+    def _map_file(self, fd):
+        start = fd.tell()
+        try:
+            fileno = fd.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            fileno = None
+
+        if fileno is not None:
+            self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            return self._mmap if not start else data_view(self._mmap, start, max(len(self._mmap) - start, 0))
+        if hasattr(fd, 'getbuffer'):
+            # In-memory files are viewed without copying
+            return fd.getbuffer()[start:]
+        return fd.read()
+
+    def frame(self, i):
+        """
+        Get frame with pixel data.
+        :param i: frame number
+        :return: FrameData, indices are zero-copy views
+        """
+
+        fr = self.frames[i]
+        if fr.type == SpriteCodec.FRAME_TYPE_SINGLE:
+            indices = data_view(self._data, fr.offsets, fr.params.width * fr.params.height)
+        else:
+            indices = [data_view(self._data, offset, p.width * p.height)
+                       for p, offset in zip(fr.params, fr.offsets)]
+        return SpriteCodec.FrameData(fr.type, fr.group_len, fr.intervals, fr.params, indices)
+
+    def dds_frames(self):
+        """
+        Get dds frames data of version 3 sprite.
+        :return: list of zero-copy views
+        """
+
+        return [data_view(self._data, begin, end - begin) for begin, end in self._dds_bounds]
+
+    def dds_frame(self, i):
+        """
+        Get single dds frame data of version 3 sprite.
+        :param i: frame number, negative numbers count from the end
+        :return: zero-copy view
+        """
+
+        begin, end = self._dds_bounds[i]
+        return data_view(self._data, begin, end - begin)
+
+    def _read_index(self):
+        data, data_len = self._data, len(self._data)
+
+        frames = []
+
+        def check(offset, size, what=None):
+            if offset + size > data_len:
+                raise ImportError('Invalid spr file: %s is truncated' % (what or 'frame %d' % len(frames)))
+
+        check(40, 2, 'palette')
+        pal_size = unpack_from('<H', data, 40)[0]
+        check(42, pal_size * 3, 'palette')
+        self.palette = bytes(data[42:42 + pal_size * 3])
+
+        offset = 42 + pal_size * 3
+        for _ in range(self.header.frames_number):
+            check(offset, 4)
+            frame_type = unpack_from('<I', data, offset)[0]
+            offset += 4
+
+            if frame_type == SpriteCodec.FRAME_TYPE_SINGLE:
+                group_len = 0
+                intervals = None
+                check(offset, 16)
+                params = SpriteCodec.FrameParams(*unpack_from(SpriteCodec.FRAME_PARAMS_STRUCT, data, offset))
+                offsets = offset + 16
+                offset = offsets + params.width * params.height
+                check(offsets, params.width * params.height)
+            else:
+                check(offset, 4)
+                group_len = unpack_from('<I', data, offset)[0]
+                check(offset + 4, group_len * 4)
+                intervals = unpack_from('<%df' % group_len, data, offset + 4)
+                offset += 4 + group_len * 4
+                params, offsets = [], []
+                for _ in range(group_len):
+                    check(offset, 16)
+                    p = SpriteCodec.FrameParams(*unpack_from(SpriteCodec.FRAME_PARAMS_STRUCT, data, offset))
+                    params.append(p)
+                    offsets.append(offset + 16)
+                    offset += 16 + p.width * p.height
+                    check(offsets[-1], p.width * p.height)
+
+            frames.append(SpriteCodec.FrameIndex(frame_type, group_len, intervals, params, offsets))
+
+        self.frames = frames
+
+
+class SpriteWriter:
+    """
+    Streaming atomic sprite writer.
+    Frames are written one by one as they are made into a temporary file next to the target,
+    the target is replaced only when every frame is written, so a failed export keeps the old file.
+    """
+
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, file_path, header, palette=None):
+        self.file_path = file_path
+        self.header = header
+        self.frames_written = 0
+
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        temp_fd, self._temp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(file_path), suffix='.tmp',
+                                                    dir=dir_path)
+        self._fd = os.fdopen(temp_fd, 'wb', self.BUFFER_SIZE)
+        try:
+            self._written_header = header
+            SpriteCodec._write_header(self._fd, header)
+            if header.version == SpriteCodec.VERSION_BMP:
+                SpriteCodec._write_palette(self._fd, palette)
+        except Exception:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def write_frame(self, frame):
+        """
+        Write frame.
+        :param frame: FrameData, indices may be iterables of chunks that are read while the frame is written
+        """
+
+        SpriteCodec._write_frame(self._fd, frame)
+        self.frames_written += 1
+
+    def write_dds_frame(self, data):
+        """
+        Write frame of version 3 sprite.
+        :param data: bytes-like DDS file
+        """
+
+        self._fd.write(data)
+        self.frames_written += 1
+
+    def commit(self):
+        """
+        Finish writing and replace the target file.
+        The header is written again if it was changed after the writer was created.
+        """
+
+        try:
+            if self.frames_written != self.header.frames_number:
+                raise IOError('Expected %d frames, %d written' % (self.header.frames_number, self.frames_written))
+
+            if self.header != self._written_header:
+                self._fd.seek(0)
+                SpriteCodec._write_header(self._fd, self.header)
+
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+            self._fd.close()
+            replace_file(self._temp_path, self.file_path)
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Discard written data, the target file is left as it was.
+        """
+
+        self._fd.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
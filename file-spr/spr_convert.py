@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+"""
+Batch converter between Half-Life sprites (.spr) and PNG images, works without GIMP.
+
+unpack  converts every .spr file of a directory tree to a directory of PNG frames
+        with sprite.json metadata, or to a single sprite sheet PNG with .json metadata (--sheet).
+        Sprites inside .pak archives are read in place, pak0.pak/sprites/a.spr is unpacked to pak0/sprites/a.
+pack    converts every sprite.json / sprite sheet .json of a directory tree back to .spr files.
+
+Files are converted in parallel processes, outputs newer than their inputs are skipped
+(with --hash outputs are skipped while the inputs content does not change).
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from spr_codec import SpriteCodec, SpriteWriter
+import spr_atlas
+import spr_dds
+import spr_pak
+import spr_pixels
+import spr_png
+
+FRAMES_META = 'sprite.json'
+HASH_MANIFEST = '.spr_convert.json'
+
+
+def makedirs(path):
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def file_hash(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        archive_path, name = spr_pak.split_path(path)
+        if name is not None:
+            digest.update(spr_pak.open_archive(archive_path).read(name))
+            continue
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_up_to_date(inputs, output):
+    if not os.path.exists(output):
+        return False
+    output_mtime = os.path.getmtime(output)
+    return all(os.path.getmtime(spr_pak.split_path(path)[0]) <= output_mtime for path in inputs)
+
+
+def frame_transparency(texture_format, palette):
+    if texture_format not in (SpriteCodec.TEXTURE_FORMAT_INDEXALPHA, SpriteCodec.TEXTURE_FORMAT_ALPHATEST):
+        return None
+    return spr_pixels.preview_alpha_table(texture_format, palette)[:len(palette) // 3]
+
+
+def sheet_layout(sizes):
+    """
+    Place frames into a grid of equal cells.
+    :param sizes: list of (width, height)
+    :return: sheet width, height and list of (x, y) positions
+    """
+
+    columns = max(int(math.ceil(math.sqrt(len(sizes)))), 1)
+    rows = (len(sizes) + columns - 1) // columns
+    cell_width = max(w for w, h in sizes)
+    cell_height = max(h for w, h in sizes)
+    positions = [((i % columns) * cell_width, (i // columns) * cell_height) for i in range(len(sizes))]
+    return columns * cell_width, rows * cell_height, positions
+
+
+def blit(sheet, sheet_width, x, y, data, width, height, bpp):
+    row_size, sheet_row_size = width * bpp, sheet_width * bpp
+    for row in range(height):
+        pos = (y + row) * sheet_row_size + x * bpp
+        sheet[pos:pos + row_size] = data[row * row_size:(row + 1) * row_size]
+
+
+def unpack_sprite(src_path, meta_path, sheet=False):
+    """
+    Convert sprite to PNG images.
+    :param src_path: path to the sprite file, such as sprites/a.spr or valve/pak0.pak/sprites/a.spr
+    :param meta_path: path to the output metadata file, images are written next to it
+    :param sheet: write all frames to a single sprite sheet
+    """
+
+    out_dir = os.path.dirname(meta_path)
+    name = os.path.splitext(os.path.basename(meta_path))[0]
+    makedirs(out_dir)
+
+    with spr_pak.open_sprite(src_path) as reader:
+        header = reader.header
+        meta = {
+            'version': header.version,
+            'type': header.type,
+            'format': header.format,
+            'width': header.max_width,
+            'height': header.max_height,
+            'beam_length': header.beam_length,
+            'synch_type': header.synch_type,
+            'frames': [],
+        }
+
+        # Flat list of (frame entry, pixel data, width, height, file name)
+        images = []
+        if header.version == SpriteCodec.VERSION_DDS:
+            bpp, color_type, palette, transparency = 4, spr_png.COLOR_TYPE_RGBA, None, None
+            for i, data in enumerate(reader.dds_frames()):
+                width, height, rgba = spr_dds.decode(data)
+                entry = {}
+                meta['frames'].append(entry)
+                images.append((entry, rgba, width, height, 'frame_%03d' % i))
+        else:
+            bpp, color_type = 1, spr_png.COLOR_TYPE_P
+            palette = reader.palette
+            transparency = frame_transparency(header.format, palette)
+            for i in range(header.frames_number):
+                fr = reader.frame(i)
+                if fr.type == SpriteCodec.FRAME_TYPE_SINGLE:
+                    entry = {'origin': [fr.params.origin_x, fr.params.origin_y]}
+                    meta['frames'].append(entry)
+                    images.append((entry, bytes(fr.indices), fr.params.width, fr.params.height, 'frame_%03d' % i))
+                    continue
+
+                group = []
+                meta['frames'].append({'type': fr.type, 'group': group})
+                for j, p in enumerate(fr.params):
+                    entry = {'origin': [p.origin_x, p.origin_y], 'interval': fr.intervals[j]}
+                    group.append(entry)
+                    images.append((entry, bytes(fr.indices[j]), p.width, p.height, 'frame_%03d_%02d' % (i, j)))
+                del fr
+
+    if sheet:
+        sheet_width, sheet_height, positions = sheet_layout([(w, h) for _, _, w, h, _ in images])
+        background = b'\0' * bpp
+        if header.format == SpriteCodec.TEXTURE_FORMAT_ALPHATEST and palette:
+            background = bytes(bytearray([len(palette) // 3 - 1]))
+        pixels = bytearray(background * (sheet_width * sheet_height))
+        for (entry, data, width, height, _), (x, y) in zip(images, positions):
+            blit(pixels, sheet_width, x, y, data, width, height, bpp)
+            entry['rect'] = [x, y, width, height]
+
+        meta['sheet'] = name + '.png'
+        with open(os.path.join(out_dir, meta['sheet']), 'wb') as fd:
+            spr_png.write_png(fd, sheet_width, sheet_height, pixels, color_type, palette, transparency)
+    else:
+        for entry, data, width, height, frame_name in images:
+            entry['image'] = frame_name + '.png'
+            with open(os.path.join(out_dir, entry['image']), 'wb') as fd:
+                spr_png.write_png(fd, width, height, data, color_type, palette, transparency)
+
+    # Metadata is written last, it marks the conversion as complete
+    with open(meta_path, 'w') as fd:
+        json.dump(meta, fd, indent=2, sort_keys=True)
+
+
+def meta_inputs(meta_path):
+    """
+    Get image files used by metadata file.
+    """
+
+    with open(meta_path) as fd:
+        meta = json.load(fd)
+
+    base_dir = os.path.dirname(meta_path)
+    if 'sheet' in meta:
+        return [os.path.join(base_dir, meta['sheet'])]
+
+    paths = []
+    for entry in meta['frames']:
+        for sub_entry in entry.get('group', [entry]):
+            paths.append(os.path.join(base_dir, sub_entry['image']))
+    return paths
+
+
+def pack_sprite(meta_path, dst_path):
+    """
+    Convert PNG images to sprite.
+    :param meta_path: path to the metadata file
+    :param dst_path: path to the output sprite file
+    """
+
+    with open(meta_path) as fd:
+        meta = json.load(fd)
+
+    version = meta.get('version', SpriteCodec.VERSION_BMP)
+    if version not in SpriteCodec.VERSIONS:
+        raise ImportError('Unknown sprite version %r' % (version,))
+    if not meta['frames']:
+        raise ImportError('No frames to pack')
+    for i, entry in enumerate(meta['frames']):
+        if 'group' in entry and version == SpriteCodec.VERSION_DDS:
+            raise ImportError('Frame %d is a group, version %d sprites have no frame groups' % (i, version))
+        if 'group' in entry and not entry['group']:
+            raise ImportError('Frame %d is an empty group' % i)
+
+    base_dir = os.path.dirname(meta_path)
+    images = {}
+
+    def load_image(file_name):
+        image = images.get(file_name)
+        if image is None:
+            with open(os.path.join(base_dir, file_name), 'rb') as fd:
+                image = spr_png.read_png(fd.read())
+            if image.color_type != spr_png.COLOR_TYPE_P and version == SpriteCodec.VERSION_BMP:
+                raise ImportError('%s is not an indexed image' % file_name)
+            images[file_name] = image
+        return image
+
+    makedirs(os.path.dirname(dst_path))
+    if version == SpriteCodec.VERSION_DDS:
+        _pack_dds_sprite(meta, load_image, dst_path)
+        return
+
+    palette = []
+
+    def frame_pixels(entry):
+        image = load_image(meta['sheet'] if 'sheet' in meta else entry['image'])
+        if not palette:
+            palette.append(image.palette)
+        elif image.palette != palette[0]:
+            raise ImportError('Palette of %s differs from the first frame' % entry.get('image', meta.get('sheet')))
+
+        if 'rect' in entry:
+            x, y, width, height = entry['rect']
+            if x < 0 or y < 0 or x + width > image.width or y + height > image.height:
+                raise ImportError('Frame rect %r is out of the sheet' % (entry['rect'],))
+            data = spr_atlas.frame_rows(image.data, image.width, x, y, width, height)
+        else:
+            width, height, data = image.width, image.height, image.data
+
+        origin_x, origin_y = entry.get('origin', [-width // 2, height // 2])
+        return SpriteCodec.FrameParams(origin_x, origin_y, width, height), data
+
+    def make_frame(entry):
+        if 'group' not in entry:
+            params, indices = frame_pixels(entry)
+            return SpriteCodec.FrameData(SpriteCodec.FRAME_TYPE_SINGLE, 0, None, params, indices)
+
+        group = [frame_pixels(sub_entry) for sub_entry in entry['group']]
+        intervals = [sub_entry.get('interval', (i + 1) * 0.1) for i, sub_entry in enumerate(entry['group'])]
+        return SpriteCodec.FrameData(entry.get('type', SpriteCodec.FRAME_TYPE_GROUP), len(group), intervals,
+                                     [p for p, _ in group], [d for _, d in group])
+
+    def make_header(width, height):
+        header = SpriteCodec.make_header(width, height, len(meta['frames']), meta.get('type', 0), meta.get('format', 0))
+        return header._replace(beam_length=meta.get('beam_length', 0), synch_type=meta.get('synch_type', 1))
+
+    # The palette is known after the first frame is read, groups are not empty so it reads at least one image
+    frames = (make_frame(entry) for entry in meta['frames'])
+    first_frame = next(frames)
+
+    with SpriteWriter(dst_path, make_header(meta.get('width', 0), meta.get('height', 0)), palette[0]) as writer:
+        max_width, max_height = 0, 0
+        for fr in itertools.chain([first_frame], frames):
+            for p in [fr.params] if fr.type == SpriteCodec.FRAME_TYPE_SINGLE else fr.params:
+                max_width, max_height = max(max_width, p.width), max(max_height, p.height)
+            writer.write_frame(fr)
+        del first_frame, fr
+
+        # Without size in metadata the header is written again on commit
+        if not meta.get('width') or not meta.get('height'):
+            writer.header = make_header(meta.get('width') or max_width, meta.get('height') or max_height)
+
+
+def _pack_dds_sprite(meta, load_image, dst_path):
+    """
+    Encode PNG images of version 3 metadata to DDS frames.
+    Images of any color type are read, indexed images get their alpha from the tRNS chunk.
+    """
+
+    def frame_rgba(entry):
+        image = load_image(meta['sheet'] if 'sheet' in meta else entry['image'])
+        bpp = spr_png.CHANNELS[image.color_type]
+        if image.color_type == spr_png.COLOR_TYPE_P:
+            rgba = bytearray(spr_pixels.layer_rgba(image.data, bpp, image.palette))
+            alphas = bytes(image.transparency or b'')[:256]
+            rgba[3::4] = bytes(image.data).translate(alphas + b'\xff' * (256 - len(alphas)))
+            rgba = bytes(rgba)
+        else:
+            rgba = spr_pixels.layer_rgba(image.data, bpp)
+
+        if 'rect' not in entry:
+            return image.width, image.height, rgba
+        x, y, width, height = entry['rect']
+        if x < 0 or y < 0 or x + width > image.width or y + height > image.height:
+            raise ImportError('Frame rect %r is out of the sheet' % (entry['rect'],))
+        return width, height, spr_pixels.crop(rgba, image.width, x, y, width, height, 4)
+
+    def make_header(width, height):
+        header = SpriteCodec.make_header(width, height, len(meta['frames']), meta.get('type', 0),
+                                         meta.get('format', 0), SpriteCodec.VERSION_DDS)
+        return header._replace(beam_length=meta.get('beam_length', 0), synch_type=meta.get('synch_type', 1))
+
+    with SpriteWriter(dst_path, make_header(meta.get('width', 0), meta.get('height', 0))) as writer:
+        max_width, max_height = 0, 0
+        for entry in meta['frames']:
+            width, height, rgba = frame_rgba(entry)
+            max_width, max_height = max(max_width, width), max(max_height, height)
+            writer.write_dds_frame(spr_dds.encode(width, height, rgba))
+
+        # Without size in metadata the header is written again on commit
+        if not meta.get('width') or not meta.get('height'):
+            writer.header = make_header(meta.get('width') or max_width, meta.get('height') or max_height)
+
+
+def find_tasks(command, src_dir, dst_dir, sheet):
+    """
+    Find files to convert.
+    :return: list of (input path, output path)
+    """
+
+    tasks = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        rel_dir = os.path.relpath(root, src_dir)
+        for file_name in sorted(files):
+            src_path = os.path.join(root, file_name)
+            name, ext = os.path.splitext(file_name)
+            if command == 'unpack' and ext.lower() in ('.spr', '.pak'):
+                if ext.lower() == '.spr':
+                    sprites = [(src_path, os.path.join(rel_dir, name))]
+                else:
+                    sprites = [(path, os.path.join(rel_dir, name, os.path.splitext(os.path.relpath(path, src_path))[0]))
+                               for path in spr_pak.find_sprites(src_path)]
+                for sprite_path, rel_name in sprites:
+                    if sheet:
+                        dst_path = os.path.join(dst_dir, rel_name + '.json')
+                    else:
+                        dst_path = os.path.join(dst_dir, rel_name, FRAMES_META)
+                    tasks.append((sprite_path, os.path.normpath(dst_path)))
+            elif command == 'pack' and ext.lower() == '.json' and file_name != HASH_MANIFEST:
+                if file_name == FRAMES_META:
+                    dst_path = os.path.join(dst_dir, os.path.dirname(rel_dir), os.path.basename(root) + '.spr')
+                else:
+                    dst_path = os.path.join(dst_dir, rel_dir, name + '.spr')
+                tasks.append((src_path, os.path.normpath(dst_path)))
+    return tasks
+
+
+def convert(task):
+    """
+    Convert single file, called in worker processes.
+    :param task: command, input path, output path, sheet flag, force flag, previous inputs hash or None
+    :return: input path, status, seconds, inputs hash, error message
+    """
+
+    command, src_path, dst_path, sheet, force, old_hash = task
+    start = time.time()
+    new_hash = None
+    try:
+        inputs = [src_path] if command == 'unpack' else [src_path] + meta_inputs(src_path)
+        if old_hash is not None:
+            new_hash = file_hash(inputs)
+            skip = not force and new_hash == old_hash and os.path.exists(dst_path)
+        else:
+            skip = not force and is_up_to_date(inputs, dst_path)
+
+        if skip:
+            return src_path, 'skipped', time.time() - start, new_hash, None
+
+        if command == 'unpack':
+            unpack_sprite(src_path, dst_path, sheet)
+        else:
+            pack_sprite(src_path, dst_path)
+        return src_path, 'converted', time.time() - start, new_hash, None
+    except Exception as e:
+        return src_path, 'failed', time.time() - start, None, '%s: %s' % (type(e).__name__, e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Half-Life sprites to PNG images and back.')
+    parser.add_argument('command', choices=('unpack', 'pack'),
+                        help='unpack: .spr to PNG, pack: PNG with .json metadata to .spr')
+    parser.add_argument('src', help='input directory')
+    parser.add_argument('dst', help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--sheet', action='store_true', help='unpack frames to a single sprite sheet')
+    parser.add_argument('--hash', action='store_true',
+                        help='skip files by content hash of inputs instead of modification time')
+    parser.add_argument('-f', '--force', action='store_true', help='convert files that are up to date')
+    args = parser.parse_args(argv)
+
+    manifest_path = os.path.join(args.dst, HASH_MANIFEST)
+    manifest = {}
+    if args.hash and os.path.exists(manifest_path):
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+
+    tasks = []
+    for src_path, dst_path in find_tasks(args.command, args.src, args.dst, args.sheet):
+        old_hash = manifest.get(os.path.relpath(dst_path, args.dst), '') if args.hash else None
+        tasks.append((args.command, src_path, dst_path, args.sheet, args.force, old_hash))
+    outputs = dict((task[1], task[2]) for task in tasks)
+
+    start = time.time()
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(convert, tasks)
+    else:
+        pool = None
+        results = (convert(task) for task in tasks)
+
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    try:
+        for src_path, status, seconds, new_hash, error in results:
+            counts[status] += 1
+            print('%8.3fs  %-9s  %s%s' % (seconds, status, os.path.relpath(src_path, args.src),
+                                          '\n           %s' % error if error else ''))
+            if new_hash is not None:
+                manifest[os.path.relpath(outputs[src_path], args.dst)] = new_hash
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if args.hash:
+        makedirs(args.dst)
+        with open(manifest_path, 'w') as fd:
+            json.dump(manifest, fd, indent=2, sort_keys=True)
+
+    print('%d converted, %d skipped, %d failed in %.2fs' % (counts['converted'], counts['skipped'], counts['failed'],
+                                                            time.time() - start))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
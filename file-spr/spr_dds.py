@@ -0,0 +1,758 @@
+"""
+DDS textures of version 3 sprites (Counter-Strike Online).
+
+Frames of such sprites are complete DDS files stored one after another,
+so frame lengths are computed from their headers. Frames are written as BC1
+(DXT1) textures if they are opaque and as BC3 (DXT5) textures otherwise.
+"""
+
+from collections import namedtuple
+from math import sqrt
+from struct import pack, unpack_from
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'DDS '
+HEADER_STRUCT = '<4s7I44x2I4s5I5I'
+HEADER_SIZE = 128
+DX10_HEADER_STRUCT = '<5I'
+DX10_HEADER_SIZE = 20
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDSD_DEPTH = 0x800000
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS2_CUBEMAP = 0x200
+DDSCAPS2_CUBEMAP_FACES = (0x400, 0x800, 0x1000, 0x2000, 0x4000, 0x8000)
+
+# Bytes per 4x4 block of compressed formats
+FOURCC_BLOCK_SIZES = {
+    b'DXT1': 8,
+    b'DXT2': 16,
+    b'DXT3': 16,
+    b'DXT4': 16,
+    b'DXT5': 16,
+    b'ATI1': 8,
+    b'BC4U': 8,
+    b'BC4S': 8,
+    b'ATI2': 16,
+    b'BC5U': 16,
+    b'BC5S': 16,
+}
+
+# DXGI format: (bytes per 4x4 block, 0) for compressed formats or (0, bits per pixel)
+DXGI_FORMAT_SIZES = {
+    2: (0, 128), 10: (0, 64), 24: (0, 32), 28: (0, 32), 29: (0, 32),
+    61: (0, 8), 71: (8, 0), 72: (8, 0), 74: (16, 0), 75: (16, 0),
+    77: (16, 0), 78: (16, 0), 80: (8, 0), 81: (8, 0), 83: (16, 0),
+    84: (16, 0), 87: (0, 32), 88: (0, 32), 91: (0, 32), 95: (16, 0),
+    96: (16, 0), 98: (16, 0), 99: (16, 0),
+}
+
+FORMAT_BC1, FORMAT_BC2, FORMAT_BC3, FORMAT_RGBA = 'BC1', 'BC2', 'BC3', 'RGBA'
+
+# Encoder quality: bounding box endpoints, principal axis endpoints, principal axis with least squares refinement
+QUALITY_FAST, QUALITY_NORMAL, QUALITY_HIGH = range(3)
+
+# Power method steps finding the principal color axis and least squares steps refining endpoints
+AXIS_ITERATIONS = 8
+REFINE_ITERATIONS = 2
+
+# Number of blocks the vectorized encoder processes at once, it bounds memory of the distance arrays
+ENCODE_CHUNK_BLOCKS = 4096
+
+# Weight of the first endpoint in each of the four colors of a block
+COLOR_WEIGHTS = (1.0, 0.0, 2 / 3.0, 1 / 3.0)
+
+FOURCC_FORMATS = {
+    b'DXT1': FORMAT_BC1,
+    b'DXT2': FORMAT_BC2,
+    b'DXT3': FORMAT_BC2,
+    b'DXT4': FORMAT_BC3,
+    b'DXT5': FORMAT_BC3,
+}
+
+DXGI_FORMATS = {
+    71: FORMAT_BC1, 72: FORMAT_BC1,
+    74: FORMAT_BC2, 75: FORMAT_BC2,
+    77: FORMAT_BC3, 78: FORMAT_BC3,
+}
+
+# DXGI format: channel masks of 32 bit uncompressed formats
+DXGI_RGBA_MASKS = {
+    28: (0xff, 0xff00, 0xff0000, 0xff000000),
+    29: (0xff, 0xff00, 0xff0000, 0xff000000),
+    87: (0xff0000, 0xff00, 0xff, 0xff000000),
+    88: (0xff0000, 0xff00, 0xff, 0),
+    91: (0xff0000, 0xff00, 0xff, 0xff000000),
+}
+
+DdsHeader = namedtuple('DdsHeader', [
+    'magic',
+    'size',
+    'flags',
+    'height',
+    'width',
+    'pitch_or_linear_size',
+    'depth',
+    'mip_count',
+    'pf_size',
+    'pf_flags',
+    'fourcc',
+    'rgb_bit_count',
+    'r_mask',
+    'g_mask',
+    'b_mask',
+    'a_mask',
+    'caps',
+    'caps2',
+    'caps3',
+    'caps4',
+    'reserved2'
+])
+
+
+def read_header(data, offset=0):
+    """
+    Read DDS header.
+    :param data: bytes-like object
+    :param offset: position of the DDS magic
+    :return: DdsHeader and DXGI format (None without DX10 header)
+    """
+
+    if offset + HEADER_SIZE > len(data):
+        raise ImportError('Invalid dds frame: header is truncated')
+
+    header = DdsHeader(*unpack_from(HEADER_STRUCT, data, offset))
+    if header.magic != MAGIC:
+        raise ImportError('Invalid dds frame')
+
+    dxgi_format = None
+    if header.pf_flags & DDPF_FOURCC and header.fourcc == b'DX10':
+        if offset + HEADER_SIZE + DX10_HEADER_SIZE > len(data):
+            raise ImportError('Invalid dds frame: header is truncated')
+        dxgi_format = unpack_from(DX10_HEADER_STRUCT, data, offset + HEADER_SIZE)[0]
+
+    return header, dxgi_format
+
+
+def frame_size(header, dxgi_format=None):
+    """
+    Get size of DDS file from its header.
+    :param header: DdsHeader
+    :param dxgi_format: DXGI format of DX10 header
+    :return: size in bytes or None if the pixel format is unknown
+    """
+
+    block_size, bit_count = 0, 0
+    if dxgi_format is not None:
+        block_size, bit_count = DXGI_FORMAT_SIZES.get(dxgi_format, (0, 0))
+    elif header.pf_flags & DDPF_FOURCC:
+        block_size = FOURCC_BLOCK_SIZES.get(header.fourcc, 0)
+    else:
+        bit_count = header.rgb_bit_count
+
+    if not block_size and not bit_count:
+        return None
+
+    mip_count = header.mip_count if header.flags & DDSD_MIPMAPCOUNT and header.mip_count else 1
+    depth = header.depth if header.flags & DDSD_DEPTH and header.depth else 1
+
+    faces = 1
+    if header.caps2 & DDSCAPS2_CUBEMAP:
+        faces = sum(1 for face in DDSCAPS2_CUBEMAP_FACES if header.caps2 & face)
+
+    width, height, data_size = header.width, header.height, 0
+    for _ in range(mip_count):
+        if block_size:
+            level_size = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+        else:
+            level_size = (width * bit_count + 7) // 8 * height
+        data_size += level_size * depth
+        width, height, depth = max(1, width >> 1), max(1, height >> 1), max(1, depth >> 1)
+
+    size = HEADER_SIZE + data_size * faces
+    if dxgi_format is not None:
+        size += DX10_HEADER_SIZE
+    return size
+
+
+def split_frames(data, offset, num, end=None):
+    """
+    Find bounds of DDS frames stored one after another.
+    Each frame length is computed from its header, scanning for the next magic
+    is used only for unknown pixel formats or padding between frames.
+    :param data: bytes-like object
+    :param offset: position of the first frame
+    :param num: number of frames
+    :param end: position after the last frame, the end of data if None
+    :return: list of (begin, end) positions
+    """
+
+    data_len, bounds = len(data) if end is None else end, []
+    for i in range(num):
+        if offset >= data_len:
+            break
+
+        if data[offset:offset + 4] != MAGIC:
+            raise ImportError('Invalid dds frame_%d' % i)
+        if offset + HEADER_SIZE > data_len:
+            raise ImportError('Invalid dds frame_%d: header is truncated' % i)
+        header, dxgi_format = read_header(data, offset)
+
+        size = frame_size(header, dxgi_format)
+        if size is None:
+            frame_end = _find(data, MAGIC, offset + 4, data_len)
+            frame_end = data_len if frame_end == -1 else frame_end
+        else:
+            frame_end = offset + size
+            if frame_end > data_len:
+                raise ImportError('Invalid dds frame_%d: frame is truncated' % i)
+            if frame_end < data_len and data[frame_end:frame_end + 4] != MAGIC and i + 1 < num:
+                next_frame = _find(data, MAGIC, frame_end, data_len)
+                frame_end = data_len if next_frame == -1 else next_frame
+
+        bounds.append((offset, frame_end))
+        offset = frame_end
+
+    return bounds
+
+
+def _find(data, sub, start, end):
+    if hasattr(data, 'find'):
+        return data.find(sub, start, end)
+    # Views have no find, only the searched range is copied
+    pos = bytes(data[start:end]).find(sub)
+    return pos if pos == -1 else start + pos
+
+
+def pixel_format(header, dxgi_format=None):
+    """
+    Get pixel format the decoder supports.
+    :param header: DdsHeader
+    :param dxgi_format: DXGI format of DX10 header
+    :return: one of FORMAT_* or None
+    """
+
+    if dxgi_format is not None:
+        if dxgi_format in DXGI_RGBA_MASKS:
+            return FORMAT_RGBA
+        return DXGI_FORMATS.get(dxgi_format)
+
+    if header.pf_flags & DDPF_FOURCC:
+        return FOURCC_FORMATS.get(header.fourcc)
+
+    if header.pf_flags & DDPF_RGB and header.rgb_bit_count in (16, 24, 32):
+        return FORMAT_RGBA
+
+    return None
+
+
+def decode(data):
+    """
+    Decode the top mip level of DDS file.
+    :param data: bytes-like DDS file
+    :return: width, height and RGBA data
+    """
+
+    header, dxgi_format = read_header(data)
+    fmt = pixel_format(header, dxgi_format)
+    if fmt is None:
+        raise ImportError('Unsupported dds pixel format')
+
+    width, height = header.width, header.height
+    offset = HEADER_SIZE if dxgi_format is None else HEADER_SIZE + DX10_HEADER_SIZE
+
+    if fmt == FORMAT_RGBA:
+        if dxgi_format is not None:
+            bit_count, masks = 32, DXGI_RGBA_MASKS[dxgi_format]
+        else:
+            bit_count = header.rgb_bit_count
+            masks = (header.r_mask, header.g_mask, header.b_mask,
+                     header.a_mask if header.pf_flags & DDPF_ALPHAPIXELS else 0)
+        size = (width * bit_count + 7) // 8 * height
+        pixels = bytes(data[offset:offset + size])
+        if len(pixels) < size:
+            raise ImportError('Invalid dds frame: frame is truncated')
+        return width, height, _decode_masked(pixels, width, height, bit_count, masks)
+
+    block_size = 8 if fmt == FORMAT_BC1 else 16
+    blocks_x, blocks_y = max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+    size = blocks_x * blocks_y * block_size
+    blocks = bytes(data[offset:offset + size])
+    if len(blocks) < size:
+        raise ImportError('Invalid dds frame: frame is truncated')
+
+    if numpy is not None:
+        rgba = _decode_blocks_numpy(blocks, fmt, blocks_x, blocks_y)
+    else:
+        rgba = _decode_blocks_python(blocks, fmt, blocks_x, blocks_y)
+    return width, height, _crop(rgba, blocks_x * 4, width, height)
+
+
+def make_header(width, height, fmt):
+    """
+    Make header of a block compressed DDS file with one mip level.
+    :param width: texture width
+    :param height: texture height
+    :param fmt: FORMAT_BC1 or FORMAT_BC3
+    :return: DdsHeader
+    """
+
+    fourcc, block_size = (b'DXT1', 8) if fmt == FORMAT_BC1 else (b'DXT5', 16)
+    linear_size = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    return DdsHeader(MAGIC, 124, flags, height, width, linear_size, 0, 0, 32, DDPF_FOURCC, fourcc,
+                     0, 0, 0, 0, 0, DDSCAPS_TEXTURE, 0, 0, 0, 0)
+
+
+def is_opaque(rgba):
+    """
+    Check that every pixel is fully opaque.
+    :param rgba: bytes-like RGBA data
+    :return: True if BC1 keeps the alpha channel exactly
+    """
+
+    return not bytes(rgba)[3::4].strip(b'\xff')
+
+
+def encode(width, height, rgba, fmt=None, quality=QUALITY_NORMAL):
+    """
+    Encode RGBA pixels to a DDS file with one mip level.
+    :param width: texture width
+    :param height: texture height
+    :param rgba: bytes-like RGBA data
+    :param fmt: FORMAT_BC1 or FORMAT_BC3, None picks BC1 for opaque pixels and BC3 otherwise
+    :param quality: one of QUALITY_*
+    :return: DDS file
+    """
+
+    if not width or not height:
+        raise ValueError('Empty dds frame')
+    if len(rgba) != width * height * 4:
+        raise ValueError('Pixel data has wrong size')
+    if fmt is None:
+        fmt = FORMAT_BC1 if is_opaque(rgba) else FORMAT_BC3
+    elif fmt not in (FORMAT_BC1, FORMAT_BC3):
+        raise ValueError('Unsupported dds encoding format: %s' % fmt)
+
+    if numpy is not None:
+        blocks = _encode_blocks_numpy(rgba, width, height, fmt, quality)
+    else:
+        blocks = _encode_blocks_python(rgba, width, height, fmt, quality)
+    return pack(HEADER_STRUCT, *make_header(width, height, fmt)) + blocks
+
+
+def _crop(rgba, row_width, width, height):
+    if row_width == width and len(rgba) == width * height * 4:
+        return rgba
+    row_size, size = row_width * 4, width * 4
+    return b''.join(rgba[y * row_size:y * row_size + size] for y in range(height))
+
+
+def _expand_565(color):
+    r, g, b = (color >> 11) & 0x1f, (color >> 5) & 0x3f, color & 0x1f
+    return (r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)
+
+
+def _color_palette(c0, c1, opaque):
+    rgb0, rgb1 = _expand_565(c0), _expand_565(c1)
+    if c0 > c1 or opaque:
+        rgb2 = tuple((2 * a + b) // 3 for a, b in zip(rgb0, rgb1))
+        rgb3 = tuple((a + 2 * b) // 3 for a, b in zip(rgb0, rgb1))
+        return rgb0 + (255,), rgb1 + (255,), rgb2 + (255,), rgb3 + (255,)
+    rgb2 = tuple((a + b) // 2 for a, b in zip(rgb0, rgb1))
+    return rgb0 + (255,), rgb1 + (255,), rgb2 + (255,), (0, 0, 0, 0)
+
+
+def _alpha_palette(a0, a1):
+    if a0 > a1:
+        return [a0, a1] + [((7 - i) * a0 + i * a1) // 7 for i in range(1, 7)]
+    return [a0, a1] + [((5 - i) * a0 + i * a1) // 5 for i in range(1, 5)] + [0, 255]
+
+
+def _decode_blocks_python(blocks, fmt, blocks_x, blocks_y):
+    """
+    Scalar block decoder, it is also the reference for the vectorized one.
+    """
+
+    block_size = 8 if fmt == FORMAT_BC1 else 16
+    row_size = blocks_x * 16
+    rgba = bytearray(blocks_y * 4 * row_size)
+
+    for i in range(blocks_x * blocks_y):
+        offset = i * block_size
+        alpha = None
+        if fmt == FORMAT_BC2:
+            bits = unpack_from('<Q', blocks, offset)[0]
+            alpha = [((bits >> (4 * p)) & 0xf) * 17 for p in range(16)]
+            offset += 8
+        elif fmt == FORMAT_BC3:
+            a0, a1 = unpack_from('<2B', blocks, offset)
+            bits = unpack_from('<Q', blocks, offset)[0] >> 16
+            palette = _alpha_palette(a0, a1)
+            alpha = [palette[(bits >> (3 * p)) & 0x7] for p in range(16)]
+            offset += 8
+
+        c0, c1, bits = unpack_from('<2HI', blocks, offset)
+        palette = _color_palette(c0, c1, fmt != FORMAT_BC1)
+
+        bx, by = i % blocks_x, i // blocks_x
+        for p in range(16):
+            color = palette[(bits >> (2 * p)) & 0x3]
+            pos = (by * 4 + p // 4) * row_size + (bx * 4 + p % 4) * 4
+            rgba[pos:pos + 3] = bytearray(color[:3])
+            rgba[pos + 3] = color[3] if alpha is None else alpha[p]
+
+    return bytes(rgba)
+
+
+def _decode_blocks_numpy(blocks, fmt, blocks_x, blocks_y):
+    block_size = 8 if fmt == FORMAT_BC1 else 16
+    raw = numpy.frombuffer(blocks, numpy.uint8).reshape(-1, block_size)
+    color_raw = raw[:, block_size - 8:]
+
+    c0 = color_raw[:, 0].astype(numpy.uint32) | (color_raw[:, 1].astype(numpy.uint32) << 8)
+    c1 = color_raw[:, 2].astype(numpy.uint32) | (color_raw[:, 3].astype(numpy.uint32) << 8)
+    bits = numpy.ascontiguousarray(color_raw[:, 4:8]).view('<u4').ravel()
+
+    def expand(c):
+        r, g, b = (c >> 11) & 0x1f, (c >> 5) & 0x3f, c & 0x1f
+        return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+    rgb0, rgb1 = expand(c0), expand(c1)
+    four_colors = (c0 > c1)[:, None] if fmt == FORMAT_BC1 else numpy.ones((len(raw), 1), bool)
+
+    palette = numpy.empty((len(raw), 4, 4), numpy.uint32)
+    palette[:, 0, :3], palette[:, 1, :3] = rgb0, rgb1
+    palette[:, 2, :3] = numpy.where(four_colors, (2 * rgb0 + rgb1) // 3, (rgb0 + rgb1) // 2)
+    palette[:, 3, :3] = numpy.where(four_colors, (rgb0 + 2 * rgb1) // 3, 0)
+    palette[:, :, 3] = 255
+    palette[:, 3, 3] = numpy.where(four_colors[:, 0], 255, 0)
+
+    shifts = numpy.arange(16, dtype=numpy.uint32)
+    selectors = (bits[:, None] >> (2 * shifts)) & 0x3
+    pixels = palette[numpy.arange(len(raw))[:, None], selectors]
+
+    if fmt == FORMAT_BC2:
+        alpha_bits = numpy.ascontiguousarray(raw[:, :8]).view('<u8').ravel()
+        pixels[:, :, 3] = ((alpha_bits[:, None] >> (4 * shifts.astype(numpy.uint64))) & 0xf) * 17
+    elif fmt == FORMAT_BC3:
+        a0, a1 = raw[:, :1].astype(numpy.int32), raw[:, 1:2].astype(numpy.int32)
+        steps7, steps5 = numpy.arange(1, 7, dtype=numpy.int32), numpy.arange(1, 5, dtype=numpy.int32)
+        alpha8 = numpy.hstack([a0, a1, ((7 - steps7) * a0 + steps7 * a1) // 7])
+        alpha6 = numpy.hstack([a0, a1, ((5 - steps5) * a0 + steps5 * a1) // 5,
+                               numpy.zeros_like(a0), numpy.full_like(a0, 255)])
+        alpha_palette = numpy.where(a0 > a1, alpha8, alpha6)
+
+        alpha_raw = numpy.zeros((len(raw), 8), numpy.uint8)
+        alpha_raw[:, :6] = raw[:, 2:8]
+        alpha_bits = alpha_raw.view('<u8').ravel()
+        alpha_selectors = (alpha_bits[:, None] >> (3 * shifts.astype(numpy.uint64))) & 0x7
+        pixels[:, :, 3] = alpha_palette[numpy.arange(len(raw))[:, None], alpha_selectors.astype(numpy.intp)]
+
+    pixels = pixels.astype(numpy.uint8).reshape(blocks_y, blocks_x, 4, 4, 4)
+    return pixels.transpose(0, 2, 1, 3, 4).tobytes()
+
+
+def _decode_masked(pixels, width, height, bit_count, masks):
+    bpp = bit_count // 8
+    row_size = (width * bit_count + 7) // 8
+
+    def channel_params(mask):
+        if not mask:
+            return 0, 0, 0
+        shift = 0
+        while not (mask >> shift) & 1:
+            shift += 1
+        return mask, shift, (mask >> shift)
+
+    params = [channel_params(mask) for mask in masks]
+
+    if numpy is not None:
+        raw = numpy.frombuffer(pixels, numpy.uint8).reshape(height, row_size)[:, :width * bpp]
+        values = numpy.zeros((height, width), numpy.uint32)
+        for i in range(bpp):
+            values |= raw[:, i::bpp].astype(numpy.uint32) << (8 * i)
+        rgba = numpy.empty((height, width, 4), numpy.uint8)
+        for i, (mask, shift, max_value) in enumerate(params):
+            if mask:
+                rgba[:, :, i] = ((values & mask) >> shift) * 255 // max_value
+            else:
+                rgba[:, :, i] = 255 if i == 3 else 0
+        return rgba.tobytes()
+
+    raw, rgba = bytearray(pixels), bytearray(width * height * 4)
+    for y in range(height):
+        for x in range(width):
+            pos = y * row_size + x * bpp
+            value = 0
+            for i in range(bpp):
+                value |= raw[pos + i] << (8 * i)
+            out = (y * width + x) * 4
+            for i, (mask, shift, max_value) in enumerate(params):
+                rgba[out + i] = ((value & mask) >> shift) * 255 // max_value if mask else (255 if i == 3 else 0)
+    return bytes(rgba)
+
+
+def _pack_565(color):
+    r, g, b = [min(max(int(v * scale / 255.0 + 0.5), 0), scale) for v, scale in zip(color, (31, 63, 31))]
+    return (r << 11) | (g << 5) | b
+
+
+def _color_block(c0, c1, selectors):
+    # Endpoints are ordered so that BC1 decoders use the four colors mode
+    if c0 < c1:
+        c0, c1 = c1, c0
+        selectors = [(1, 0, 3, 2)[s] for s in selectors]
+    elif c0 == c1:
+        selectors = [0] * 16
+    bits = 0
+    for p, s in enumerate(selectors):
+        bits |= s << (2 * p)
+    return pack('<2HI', c0, c1, bits)
+
+
+def _fit_colors_python(colors, c0, c1):
+    palette = _color_palette(c0, c1, True)
+    selectors, error = [], 0
+    for color in colors:
+        distances = [sum((a - b) ** 2 for a, b in zip(color, entry[:3])) for entry in palette]
+        selector = distances.index(min(distances))
+        selectors.append(selector)
+        error += distances[selector]
+    return selectors, error
+
+
+def _color_endpoints_python(colors, quality):
+    lo = [min(c[i] for c in colors) for i in range(3)]
+    hi = [max(c[i] for c in colors) for i in range(3)]
+    mean = [sum(c[i] for c in colors) / 16.0 for i in range(3)]
+    centered = [[c[i] - mean[i] for i in range(3)] for c in colors]
+
+    # Channels falling while the widest channel rises run between the other corners of the bounding box
+    widest = max(range(3), key=lambda i: hi[i] - lo[i])
+    falling = [sum(p[i] * p[widest] for p in centered) < 0 for i in range(3)]
+    if quality == QUALITY_FAST:
+        # Bounding box diagonal inset by 1/16 of its size
+        inset = [(h - l) / 16.0 for l, h in zip(lo, hi)]
+        return ([l + d if f else h - d for l, h, d, f in zip(lo, hi, inset, falling)],
+                [h - d if f else l + d for l, h, d, f in zip(lo, hi, inset, falling)])
+
+    cov = [[sum(p[i] * p[j] for p in centered) for j in range(3)] for i in range(3)]
+    axis = [float(l - h if f else h - l) for l, h, f in zip(lo, hi, falling)]
+    for _ in range(AXIS_ITERATIONS):
+        axis = [sum(cov[i][j] * axis[j] for j in range(3)) for i in range(3)]
+        norm = max(sqrt(sum(a * a for a in axis)), 1e-12)
+        axis = [a / norm for a in axis]
+
+    t = [sum(p[i] * axis[i] for i in range(3)) for p in centered]
+    t_max, t_min = max(t), min(t)
+    return [m + a * t_max for m, a in zip(mean, axis)], [m + a * t_min for m, a in zip(mean, axis)]
+
+
+def _encode_color_python(colors, quality):
+    e0, e1 = _color_endpoints_python(colors, quality)
+    c0, c1 = _pack_565(e0), _pack_565(e1)
+    selectors, error = _fit_colors_python(colors, c0, c1)
+
+    for _ in range(REFINE_ITERATIONS if quality == QUALITY_HIGH else 0):
+        # Least squares endpoints for the selected colors
+        w0 = [COLOR_WEIGHTS[s] for s in selectors]
+        a = sum(w * w for w in w0)
+        b = sum(w * (1 - w) for w in w0)
+        c = sum((1 - w) * (1 - w) for w in w0)
+        det = a * c - b * b
+        if det < 1e-6:
+            break
+        x0 = [sum(w * color[i] for w, color in zip(w0, colors)) for i in range(3)]
+        x1 = [sum((1 - w) * color[i] for w, color in zip(w0, colors)) for i in range(3)]
+        new_c0 = _pack_565([(c * v0 - b * v1) / det for v0, v1 in zip(x0, x1)])
+        new_c1 = _pack_565([(a * v1 - b * v0) / det for v0, v1 in zip(x0, x1)])
+        new_selectors, new_error = _fit_colors_python(colors, new_c0, new_c1)
+        if new_error >= error:
+            break
+        c0, c1, selectors, error = new_c0, new_c1, new_selectors, new_error
+
+    return _color_block(c0, c1, selectors)
+
+
+def _fit_alpha_python(alphas, a0, a1):
+    palette = _alpha_palette(a0, a1)
+    selectors, error = [], 0
+    for alpha in alphas:
+        distances = [(alpha - entry) ** 2 for entry in palette]
+        selector = distances.index(min(distances))
+        selectors.append(selector)
+        error += distances[selector]
+    return selectors, error
+
+
+def _encode_alpha_python(alphas, quality):
+    a0, a1 = max(alphas), min(alphas)
+    selectors, error = _fit_alpha_python(alphas, a0, a1)
+
+    if quality == QUALITY_HIGH:
+        # Six alpha mode has exact 0 and 255, so the other values get finer steps
+        inner = [a for a in alphas if 0 < a < 255]
+        b0, b1 = (min(inner), max(inner)) if inner else (0, 255)
+        new_selectors, new_error = _fit_alpha_python(alphas, b0, b1)
+        if new_error < error:
+            a0, a1, selectors = b0, b1, new_selectors
+
+    bits = 0
+    for p, s in enumerate(selectors):
+        bits |= s << (3 * p)
+    return pack('<2B', a0, a1) + pack('<Q', bits)[:6]
+
+
+def _encode_blocks_python(rgba, width, height, fmt, quality):
+    """
+    Scalar block encoder, it is also the reference for the vectorized one.
+    Pixels outside of the texture repeat the last row and column.
+    """
+
+    rgba = bytearray(rgba)
+    blocks = []
+    for by in range(max(1, (height + 3) // 4)):
+        rows = [min(by * 4 + i, height - 1) * width for i in range(4)]
+        for bx in range(max(1, (width + 3) // 4)):
+            columns = [min(bx * 4 + i, width - 1) for i in range(4)]
+            pixels = [rgba[(row + x) * 4:(row + x) * 4 + 4] for row in rows for x in columns]
+            if fmt == FORMAT_BC3:
+                blocks.append(_encode_alpha_python([p[3] for p in pixels], quality))
+            blocks.append(_encode_color_python([tuple(p[:3]) for p in pixels], quality))
+    return b''.join(blocks)
+
+
+def _pack_565_numpy(color):
+    scale = numpy.array([31, 63, 31])
+    c = numpy.clip(numpy.floor(color * (scale / 255.0) + 0.5), 0, scale).astype(numpy.int32)
+    return (c[:, 0] << 11) | (c[:, 1] << 5) | c[:, 2]
+
+
+def _fit_colors_numpy(rgb, c0, c1):
+    def expand(c):
+        r, g, b = (c >> 11) & 0x1f, (c >> 5) & 0x3f, c & 0x1f
+        return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+    rgb0, rgb1 = expand(c0), expand(c1)
+    palette = numpy.stack([rgb0, rgb1, (2 * rgb0 + rgb1) // 3, (rgb0 + 2 * rgb1) // 3], 1)
+    diff = rgb[:, :, None, :] - palette[:, None, :, :]
+    distances = numpy.einsum('npci,npci->npc', diff, diff)
+    selectors = distances.argmin(2)
+    return selectors, distances.min(2).sum(1)
+
+
+def _encode_colors_numpy(pixels, quality):
+    rgb = pixels[:, :, :3].astype(numpy.int32)
+    lo, hi = rgb.min(1).astype(numpy.float64), rgb.max(1).astype(numpy.float64)
+    mean = rgb.mean(1)
+    centered = rgb - mean[:, None, :]
+
+    widest = (hi - lo).argmax(1)
+    falling = numpy.einsum('npi,np->ni', centered, centered[numpy.arange(len(rgb)), :, widest]) < 0
+    if quality == QUALITY_FAST:
+        inset = (hi - lo) / 16.0
+        e0 = numpy.where(falling, lo + inset, hi - inset)
+        e1 = numpy.where(falling, hi - inset, lo + inset)
+    else:
+        cov = numpy.einsum('npi,npj->nij', centered, centered)
+        axis = numpy.where(falling, lo - hi, hi - lo)
+        for _ in range(AXIS_ITERATIONS):
+            axis = numpy.einsum('nij,nj->ni', cov, axis)
+            axis /= numpy.maximum(numpy.sqrt((axis * axis).sum(1)), 1e-12)[:, None]
+        t = numpy.einsum('npi,ni->np', centered, axis)
+        e0, e1 = mean + axis * t.max(1)[:, None], mean + axis * t.min(1)[:, None]
+
+    c0, c1 = _pack_565_numpy(e0), _pack_565_numpy(e1)
+    selectors, error = _fit_colors_numpy(rgb, c0, c1)
+
+    weights = numpy.array(COLOR_WEIGHTS)
+    for _ in range(REFINE_ITERATIONS if quality == QUALITY_HIGH else 0):
+        w0 = weights[selectors]
+        w1 = 1 - w0
+        a, b, c = (w0 * w0).sum(1), (w0 * w1).sum(1), (w1 * w1).sum(1)
+        det = a * c - b * b
+        solvable = det >= 1e-6
+        det = numpy.where(solvable, det, 1)[:, None]
+        x0, x1 = numpy.einsum('np,npi->ni', w0, rgb), numpy.einsum('np,npi->ni', w1, rgb)
+        new_c0 = _pack_565_numpy((c[:, None] * x0 - b[:, None] * x1) / det)
+        new_c1 = _pack_565_numpy((a[:, None] * x1 - b[:, None] * x0) / det)
+        new_selectors, new_error = _fit_colors_numpy(rgb, new_c0, new_c1)
+        better = solvable & (new_error < error)
+        c0, c1 = numpy.where(better, new_c0, c0), numpy.where(better, new_c1, c1)
+        selectors = numpy.where(better[:, None], new_selectors, selectors)
+        error = numpy.where(better, new_error, error)
+
+    swap = c0 < c1
+    c0, c1 = numpy.where(swap, c1, c0), numpy.where(swap, c0, c1)
+    selectors = numpy.where(swap[:, None], numpy.array([1, 0, 3, 2])[selectors], selectors)
+    selectors[c0 == c1] = 0
+
+    shifts = 2 * numpy.arange(16, dtype=numpy.uint32)
+    bits = (selectors.astype(numpy.uint32) << shifts).sum(1, dtype=numpy.uint32)
+    out = numpy.empty((len(pixels), 8), numpy.uint8)
+    out[:, 0:2] = c0.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    out[:, 2:4] = c1.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    out[:, 4:8] = bits.astype('<u4').view(numpy.uint8).reshape(-1, 4)
+    return out
+
+
+def _fit_alpha_numpy(alpha, a0, a1):
+    a0, a1 = a0[:, None], a1[:, None]
+    steps7, steps5 = numpy.arange(1, 7, dtype=numpy.int32), numpy.arange(1, 5, dtype=numpy.int32)
+    alpha8 = numpy.hstack([a0, a1, ((7 - steps7) * a0 + steps7 * a1) // 7])
+    alpha6 = numpy.hstack([a0, a1, ((5 - steps5) * a0 + steps5 * a1) // 5,
+                           numpy.zeros_like(a0), numpy.full_like(a0, 255)])
+    palette = numpy.where(a0 > a1, alpha8, alpha6)
+    diff = alpha[:, :, None] - palette[:, None, :]
+    distances = diff * diff
+    return distances.argmin(2), distances.min(2).sum(1)
+
+
+def _encode_alpha_numpy(pixels, quality):
+    alpha = pixels[:, :, 3].astype(numpy.int32)
+    a0, a1 = alpha.max(1), alpha.min(1)
+    selectors, error = _fit_alpha_numpy(alpha, a0, a1)
+
+    if quality == QUALITY_HIGH:
+        inner = (alpha > 0) & (alpha < 255)
+        b0, b1 = numpy.where(inner, alpha, 256).min(1), numpy.where(inner, alpha, -1).max(1)
+        empty = b0 > b1
+        b0, b1 = numpy.where(empty, 0, b0), numpy.where(empty, 255, b1)
+        new_selectors, new_error = _fit_alpha_numpy(alpha, b0, b1)
+        better = new_error < error
+        a0, a1 = numpy.where(better, b0, a0), numpy.where(better, b1, a1)
+        selectors = numpy.where(better[:, None], new_selectors, selectors)
+
+    shifts = 3 * numpy.arange(16, dtype=numpy.uint64)
+    bits = (selectors.astype(numpy.uint64) << shifts).sum(1, dtype=numpy.uint64)
+    out = numpy.empty((len(pixels), 8), numpy.uint8)
+    out[:, 0], out[:, 1] = a0, a1
+    out[:, 2:8] = bits.astype('<u8').view(numpy.uint8).reshape(-1, 8)[:, :6]
+    return out
+
+
+def _encode_blocks_numpy(rgba, width, height, fmt, quality):
+    blocks_x, blocks_y = max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+    pixels = numpy.frombuffer(rgba, numpy.uint8).reshape(height, width, 4)
+    pixels = numpy.pad(pixels, ((0, blocks_y * 4 - height), (0, blocks_x * 4 - width), (0, 0)), 'edge')
+    pixels = pixels.reshape(blocks_y, 4, blocks_x, 4, 4).transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+
+    chunks = []
+    for start in range(0, len(pixels), ENCODE_CHUNK_BLOCKS):
+        chunk = pixels[start:start + ENCODE_CHUNK_BLOCKS]
+        color = _encode_colors_numpy(chunk, quality)
+        chunks.append(numpy.hstack([_encode_alpha_numpy(chunk, quality), color]) if fmt == FORMAT_BC3 else color)
+    return numpy.vstack(chunks).tobytes()
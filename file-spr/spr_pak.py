@@ -0,0 +1,203 @@
+"""
+Half-Life PAK archives.
+
+The directory of an archive is read once into an index of entries, then entries are
+handed out as zero-copy views of the memory-mapped archive. Sprites are read straight
+from the archive without extracting it.
+
+Files inside an archive are addressed by paths that continue past the archive file,
+such as valve/pak0.pak/sprites/muzzleflash1.spr.
+"""
+
+from collections import namedtuple
+from struct import unpack_from
+import mmap
+import os
+
+from spr_codec import SpriteReader, _PATH_TYPES, data_view
+
+MAGIC = b'PACK'
+HEADER_STRUCT = '<4s2i'
+HEADER_SIZE = 12
+ENTRY_STRUCT = '<56s2i'
+ENTRY_SIZE = 64
+
+PakEntry = namedtuple('PakEntry', ['name', 'offset', 'size'])
+
+# Archives opened by open_archive, they stay open for the life of the process
+_archives = {}
+
+
+def normalize_name(name):
+    """
+    Get lookup key of an entry name, the game looks entries up without regard to case.
+    """
+
+    return name.replace('\\', '/').lower()
+
+
+class PakReader:
+    """
+    PAK archive reader with an in-memory index of entries.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: file path or bytes-like object
+        """
+
+        self._fd = None
+        self._mmap = None
+        if isinstance(source, _PATH_TYPES):
+            self._fd = open(source, 'rb')
+            try:
+                self._data = self._mmap = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                self.close()
+                raise ImportError('Invalid pak file')
+        else:
+            self._data = source
+
+        try:
+            self._read_directory()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Entry views are still alive, the mapping is released along with them
+                pass
+        if self._fd is not None:
+            self._fd.close()
+
+    def entry(self, name):
+        """
+        Find entry by name.
+        :param name: entry name, case and slashes are not significant
+        :return: PakEntry
+        """
+
+        try:
+            return self._index[normalize_name(name)]
+        except KeyError:
+            raise KeyError('No entry %s in the pak file' % name)
+
+    def read(self, name):
+        """
+        Get entry data.
+        :param name: entry name
+        :return: zero-copy view
+        """
+
+        entry = self.entry(name)
+        return data_view(self._data, entry.offset, entry.size)
+
+    def sprites(self):
+        """
+        Get sprite entries.
+        :return: list of PakEntry in directory order
+        """
+
+        return [entry for entry in self.entries if normalize_name(entry.name).endswith('.spr')]
+
+    def open_sprite(self, name):
+        """
+        Open sprite entry, the reader views the archive and must be closed before it.
+        :param name: entry name
+        :return: SpriteReader
+        """
+
+        return SpriteReader(self.read(name))
+
+    def _read_directory(self):
+        data, data_len = self._data, len(self._data)
+        if data_len < HEADER_SIZE or data[:4] != MAGIC:
+            raise ImportError('Invalid pak file')
+
+        _, dir_offset, dir_size = unpack_from(HEADER_STRUCT, data, 0)
+        if dir_offset < HEADER_SIZE or dir_size < 0 or dir_size % ENTRY_SIZE or dir_offset + dir_size > data_len:
+            raise ImportError('Invalid pak file: directory is truncated')
+
+        self.entries, self._index = [], {}
+        for offset in range(dir_offset, dir_offset + dir_size, ENTRY_SIZE):
+            name, entry_offset, size = unpack_from(ENTRY_STRUCT, data, offset)
+            name = name.split(b'\0', 1)[0]
+            if str is not bytes:
+                name = name.decode('latin-1')
+            if entry_offset < 0 or size < 0 or entry_offset + size > data_len:
+                raise ImportError('Invalid pak file: entry %s is truncated' % name)
+
+            entry = PakEntry(name, entry_offset, size)
+            self.entries.append(entry)
+            # The first of duplicate entries is found, like in the game
+            self._index.setdefault(normalize_name(name), entry)
+
+
+def split_path(path):
+    """
+    Split path of a file inside an archive.
+    :param path: file path, such as valve/pak0.pak/sprites/a.spr
+    :return: archive path and entry name, entry name is None for files outside of archives
+    """
+
+    parts = path.replace('\\', '/').split('/')
+    for i in range(1, len(parts)):
+        archive_path = os.sep.join(parts[:i]) or os.sep
+        if parts[i - 1].lower().endswith('.pak') and os.path.isfile(archive_path):
+            return archive_path, '/'.join(parts[i:])
+    return path, None
+
+
+def open_archive(path):
+    """
+    Get archive opened once per process, so batch tools handling its entries one by one
+    read the directory only once.
+    :param path: archive path
+    :return: PakReader
+    """
+
+    archive = _archives.get(path)
+    if archive is None:
+        archive = _archives[path] = PakReader(path)
+    return archive
+
+
+def open_sprite(path):
+    """
+    Open sprite file or sprite inside an archive.
+    :param path: file path, such as sprites/a.spr or valve/pak0.pak/sprites/a.spr
+    :return: SpriteReader
+    """
+
+    archive_path, name = split_path(path)
+    if name is not None:
+        return open_archive(archive_path).open_sprite(name)
+    if os.path.splitext(path)[1].lower() == '.pak':
+        # Archives that can not be opened are reported with their own error
+        open_archive(path)
+    return SpriteReader(path)
+
+
+def find_sprites(path):
+    """
+    Get paths of sprites in an archive.
+    :param path: archive path
+    :return: list of paths continuing past the archive path, an archive that can not be opened
+        is returned as the only path, so its error is reported when it is read
+    """
+
+    try:
+        archive = open_archive(path)
+    except (ImportError, EnvironmentError):
+        return [path]
+    return [os.path.join(path, *entry.name.replace('\\', '/').split('/')) for entry in archive.sprites()]
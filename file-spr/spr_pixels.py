@@ -0,0 +1,400 @@
+"""
+Pixel data helpers for sprite frames.
+
+Frames are 8 bit palette indices, so scaling uses nearest neighbour sampling,
+which keeps every index valid for the palette.
+"""
+
+from operator import itemgetter
+
+from spr_codec import SpriteCodec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def fit_size(width, height, max_size):
+    """
+    Get size of the frame scaled down to fit in a square.
+    :param width: frame width
+    :param height: frame height
+    :param max_size: square side
+    :return: new width and height, frames are never scaled up
+    """
+
+    scale = float(max_size) / max(width, height, 1)
+    if scale >= 1.0:
+        return width, height
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def scale_nearest(data, width, height, new_width, new_height, bpp=1):
+    """
+    Scale pixel data with nearest neighbour sampling.
+    :param data: bytes-like pixel data
+    :param width: source width
+    :param height: source height
+    :param new_width: result width
+    :param new_height: result height
+    :param bpp: bytes per pixel
+    :return: scaled pixel data
+    """
+
+    if (new_width, new_height) == (width, height):
+        return bytes(data)
+
+    xs = [x * width // new_width for x in range(new_width)]
+    ys = [y * height // new_height for y in range(new_height)]
+
+    if numpy is not None:
+        pixels = numpy.frombuffer(data, numpy.uint8, width * height * bpp).reshape(height, width, bpp)
+        return pixels[ys][:, xs].tobytes()
+
+    row_size = width * bpp
+    if bpp == 1:
+        columns = xs
+    else:
+        columns = [x * bpp + c for x in xs for c in range(bpp)]
+    get_columns = itemgetter(*columns) if len(columns) > 1 else lambda row: (row[columns[0]],)
+
+    data = bytes(data)
+    rows, last_y, last_row = [], None, None
+    for y in ys:
+        if y != last_y:
+            last_y, last_row = y, bytes(bytearray(get_columns(bytearray(data[y * row_size:(y + 1) * row_size]))))
+        rows.append(last_row)
+    return b''.join(rows)
+
+
+def alpha_table(texture_format, palette_size):
+    """
+    Get lookup table from palette index to layer alpha.
+    :param texture_format: sprite texture format
+    :param palette_size: number of palette colors
+    :return: 256 bytes table or None if the texture format has no alpha channel
+    """
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_INDEXALPHA:
+        return bytes(bytearray(range(256)))
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_ALPHATEST:
+        last_index = palette_size - 1
+        return bytes(bytearray(0 if i >= last_index else 0xff for i in range(256)))
+
+    return None
+
+
+def interleave(indices, alpha):
+    """
+    Make two channel pixel data from indices and alpha.
+    :param indices: bytes-like indices
+    :param alpha: bytes-like alpha, same length
+    :return: pixel data
+    """
+
+    if numpy is not None:
+        pixels = numpy.empty((len(indices), 2), numpy.uint8)
+        pixels[:, 0] = numpy.frombuffer(indices, numpy.uint8)
+        pixels[:, 1] = numpy.frombuffer(alpha, numpy.uint8)
+        return pixels.tobytes()
+
+    pixels = bytearray(len(indices) * 2)
+    pixels[0::2] = indices
+    pixels[1::2] = alpha
+    return bytes(pixels)
+
+
+def expand_indices(indices, texture_format, palette_size):
+    """
+    Convert frame indices to GIMP layer pixel data.
+    :param indices: bytes-like frame indices
+    :param texture_format: sprite texture format
+    :param palette_size: number of palette colors
+    :return: pixel data, one byte per pixel for formats without alpha, two bytes otherwise
+    """
+
+    indices = bytes(indices)
+    table = alpha_table(texture_format, palette_size)
+    if table is None:
+        return indices
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_INDEXALPHA:
+        return interleave(indices, indices)
+
+    return interleave(indices, indices.translate(table))
+
+
+def crop(data, width, x, y, crop_width, crop_height, bpp=1):
+    """
+    Cut rectangle from pixel data.
+    :param data: bytes-like pixel data
+    :param width: source width
+    :param x: rectangle left
+    :param y: rectangle top
+    :param crop_width: rectangle width
+    :param crop_height: rectangle height
+    :param bpp: bytes per pixel
+    :return: pixel data of the rectangle
+    """
+
+    row_size = width * bpp
+    return b''.join(bytes(data[(y + row) * row_size + x * bpp:(y + row) * row_size + (x + crop_width) * bpp])
+                    for row in range(crop_height))
+
+
+def opacity_table(texture_format, palette):
+    """
+    Get lookup table from palette index to opacity mask the engine draws the frame with.
+    Indexalpha index 0, alphatest last index and black colors of additive frames are invisible.
+    :param texture_format: sprite texture format
+    :param palette: sprite palette, 3 bytes per color
+    :return: 256 bytes table, 0 for invisible indices and 1 otherwise, or None if all indices are visible
+    """
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_INDEXALPHA:
+        return b'\0' + b'\1' * 255
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_ALPHATEST:
+        last_index = len(palette) // 3 - 1
+        return bytes(bytearray(0 if i >= last_index else 1 for i in range(256)))
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_ADDITIVE:
+        colors = bytearray(palette[:768])
+        colors.extend(bytearray(768 - len(colors)))
+        return bytes(bytearray(1 if any(colors[i * 3:i * 3 + 3]) else 0 for i in range(256)))
+
+    return None
+
+
+def opaque_bounds(indices, width, height, table):
+    """
+    Find bounding box of visible pixels.
+    :param indices: bytes-like frame indices
+    :param width: frame width
+    :param height: frame height
+    :param table: opacity table from opacity_table
+    :return: left, top, width and height of the box, or None if the frame has no visible pixels
+    """
+
+    if numpy is not None:
+        lut = numpy.frombuffer(table, numpy.uint8)
+        mask = lut[numpy.frombuffer(indices, numpy.uint8, width * height).reshape(height, width)]
+        rows, columns = numpy.flatnonzero(mask.any(1)), numpy.flatnonzero(mask.any(0))
+        if not len(rows):
+            return None
+        return int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1)
+
+    mask = bytes(indices).translate(table)
+    end = len(mask.rstrip(b'\0'))
+    if not end:
+        return None
+    top = (len(mask) - len(mask.lstrip(b'\0'))) // width
+    bottom = (end - 1) // width
+
+    left, right = width, 0
+    for y in range(top, bottom + 1):
+        row = mask[y * width:(y + 1) * width]
+        row_end = len(row.rstrip(b'\0'))
+        if row_end:
+            left = min(left, width - len(row.lstrip(b'\0')))
+            right = max(right, row_end)
+    return left, top, right - left, bottom - top + 1
+
+
+def union_bounds(a, b):
+    """
+    Get bounding box of two boxes.
+    :param a: left, top, width and height, or None
+    :param b: left, top, width and height, or None
+    :return: box containing both boxes, or None if both are None
+    """
+
+    if a is None or b is None:
+        return a or b
+    left, top = min(a[0], b[0]), min(a[1], b[1])
+    right, bottom = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return left, top, right - left, bottom - top
+
+
+def crop_params(params, bounds):
+    """
+    Get params of frame cropped to a box, origin is moved so the frame stays in place.
+    :param params: frame params
+    :param bounds: left, top, width and height of the box
+    :return: frame params
+    """
+
+    x, y, width, height = bounds
+    return params._replace(origin_x=params.origin_x + x, origin_y=params.origin_y - y, width=width, height=height)
+
+
+def crop_frame(params, indices, table):
+    """
+    Crop frame to its visible pixels, origin is moved so the frame stays in place.
+    :param params: frame params
+    :param indices: bytes-like frame indices
+    :param table: opacity table from opacity_table
+    :return: cropped frame params and indices, frames without visible pixels become 1x1
+    """
+
+    bounds = opaque_bounds(indices, params.width, params.height, table) or (0, 0, 1, 1)
+    x, y, width, height = bounds
+    if (width, height) == (params.width, params.height):
+        return params, indices
+
+    return crop_params(params, bounds), crop(indices, params.width, x, y, width, height)
+
+
+def palette_tables(palette):
+    """
+    Split palette to lookup tables of color channels.
+    :param palette: sprite palette, 3 bytes per color
+    :return: red, green and blue tables, 256 bytes each
+    """
+
+    colors = bytearray(palette[:768])
+    colors.extend(bytearray(768 - len(colors)))
+    return bytes(colors[0::3]), bytes(colors[1::3]), bytes(colors[2::3])
+
+
+def preview_alpha_table(texture_format, palette):
+    """
+    Get lookup table from palette index to alpha the texture format is drawn with.
+    Additive frames get alpha from color brightness.
+    :param texture_format: sprite texture format
+    :param palette: sprite palette, 3 bytes per color
+    :return: 256 bytes table
+    """
+
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_ADDITIVE:
+        colors = bytearray(palette[:768])
+        colors.extend(bytearray(768 - len(colors)))
+        return bytes(bytearray(sum(colors[i * 3:i * 3 + 3]) // 3 for i in range(256)))
+
+    table = alpha_table(texture_format, len(palette) // 3)
+    return table if table is not None else b'\xff' * 256
+
+
+def layer_rgba(data, bpp, palette=None):
+    """
+    Convert GIMP layer pixel data to RGBA data.
+    :param data: bytes-like pixel data of RGB, grayscale or indexed layer with or without alpha
+    :param bpp: bytes per pixel
+    :param palette: colormap of indexed layers, None for other layers
+    :return: RGBA data
+    """
+
+    data = bytes(data)
+    if palette is not None:
+        indices = data if bpp == 1 else data[0::2]
+        rgba = bytearray(render_rgba(indices, SpriteCodec.TEXTURE_FORMAT_NORMAL, palette))
+    else:
+        color_channels = 3 if bpp >= 3 else 1
+        rgba = bytearray(len(data) // bpp * 4)
+        for channel in range(3):
+            rgba[channel::4] = data[min(channel, color_channels - 1)::bpp]
+        rgba[3::4] = b'\xff' * (len(rgba) // 4)
+
+    if bpp in (2, 4):
+        rgba[3::4] = data[bpp - 1::bpp]
+    return bytes(rgba)
+
+
+def render_rgba(indices, texture_format, palette):
+    """
+    Convert frame indices to RGBA data.
+    :param indices: bytes-like frame indices
+    :param texture_format: sprite texture format
+    :param palette: sprite palette, 3 bytes per color
+    :return: RGBA data
+    """
+
+    indices = bytes(indices)
+    tables = palette_tables(palette) + (preview_alpha_table(texture_format, palette),)
+
+    if numpy is not None:
+        lut = numpy.frombuffer(b''.join(tables), numpy.uint8).reshape(4, 256).T
+        return lut[numpy.frombuffer(indices, numpy.uint8)].tobytes()
+
+    pixels = bytearray(len(indices) * 4)
+    for channel, table in enumerate(tables):
+        pixels[channel::4] = indices.translate(table)
+    return bytes(pixels)
+
+
+def composite_tables(texture_format, palette, background):
+    """
+    Get lookup tables from palette index to the color a frame is drawn with over a solid background.
+    Colors are blended like in the engine: additive colors are added to the background, indexalpha
+    frames are drawn with the last palette color and the index as alpha, alphatest frames skip the last color.
+    :param texture_format: sprite texture format
+    :param palette: sprite palette, 3 bytes per color
+    :param background: background color, tuple of red, green and blue
+    :return: red, green and blue tables, 256 bytes each
+    """
+
+    colors = [bytearray(table) for table in palette_tables(palette)]
+    alpha = bytearray(alpha_table(texture_format, len(palette) // 3) or b'\xff' * 256)
+    if texture_format == SpriteCodec.TEXTURE_FORMAT_INDEXALPHA:
+        last_index = max(len(palette) // 3 - 1, 0)
+        colors = [bytearray([channel[last_index]]) * 256 for channel in colors]
+
+    tables = []
+    for channel, back in zip(colors, background):
+        if texture_format == SpriteCodec.TEXTURE_FORMAT_ADDITIVE:
+            table = bytearray(min(back + c, 255) for c in channel)
+        else:
+            table = bytearray((c * a + back * (255 - a) + 127) // 255 for c, a in zip(channel, alpha))
+        tables.append(bytes(table))
+    return tuple(tables)
+
+
+def render_rgb(indices, tables):
+    """
+    Convert frame indices to RGB data.
+    :param indices: bytes-like frame indices
+    :param tables: red, green and blue lookup tables, such as composite_tables
+    :return: RGB data
+    """
+
+    indices = bytes(indices)
+    if numpy is not None:
+        lut = numpy.frombuffer(b''.join(tables), numpy.uint8).reshape(3, 256).T
+        return lut[numpy.frombuffer(indices, numpy.uint8)].tobytes()
+
+    pixels = bytearray(len(indices) * 3)
+    for channel, table in enumerate(tables):
+        pixels[channel::3] = indices.translate(table)
+    return bytes(pixels)
+
+
+def composite_rgba(rgba, background, additive=False):
+    """
+    Blend RGBA data over a solid background.
+    :param rgba: bytes-like RGBA data
+    :param background: background color, tuple of red, green and blue
+    :param additive: add colors scaled by alpha to the background instead of alpha blending
+    :return: RGB data
+    """
+
+    if numpy is not None:
+        pixels = numpy.frombuffer(bytes(rgba), numpy.uint8).reshape(-1, 4).astype(numpy.uint16)
+        color, alpha = pixels[:, :3], pixels[:, 3:]
+        back = numpy.array(background, numpy.uint16)
+        if additive:
+            rgb = numpy.minimum(back + (color * alpha + 127) // 255, 255)
+        else:
+            rgb = (color * alpha + back * (255 - alpha) + 127) // 255
+        return rgb.astype(numpy.uint8).tobytes()
+
+    rgba = bytearray(rgba)
+    pixels = bytearray(len(rgba) // 4 * 3)
+    for channel, back in enumerate(background):
+        color, alpha = rgba[channel::4], rgba[3::4]
+        if additive:
+            pixels[channel::3] = bytearray(min(back + (c * a + 127) // 255, 255) for c, a in zip(color, alpha))
+        else:
+            pixels[channel::3] = bytearray((c * a + back * (255 - a) + 127) // 255 for c, a in zip(color, alpha))
+    return bytes(pixels)
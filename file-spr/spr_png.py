@@ -0,0 +1,225 @@
+"""
+Minimal PNG reader/writer for sprite frames.
+
+Supports non-interlaced 8 bit images: indexed (with palette and transparency),
+grayscale, RGB and their alpha variants. Animated PNG (APNG) is written with full-size frames.
+"""
+
+from collections import namedtuple
+from struct import pack, unpack_from
+import zlib
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+COLOR_TYPE_L, COLOR_TYPE_RGB, COLOR_TYPE_P, COLOR_TYPE_LA, COLOR_TYPE_RGBA = 0, 2, 3, 4, 6
+CHANNELS = {
+    COLOR_TYPE_L: 1,
+    COLOR_TYPE_RGB: 3,
+    COLOR_TYPE_P: 1,
+    COLOR_TYPE_LA: 2,
+    COLOR_TYPE_RGBA: 4,
+}
+
+PngImage = namedtuple('PngImage', [
+    'width',
+    'height',
+    'color_type',
+    'data',
+    'palette',
+    'transparency',
+    'text'
+])
+
+
+def _chunk(chunk_type, data):
+    return pack('>I', len(data)) + chunk_type + data + pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def write_png(fd, width, height, data, color_type=COLOR_TYPE_P, palette=None, transparency=None, text=None,
+              compress_level=6):
+    """
+    Write PNG image.
+    :param fd: binary file object
+    :param width: image width
+    :param height: image height
+    :param data: bytes-like pixel data without filter bytes, or list or iterator of rows
+    :param color_type: one of COLOR_TYPE_*
+    :param palette: palette data, 3 bytes per color, for indexed images
+    :param transparency: alpha of palette colors for indexed images
+    :param text: dict of tEXt keywords and values
+    :param compress_level: zlib compression level
+    """
+
+    _write_head(fd, width, height, color_type, palette, transparency, text)
+    fd.write(_chunk(b'IDAT', _compress(width, height, data, color_type, compress_level)))
+    fd.write(_chunk(b'IEND', b''))
+
+
+def write_apng(fd, width, height, frames, frames_number, color_type=COLOR_TYPE_RGB, palette=None,
+               transparency=None, plays=0, compress_level=6):
+    """
+    Write animated PNG image, viewers without APNG support show the first frame.
+    :param fd: binary file object
+    :param width: image width
+    :param height: image height
+    :param frames: iterable of (pixel data, delay in seconds), pixel data as in write_png
+    :param frames_number: number of frames
+    :param color_type: one of COLOR_TYPE_*
+    :param palette: palette data, 3 bytes per color, for indexed images
+    :param transparency: alpha of palette colors for indexed images
+    :param plays: number of times the animation is played, 0 loops forever
+    :param compress_level: zlib compression level
+    """
+
+    _write_head(fd, width, height, color_type, palette, transparency)
+    fd.write(_chunk(b'acTL', pack('>2I', frames_number, plays)))
+
+    sequence = 0
+    for i, (data, delay) in enumerate(frames):
+        delay_ms = min(max(int(delay * 1000 + 0.5), 0), 0xffff)
+        fd.write(_chunk(b'fcTL', pack('>5I2H2B', sequence, width, height, 0, 0, delay_ms, 1000, 0, 0)))
+        sequence += 1
+
+        compressed = _compress(width, height, data, color_type, compress_level)
+        if i == 0:
+            fd.write(_chunk(b'IDAT', compressed))
+        else:
+            fd.write(_chunk(b'fdAT', pack('>I', sequence) + compressed))
+            sequence += 1
+    fd.write(_chunk(b'IEND', b''))
+
+
+def _write_head(fd, width, height, color_type, palette=None, transparency=None, text=None):
+    fd.write(SIGNATURE)
+    fd.write(_chunk(b'IHDR', pack('>2I5B', width, height, 8, color_type, 0, 0, 0)))
+    if color_type == COLOR_TYPE_P:
+        fd.write(_chunk(b'PLTE', bytes(palette)))
+        if transparency:
+            fd.write(_chunk(b'tRNS', bytes(transparency)))
+    for key, value in sorted((text or {}).items()):
+        fd.write(_chunk(b'tEXt', key.encode('latin-1') + b'\0' + value.encode('latin-1')))
+
+
+def _compress(width, height, data, color_type, compress_level):
+    row_size = width * CHANNELS[color_type]
+    if isinstance(data, list) or not hasattr(data, '__getitem__'):
+        rows = data
+    else:
+        data = bytes(data)
+        rows = (data[y * row_size:(y + 1) * row_size] for y in range(height))
+
+    compressor = zlib.compressobj(compress_level)
+    compressed = []
+    for row in rows:
+        compressed.append(compressor.compress(b'\0'))
+        compressed.append(compressor.compress(bytes(row)))
+    compressed.append(compressor.flush())
+    return b''.join(compressed)
+
+
+def read_png(data):
+    """
+    Read PNG image.
+    :param data: bytes-like PNG file
+    :return: PngImage, pixel data has no filter bytes
+    """
+
+    data = bytes(data)
+    if data[:8] != SIGNATURE:
+        raise ImportError('Invalid png file')
+
+    pos, idat, palette, transparency, text = 8, [], None, None, {}
+    width = height = color_type = None
+    while pos + 8 <= len(data):
+        length = unpack_from('>I', data, pos)[0]
+        chunk_type = data[pos + 4:pos + 8]
+        chunk = data[pos + 8:pos + 8 + length]
+        if len(chunk) < length:
+            raise ImportError('Invalid png file: %s chunk is truncated' % chunk_type.decode('latin-1'))
+        pos += 12 + length
+
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = unpack_from('>2I5B', chunk)
+            if bit_depth != 8 or color_type not in CHANNELS:
+                raise ImportError('Unsupported png format: bit depth %d, color type %d' % (bit_depth, color_type))
+            if interlace:
+                raise ImportError('Unsupported png format: interlaced image')
+        elif chunk_type == b'PLTE':
+            palette = chunk
+        elif chunk_type == b'tRNS':
+            transparency = chunk
+        elif chunk_type == b'tEXt':
+            key, _, value = chunk.partition(b'\0')
+            text[key.decode('latin-1')] = value.decode('latin-1')
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+
+    if width is None:
+        raise ImportError('Invalid png file')
+
+    pixels = _unfilter(zlib.decompress(b''.join(idat)), width * CHANNELS[color_type], height,
+                       CHANNELS[color_type])
+    return PngImage(width, height, color_type, pixels, palette, transparency, text)
+
+
+def read_text(data):
+    """
+    Read tEXt chunks of PNG image without decompressing pixel data.
+    :param data: bytes-like PNG file
+    :return: dict of tEXt keywords and values
+    """
+
+    data = bytes(data)
+    if data[:8] != SIGNATURE:
+        raise ImportError('Invalid png file')
+
+    pos, text = 8, {}
+    while pos + 8 <= len(data):
+        length = unpack_from('>I', data, pos)[0]
+        chunk_type = data[pos + 4:pos + 8]
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        if chunk_type == b'tEXt':
+            key, _, value = data[pos + 8:pos + 8 + length].partition(b'\0')
+            text[key.decode('latin-1')] = value.decode('latin-1')
+        pos += 12 + length
+    return text
+
+
+def _unfilter(raw, row_size, height, bpp):
+    if len(raw) < (row_size + 1) * height:
+        raise ImportError('Invalid png file: image data is truncated')
+
+    rows, prev = [], bytearray(row_size)
+    for y in range(height):
+        pos = y * (row_size + 1)
+        filter_type = bytearray(raw[pos:pos + 1])[0]
+        row = bytearray(raw[pos + 1:pos + 1 + row_size])
+
+        if filter_type == 1:
+            for i in range(bpp, row_size):
+                row[i] = (row[i] + row[i - bpp]) & 0xff
+        elif filter_type == 2:
+            for i in range(row_size):
+                row[i] = (row[i] + prev[i]) & 0xff
+        elif filter_type == 3:
+            for i in range(row_size):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xff
+        elif filter_type == 4:
+            for i in range(row_size):
+                a = row[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xff
+        elif filter_type != 0:
+            raise ImportError('Invalid png file: unknown filter %d' % filter_type)
+
+        rows.append(bytes(row))
+        prev = row
+
+    return b''.join(rows)
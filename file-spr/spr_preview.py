@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Animated previews of sprites, works without GIMP.
+
+Frames are drawn the way the engine draws them: placed by their origins on one canvas and
+blended over a solid background by the texture format of the sprite. Frame groups are played
+by their intervals, single frames at a fixed frame rate, and angled groups show their first
+angle. Previews are written as animated PNG images or as contact sheets.
+
+Usage: python spr_preview.py sprites/ previews/ [--sheet] [--background 404040] [--fps 10] [-j N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from spr_codec import SpriteCodec, replace_file
+from spr_convert import makedirs
+from spr_scan import find_sprites
+import spr_dds
+import spr_pak
+import spr_pixels
+import spr_png
+
+# The engine plays sprites at 10 frames per second unless the entity sets another frame rate
+DEFAULT_FPS = 10.0
+
+
+def parse_color(text):
+    """
+    Parse color written as RRGGBB hex digits, with or without leading #.
+    :return: tuple of red, green and blue
+    """
+
+    text = text.lstrip('#')
+    if len(text) != 6:
+        raise ValueError('Color must have 6 hex digits: %s' % text)
+    value = int(text, 16)
+    return value >> 16, value >> 8 & 0xff, value & 0xff
+
+
+def play_order(reader, fps=DEFAULT_FPS):
+    """
+    Get frames of a sprite in the order they are played.
+    :param reader: SpriteReader
+    :param fps: frame rate of single frames
+    :return: list of (FrameParams, frame source, delay in seconds), frame source is indices of
+        version 2 frames and DDS data of version 3 frames
+    """
+
+    header, frame_delay = reader.header, 1.0 / fps
+    order = []
+    if header.version == SpriteCodec.VERSION_DDS:
+        for data in reader.dds_frames():
+            dds_header = spr_dds.read_header(data)[0]
+            width, height = dds_header.width, dds_header.height
+            order.append((SpriteCodec.FrameParams(-width // 2, height // 2, width, height), data, frame_delay))
+        return order
+
+    for i in range(header.frames_number):
+        fr = reader.frame(i)
+        if fr.type == SpriteCodec.FRAME_TYPE_SINGLE:
+            order.append((fr.params, fr.indices, frame_delay))
+        elif fr.type == SpriteCodec.FRAME_TYPE_ANGLED:
+            order.append((fr.params[0], fr.indices[0], frame_delay))
+        else:
+            # Group intervals are the times sub-frames end at, counted from the start of the group
+            start = 0.0
+            for params, indices, end in zip(fr.params, fr.indices, fr.intervals):
+                order.append((params, indices, end - start if end > start else frame_delay))
+                start = max(start, end)
+    return order
+
+
+def canvas_bounds(params_list):
+    """
+    Get canvas all frames fit on when placed by their origins.
+    :param params_list: list of FrameParams
+    :return: left and top sprite coordinates of the canvas, canvas width and height
+    """
+
+    left = min(p.origin_x for p in params_list)
+    right = max(p.origin_x + p.width for p in params_list)
+    top = max(p.origin_y for p in params_list)
+    bottom = min(p.origin_y - p.height for p in params_list)
+    return left, top, right - left, top - bottom
+
+
+def blit(canvas, canvas_width, x, y, rgb, width, height):
+    """
+    Copy RGB frame rows to RGB canvas.
+    """
+
+    row_size, canvas_row_size = width * 3, canvas_width * 3
+    for row in range(height):
+        pos = (y + row) * canvas_row_size + x * 3
+        canvas[pos:pos + row_size] = rgb[row * row_size:(row + 1) * row_size]
+
+
+def render(reader, background=(0, 0, 0), fps=DEFAULT_FPS):
+    """
+    Draw frames of a sprite in play order.
+    :param reader: SpriteReader, it must stay open while the frames are drawn
+    :param background: background color, tuple of red, green and blue
+    :param fps: frame rate of single frames
+    :return: canvas width, height, number of frames and iterator of (RGB data, delay in seconds)
+    """
+
+    header = reader.header
+    order = play_order(reader, fps)
+    if not order:
+        raise ImportError('Sprite has no frames')
+    left, top, width, height = canvas_bounds([params for params, _, _ in order])
+    empty_canvas = bytes(bytearray(background)) * (width * height)
+
+    if header.version == SpriteCodec.VERSION_DDS:
+        additive = header.format == SpriteCodec.TEXTURE_FORMAT_ADDITIVE
+
+        def draw(data):
+            return spr_pixels.composite_rgba(spr_dds.decode(bytes(data))[2], background, additive)
+    else:
+        tables = spr_pixels.composite_tables(header.format, reader.palette, background)
+
+        def draw(indices):
+            return spr_pixels.render_rgb(indices, tables)
+
+    def iter_frames():
+        for params, source, delay in order:
+            canvas = bytearray(empty_canvas)
+            blit(canvas, width, params.origin_x - left, top - params.origin_y, draw(source),
+                 params.width, params.height)
+            yield canvas, delay
+
+    return width, height, len(order), iter_frames()
+
+
+def write_preview(src_path, dst_path, sheet=False, background=(0, 0, 0), fps=DEFAULT_FPS):
+    """
+    Write preview of a sprite.
+    :param src_path: path to the sprite file, such as sprites/a.spr or valve/pak0.pak/sprites/a.spr
+    :param dst_path: path to the output PNG image
+    :param sheet: write a contact sheet of all frames instead of an animation
+    :param background: background color, tuple of red, green and blue
+    :param fps: frame rate of single frames
+    """
+
+    makedirs(os.path.dirname(dst_path))
+    with spr_pak.open_sprite(src_path) as reader:
+        width, height, frames_number, frames = render(reader, background, fps)
+        if sheet:
+            columns = int(math.ceil(math.sqrt(frames_number)))
+            rows = (frames_number + columns - 1) // columns
+            pixels = bytearray(bytes(bytearray(background)) * (columns * width * rows * height))
+            for i, (rgb, _) in enumerate(frames):
+                blit(pixels, columns * width, i % columns * width, i // columns * height, rgb, width, height)
+
+        # Animation frames are drawn while they are written, so the preview is written to a temporary
+        # file and an old preview is replaced only when the new one is complete
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dst_path), suffix='.tmp',
+                                         dir=os.path.dirname(os.path.abspath(dst_path)))
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if sheet:
+                    spr_png.write_png(temp_file, columns * width, rows * height, pixels, spr_png.COLOR_TYPE_RGB)
+                else:
+                    spr_png.write_apng(temp_file, width, height, frames, frames_number)
+            replace_file(temp_path, dst_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+
+def preview_path(src, sprite_path, dst_dir):
+    """
+    Get output path of a sprite preview, sprites inside archives are written to a directory named after the archive.
+    """
+
+    base_dir = src if os.path.isdir(src) else os.path.dirname(src)
+    rel_path = os.path.relpath(sprite_path, base_dir or os.curdir)
+    parts = rel_path.replace('\\', '/').split('/')
+    dirs = [os.path.splitext(part)[0] if part.lower().endswith('.pak') else part for part in parts[:-1]]
+    return os.path.join(dst_dir, *(dirs + [os.path.splitext(parts[-1])[0] + '.png']))
+
+
+def convert(task):
+    """
+    Write preview of a single sprite, called in worker processes.
+    :param task: input path, output path, sheet flag, background color, frame rate
+    :return: input path, seconds, error message
+    """
+
+    src_path, dst_path, sheet, background, fps = task
+    start = time.time()
+    try:
+        write_preview(src_path, dst_path, sheet, background, fps)
+        return src_path, time.time() - start, None
+    except Exception as e:
+        return src_path, time.time() - start, '%s: %s' % (type(e).__name__, e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render animated previews of Half-Life sprites.')
+    parser.add_argument('src', help='sprite file, PAK archive or directory')
+    parser.add_argument('dst', help='output directory')
+    parser.add_argument('--sheet', action='store_true', help='write contact sheets instead of animated PNG images')
+    parser.add_argument('--background', type=parse_color, default=(0, 0, 0),
+                        help='background color as RRGGBB hex digits (default: 000000)')
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS,
+                        help='frame rate of single frames (default: %g)' % DEFAULT_FPS)
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+    if args.fps <= 0:
+        parser.error('frame rate must be positive')
+
+    tasks = [(path, preview_path(args.src, path, args.dst), args.sheet, args.background, args.fps)
+             for path in find_sprites([args.src])]
+
+    start = time.time()
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap(convert, tasks)
+    else:
+        pool = None
+        results = (convert(task) for task in tasks)
+
+    failed = 0
+    try:
+        for src_path, seconds, error in results:
+            failed += error is not None
+            print('%8.3fs  %-9s  %s%s' % (seconds, 'failed' if error else 'rendered', src_path,
+                                          '\n           %s' % error if error else ''))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print('%d rendered, %d failed in %.2fs' % (len(tasks) - failed, failed, time.time() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
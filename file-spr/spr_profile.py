@@ -0,0 +1,132 @@
+"""
+Opt-in timing of import and export phases.
+
+Profiling is enabled by the SPR_PROFILE environment variable:
+
+    SPR_PROFILE=1              print phase timings to stderr
+    SPR_PROFILE=/tmp/spr.json  append phase timings to a JSON lines log
+
+Phases nest, and timings are collected until the outermost phase ends. Then one record is
+written per phase path with the number of calls, wall time, frames and bytes. When
+SPR_PROFILE is not set, phase() returns a shared no-op object.
+"""
+
+import json
+import os
+import sys
+import time
+
+TARGET = os.environ.get('SPR_PROFILE', '')
+ENABLED = bool(TARGET) and TARGET != '0'
+
+_stack = []
+_totals = {}
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, frames=0, bytes=0):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, name, frames, bytes):
+        self.name = name
+        self.frames = frames
+        self.bytes = bytes
+
+    def __enter__(self):
+        self.path = '/'.join([p.name for p in _stack] + [self.name])
+        _stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.start
+        _stack.pop()
+
+        totals = _totals.setdefault(self.path, {'calls': 0, 'seconds': 0.0, 'frames': 0, 'bytes': 0})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['frames'] += self.frames
+        totals['bytes'] += self.bytes
+
+        if not _stack:
+            _flush(failed=exc_type is not None)
+        return False
+
+    def add(self, frames=0, bytes=0):
+        """
+        Count frames and bytes processed in the phase.
+        """
+
+        self.frames += frames
+        self.bytes += bytes
+
+
+def phase(name, frames=0, bytes=0):
+    """
+    Time a phase of work.
+    :param name: phase name, nested phases are recorded as parent/child
+    :param frames: number of frames processed
+    :param bytes: number of bytes processed
+    :return: context manager, its add method counts more frames and bytes
+    """
+
+    if not ENABLED:
+        return _NULL_PHASE
+    return _Phase(name, frames, bytes)
+
+
+def profiled(name):
+    """
+    Decorator timing every call of a function as a phase, the function is returned unchanged if profiling is off.
+    :param name: phase name
+    """
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    return decorator
+
+
+def _flush(failed=False):
+    records = []
+    for path, totals in sorted(_totals.items()):
+        record = dict(totals, phase=path, pid=os.getpid(), seconds=round(totals['seconds'], 6))
+        if failed:
+            record['failed'] = True
+        records.append(record)
+    _totals.clear()
+
+    try:
+        if TARGET == '1' or TARGET.lower() == 'stderr':
+            for r in records:
+                sys.stderr.write('spr_profile: %-48s %5d calls %10.4fs %7d frames %12d bytes\n'
+                                 % (r['phase'], r['calls'], r['seconds'], r['frames'], r['bytes']))
+        else:
+            with open(TARGET, 'a') as fd:
+                for r in records:
+                    fd.write(json.dumps(r, sort_keys=True) + '\n')
+    except EnvironmentError:
+        # Profiling must not break the import or export it measures
+        pass
@@ -0,0 +1,258 @@
+"""
+Color quantization of RGB frames to one shared sprite palette.
+
+Colors of all frames are sampled to one histogram, which is split with the
+median cut algorithm. Pixels are then mapped to the nearest palette color.
+"""
+
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_COLORS = 256
+
+# Number of pixels sampled from all frames to build the histogram
+SAMPLE_SIZE = 1 << 18
+
+# Maximum number of histogram colors split without numpy, similar colors are merged above it
+SCALAR_COLORS = 1 << 12
+
+
+def sample_step(pixels_num, sample_size=SAMPLE_SIZE):
+    """
+    Get step between sampled pixels.
+    :param pixels_num: number of pixels in all frames
+    :param sample_size: preferred number of sampled pixels
+    :return: step, 1 samples every pixel
+    """
+
+    return max(pixels_num // sample_size, 1)
+
+
+def split_alpha(data, bpp):
+    """
+    Convert layer pixel data to RGB.
+    :param data: bytes-like pixel data of gray, gray with alpha, RGB or RGBA layer
+    :param bpp: bytes per pixel
+    :return: RGB data and alpha data, alpha is None if the layer has no alpha channel
+    """
+
+    data = bytes(data)
+    if bpp == 3:
+        return data, None
+
+    color_channels = 3 if bpp == 4 else 1
+    rgb = bytearray(len(data) // bpp * 3)
+    for channel in range(3):
+        rgb[channel::3] = data[min(channel, color_channels - 1)::bpp]
+    alpha = data[bpp - 1::bpp] if bpp in (2, 4) else None
+    return bytes(rgb), alpha
+
+
+def sample_pixels(rgb, alpha=None, step=1):
+    """
+    Take every step-th pixel, so samples can be kept and counted later.
+    :param rgb: bytes-like RGB data
+    :param alpha: bytes-like alpha data or None
+    :param step: step between sampled pixels
+    :return: sampled RGB data and alpha data, alpha is None if there is no alpha data
+    """
+
+    rgb = bytes(rgb)
+    if step > 1:
+        sampled = bytearray((len(rgb) // 3 + step - 1) // step * 3)
+        for channel in range(3):
+            sampled[channel::3] = rgb[channel::step * 3]
+        rgb = bytes(sampled)
+        alpha = bytes(alpha)[::step] if alpha is not None else None
+    return rgb, alpha
+
+
+def color_histogram(rgb, alpha=None, step=1, histogram=None):
+    """
+    Count colors of sampled pixels, transparent pixels are skipped.
+    :param rgb: bytes-like RGB data
+    :param alpha: bytes-like alpha data or None
+    :param step: step between sampled pixels
+    :param histogram: histogram to add counts to
+    :return: dict of colors packed as 0xRRGGBB and their counts
+    """
+
+    if histogram is None:
+        histogram = {}
+
+    if numpy is not None:
+        pixels = numpy.frombuffer(rgb, numpy.uint8).reshape(-1, 3)[::step].astype(numpy.uint32)
+        packed = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+        if alpha is not None:
+            packed = packed[numpy.frombuffer(alpha, numpy.uint8)[::step] > 0]
+        colors, counts = numpy.unique(packed, return_counts=True)
+        for color, count in zip(colors.tolist(), counts.tolist()):
+            histogram[color] = histogram.get(color, 0) + count
+        return histogram
+
+    rgb = bytes(rgb)
+    positions = range(0, len(rgb) // 3, step)
+    if alpha is not None:
+        alpha = bytearray(alpha)
+        positions = [i for i in positions if alpha[i]]
+    for key, count in Counter(rgb[i * 3:i * 3 + 3] for i in positions).items():
+        r, g, b = bytearray(key)
+        color = (r << 16) | (g << 8) | b
+        histogram[color] = histogram.get(color, 0) + count
+    return histogram
+
+
+def _reduce_histogram(histogram, max_colors):
+    # Drop low bits of all channels until few enough colors are left, merged colors are replaced by their mean
+    for shift in range(1, 8):
+        mask = ((0xff << shift) & 0xff) * 0x010101
+        if len(set(c & mask for c in histogram)) <= max_colors:
+            break
+
+    sums = {}
+    for c, n in histogram.items():
+        s = sums.setdefault(c & mask, [0, 0, 0, 0])
+        s[0] += ((c >> 16) & 0xff) * n
+        s[1] += ((c >> 8) & 0xff) * n
+        s[2] += (c & 0xff) * n
+        s[3] += n
+
+    reduced = {}
+    for r, g, b, n in sums.values():
+        color = ((r + n // 2) // n << 16) | ((g + n // 2) // n << 8) | (b + n // 2) // n
+        reduced[color] = reduced.get(color, 0) + n
+    return reduced
+
+
+def _make_box(colors):
+    population = sum(c[3] for c in colors)
+    ranges = [max(c[ch] for c in colors) - min(c[ch] for c in colors) for ch in range(3)]
+    channel = ranges.index(max(ranges))
+    score = ranges[channel] * population if len(colors) > 1 else -1
+    return score, channel, colors
+
+
+def _split_box(box):
+    _, channel, colors = box
+    colors.sort(key=lambda c: (c[channel], c))
+
+    half, population = sum(c[3] for c in colors) / 2.0, 0
+    for i, c in enumerate(colors[:-1]):
+        population += c[3]
+        if population >= half:
+            break
+    return _make_box(colors[:i + 1]), _make_box(colors[i + 1:])
+
+
+def _median_cut_python(histogram, max_colors):
+    colors = [((c >> 16) & 0xff, (c >> 8) & 0xff, c & 0xff, n) for c, n in sorted(histogram.items())]
+
+    boxes = [_make_box(colors)]
+    while len(boxes) < max_colors:
+        # Split the box with the widest range of the most pixels
+        i = max(range(len(boxes)), key=lambda j: boxes[j][0])
+        if boxes[i][0] < 0:
+            break
+        boxes[i:i + 1] = _split_box(boxes[i])
+
+    palette = bytearray()
+    for _, _, colors in boxes:
+        population = sum(c[3] for c in colors)
+        palette.extend((sum(c[ch] * c[3] for c in colors) + population // 2) // population for ch in range(3))
+    return bytes(palette)
+
+
+def _median_cut_numpy(histogram, max_colors):
+    packed = numpy.fromiter(histogram.keys(), numpy.int64, len(histogram))
+    counts = numpy.fromiter(histogram.values(), numpy.int64, len(histogram))
+    colors = numpy.stack([(packed >> 16) & 0xff, (packed >> 8) & 0xff, packed & 0xff], 1)
+
+    # Boxes are slices of colors, a split sorts its slice in place
+    def make_box(start, end):
+        box = colors[start:end]
+        ranges = box.max(0) - box.min(0)
+        channel = int(ranges.argmax())
+        score = int(ranges[channel]) * int(counts[start:end].sum()) if end - start > 1 else -1
+        return score, channel, start, end
+
+    boxes = [make_box(0, len(colors))]
+    while len(boxes) < max_colors:
+        # Split the box with the widest range of the most pixels, the same order as without numpy
+        i = max(range(len(boxes)), key=lambda j: boxes[j][0])
+        if boxes[i][0] < 0:
+            break
+        _, channel, start, end = boxes[i]
+        order = numpy.argsort(colors[start:end, channel] << 24 | packed[start:end])
+        for array in (packed, colors, counts):
+            array[start:end] = array[start:end][order]
+
+        population = numpy.cumsum(counts[start:end - 1])
+        middle = min(int(numpy.searchsorted(population, population[-1] / 2.0 + counts[end - 1] / 2.0)),
+                     len(population) - 1)
+        boxes[i:i + 1] = make_box(start, start + middle + 1), make_box(start + middle + 1, end)
+
+    palette = numpy.empty((len(boxes), 3), numpy.int64)
+    for i, (_, _, start, end) in enumerate(boxes):
+        population = counts[start:end].sum()
+        palette[i] = ((colors[start:end] * counts[start:end, None]).sum(0) + population // 2) // population
+    return palette.astype(numpy.uint8).tobytes()
+
+
+def median_cut(histogram, max_colors=MAX_COLORS):
+    """
+    Make palette for colors of histogram.
+    :param histogram: dict of colors packed as 0xRRGGBB and their counts
+    :param max_colors: maximum number of palette colors
+    :return: palette, 3 bytes per color
+    """
+
+    if not histogram:
+        return b'\0\0\0'
+    if numpy is not None:
+        return _median_cut_numpy(histogram, max_colors)
+    if len(histogram) > SCALAR_COLORS:
+        histogram = _reduce_histogram(histogram, SCALAR_COLORS)
+    return _median_cut_python(histogram, max_colors)
+
+
+def map_colors(rgb, palette):
+    """
+    Map pixels to the nearest palette colors.
+    :param rgb: bytes-like RGB data
+    :param palette: palette, 3 bytes per color
+    :return: indices, 1 byte per pixel
+    """
+
+    if numpy is not None:
+        pixels = numpy.frombuffer(rgb, numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        packed = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+        colors, inverse = numpy.unique(packed, return_inverse=True)
+        colors = numpy.stack([(colors >> 16) & 0xff, (colors >> 8) & 0xff, colors & 0xff], 1)
+
+        # Distances are computed for unique colors in chunks to bound memory
+        lut = numpy.frombuffer(bytes(palette), numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        nearest = numpy.empty(len(colors), numpy.uint8)
+        for start in range(0, len(colors), 4096):
+            diff = colors[start:start + 4096, None, :] - lut[None, :, :]
+            nearest[start:start + 4096] = (diff * diff).sum(2).argmin(1)
+        return nearest[inverse.reshape(-1)].tobytes()
+
+    rgb = bytes(rgb)
+    lut = bytearray(palette)
+    lut = [(i, lut[i * 3], lut[i * 3 + 1], lut[i * 3 + 2]) for i in range(len(lut) // 3)]
+
+    cache = {}
+    indices = bytearray(len(rgb) // 3)
+    for i in range(len(indices)):
+        key = rgb[i * 3:i * 3 + 3]
+        index = cache.get(key)
+        if index is None:
+            r, g, b = bytearray(key)
+            index = min(lut, key=lambda c: (c[1] - r) ** 2 + (c[2] - g) ** 2 + (c[3] - b) ** 2)[0]
+            cache[key] = index
+        indices[i] = index
+    return bytes(indices)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Header-only scanner for sprite collections.
+
+Reads headers, palettes and frame params of every .spr file and seeks past pixel data,
+so large asset trees are validated without decoding frames. Sprites inside PAK archives
+are scanned in place. One JSON line is printed per file:
+
+    python spr_scan.py sprites/ valve/pak0.pak > sprites.jsonl
+"""
+
+from __future__ import print_function
+
+from struct import unpack
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+from spr_codec import SpriteCodec
+import spr_dds
+import spr_pak
+
+MAX_PALETTE_SIZE = 256
+FRAME_TYPES = (SpriteCodec.FRAME_TYPE_SINGLE, SpriteCodec.FRAME_TYPE_GROUP, SpriteCodec.FRAME_TYPE_ANGLED)
+
+
+def _read(fd, size, frame):
+    data = fd.read(size)
+    if len(data) < size:
+        raise ImportError('Invalid spr file: frame %d is truncated' % frame)
+    return data
+
+
+def _skip(fd, size, end, frame):
+    if fd.tell() + size > end:
+        raise ImportError('Invalid spr file: frame %d is truncated' % frame)
+    fd.seek(size, os.SEEK_CUR)
+
+
+def _frame_info(params, header, info, frame):
+    if params.width > header.max_width or params.height > header.max_height:
+        info['warnings'].append('frame %d is %dx%d, larger than the sprite size %dx%d'
+                                % (frame, params.width, params.height, header.max_width, header.max_height))
+    if not params.width or not params.height:
+        info['warnings'].append('frame %d is empty' % frame)
+    return {'origin': [params.origin_x, params.origin_y], 'size': [params.width, params.height]}
+
+
+def _scan_frames(fd, header, end, info):
+    palette_size = unpack('<H', _read(fd, 2, 0))[0]
+    info['palette_size'] = palette_size
+    if palette_size > MAX_PALETTE_SIZE:
+        raise ImportError('Invalid palette size: %d' % palette_size)
+    if palette_size * 3 + fd.tell() > end:
+        raise ImportError('Invalid spr file: palette is truncated')
+    fd.seek(palette_size * 3, os.SEEK_CUR)
+
+    frames = info['frames'] = []
+    for i in range(header.frames_number):
+        frame_type = unpack('<I', _read(fd, 4, i))[0]
+        if frame_type not in FRAME_TYPES:
+            info['warnings'].append('frame %d has unknown type %d' % (i, frame_type))
+
+        if frame_type == SpriteCodec.FRAME_TYPE_SINGLE:
+            params = SpriteCodec.FrameParams(*unpack(SpriteCodec.FRAME_PARAMS_STRUCT, _read(fd, 16, i)))
+            frame = _frame_info(params, header, info, i)
+            _skip(fd, params.width * params.height, end, i)
+        else:
+            group_len = unpack('<I', _read(fd, 4, i))[0]
+            if not group_len:
+                raise ImportError('Invalid spr file: group frame %d is empty' % i)
+            # Intervals and params alone must fit in the file
+            if fd.tell() + group_len * 20 > end:
+                raise ImportError('Invalid spr file: frame %d is truncated' % i)
+
+            intervals = unpack('<%df' % group_len, _read(fd, group_len * 4, i))
+            group = []
+            for _ in range(group_len):
+                params = SpriteCodec.FrameParams(*unpack(SpriteCodec.FRAME_PARAMS_STRUCT, _read(fd, 16, i)))
+                group.append(_frame_info(params, header, info, i))
+                _skip(fd, params.width * params.height, end, i)
+            frame = {'intervals': [round(t, 6) for t in intervals], 'frames': group}
+
+        frame['type'] = frame_type
+        frames.append(frame)
+
+    info['single_frames'] = sum(1 for fr in frames if 'frames' not in fr)
+    info['group_frames'] = len(frames) - info['single_frames']
+    info['group_subframes'] = sum(len(fr['frames']) for fr in frames if 'frames' in fr)
+
+    if fd.tell() < end:
+        info['warnings'].append('%d bytes of trailing data' % (end - fd.tell()))
+
+
+def _scan_dds_frames(fd, header, start, end, info):
+    if end - start <= 40:
+        raise ImportError('Invalid dds frame_0')
+
+    data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        bounds = spr_dds.split_frames(data, start + 40, header.frames_number, end)
+        if len(bounds) < header.frames_number:
+            raise ImportError('Invalid spr file: %d of %d dds frames found' % (len(bounds), header.frames_number))
+
+        frames = info['dds_frames'] = []
+        for begin, end in bounds:
+            dds_header, dxgi_format = spr_dds.read_header(data, begin)
+            if dxgi_format is not None:
+                pixel_format = 'DXGI %d' % dxgi_format
+            elif dds_header.pf_flags & spr_dds.DDPF_FOURCC:
+                pixel_format = dds_header.fourcc.decode('latin-1')
+            else:
+                pixel_format = 'RGB%d' % dds_header.rgb_bit_count
+            frames.append({
+                'size': [dds_header.width, dds_header.height],
+                'format': pixel_format,
+                'decodable': spr_dds.pixel_format(dds_header, dxgi_format) is not None,
+                'mipmaps': dds_header.mip_count if dds_header.flags & spr_dds.DDSD_MIPMAPCOUNT else 1,
+                'bytes': end - begin,
+            })
+    finally:
+        data.close()
+
+
+def scan_file(file_path):
+    """
+    Read sprite structure without pixel data.
+    :param file_path: path to the sprite, such as sprites/a.spr or valve/pak0.pak/sprites/a.spr
+    :return: dict of sprite metadata, 'error' is set for invalid files
+    """
+
+    info = {'path': file_path, 'error': None, 'warnings': []}
+    try:
+        archive_path, name = spr_pak.split_path(file_path)
+        if name is None and os.path.splitext(file_path)[1].lower() == '.pak':
+            # Archives that can not be opened are reported with their own error
+            spr_pak.open_archive(file_path)
+
+        with open(archive_path, 'rb') as fd:
+            if name is None:
+                start, size = 0, os.fstat(fd.fileno()).st_size
+            else:
+                entry = spr_pak.open_archive(archive_path).entry(name)
+                start, size = entry.offset, entry.size
+                fd.seek(start)
+            info['bytes'] = size
+            end = start + size
+
+            header = SpriteCodec._read_header(fd)
+            info.update(version=header.version, type=header.type, format=header.format,
+                        radius=round(header.radius, 6), size=[header.max_width, header.max_height],
+                        frames_number=header.frames_number, beam_length=round(header.beam_length, 6),
+                        synch_type=header.synch_type)
+
+            if header.version == SpriteCodec.VERSION_BMP:
+                _scan_frames(fd, header, end, info)
+            else:
+                _scan_dds_frames(fd, header, start, end, info)
+    except ImportError as e:
+        info['error'] = str(e)
+    except KeyError as e:
+        info['error'] = e.args[0]
+    except EnvironmentError as e:
+        info['error'] = '%s: %s' % (type(e).__name__, e)
+    return info
+
+
+def find_sprites(paths):
+    """
+    Find sprite files, sprites inside PAK archives included.
+    :param paths: files, archives and directories
+    :return: iterator of file paths
+    """
+
+    for path in paths:
+        if not os.path.isdir(path):
+            if os.path.splitext(path)[1].lower() == '.pak':
+                for sprite_path in spr_pak.find_sprites(path):
+                    yield sprite_path
+            else:
+                yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                ext = os.path.splitext(file_name)[1].lower()
+                if ext == '.spr':
+                    yield os.path.join(root, file_name)
+                elif ext == '.pak':
+                    for sprite_path in spr_pak.find_sprites(os.path.join(root, file_name)):
+                        yield sprite_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan Half-Life sprites and print their metadata as JSON lines.')
+    parser.add_argument('paths', nargs='+', help='sprite files, PAK archives or directories')
+    parser.add_argument('-o', '--output', help='output file (default: standard output)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--errors-only', action='store_true', help='print only invalid files')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap(scan_file, find_sprites(args.paths), 64)
+    else:
+        pool = None
+        results = (scan_file(path) for path in find_sprites(args.paths))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    counts = {'files': 0, 'invalid': 0}
+    try:
+        for info in results:
+            counts['files'] += 1
+            counts['invalid'] += info['error'] is not None
+            if info['error'] is not None or not args.errors_only:
+                out.write(json.dumps(info, sort_keys=True) + '\n')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if out is not sys.stdout:
+            out.close()
+
+    print('%d files, %d invalid in %.2fs' % (counts['files'], counts['invalid'], time.time() - start),
+          file=sys.stderr)
+    return 1 if counts['invalid'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
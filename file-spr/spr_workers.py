@@ -0,0 +1,49 @@
+"""
+Process pool helpers for decoding sprite frames.
+"""
+
+import multiprocessing
+import os
+
+
+def _call(job):
+    func, args = job
+    return func(*args)
+
+
+def env_workers(name, default=1):
+    """
+    Read number of worker processes from environment variable.
+    :param name: variable name
+    :param default: number of workers if the variable is not set or is not a number
+    :return: number of workers, at least 1
+    """
+
+    try:
+        return max(int(os.environ.get(name, default)), 1)
+    except ValueError:
+        return max(default, 1)
+
+
+def imap(func, args_iter, workers=1, chunksize=1):
+    """
+    Call function for every arguments tuple in worker processes.
+    :param func: module-level function
+    :param args_iter: iterable of arguments tuples, they must be picklable if workers > 1
+    :param workers: number of worker processes, 1 calls the function in this process
+    :param chunksize: number of calls sent to a worker at once
+    :return: iterator of results in the order of arguments
+    """
+
+    if workers <= 1:
+        for args in args_iter:
+            yield func(*args)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(_call, ((func, args) for args in args_iter), chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
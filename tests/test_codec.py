@@ -0,0 +1,57 @@
+"""
+Tests of the sprite reader on truncated files.
+
+Usage: python -m unittest discover tests
+"""
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+from spr_codec import SpriteCodec, SpriteReader
+
+
+def sprite_data(frames_number=1):
+    header = SpriteCodec.make_header(2, 2, frames_number)
+    params = SpriteCodec.FrameParams(-1, 1, 2, 2)
+    frames = [SpriteCodec.FrameData(SpriteCodec.FRAME_TYPE_SINGLE, 0, None, params, b'\0\1\2\3')] * frames_number
+    fd = io.BytesIO()
+    SpriteCodec.write(fd, header, b'\0' * 768, frames)
+    return fd.getvalue()
+
+
+class TruncatedSpriteTest(unittest.TestCase):
+
+    def check_error(self, data, message):
+        try:
+            SpriteReader(bytearray(data)).close()
+        except ImportError as e:
+            self.assertEqual(str(e), 'Invalid spr file: %s is truncated' % message)
+        else:
+            self.fail('ImportError is not raised')
+
+    def test_complete(self):
+        reader = SpriteReader(bytearray(sprite_data(2)))
+        try:
+            self.assertEqual(bytes(reader.frame(1).indices), b'\0\1\2\3')
+        finally:
+            reader.close()
+
+    def test_header_only(self):
+        self.check_error(sprite_data()[:40], 'palette')
+
+    def test_truncated_palette(self):
+        self.check_error(sprite_data()[:42 + 100], 'palette')
+
+    def test_truncated_frame(self):
+        self.check_error(sprite_data(2)[:-1], 'frame 1')
+
+    def test_missing_frame(self):
+        self.check_error(sprite_data(2)[:-(4 + 16 + 4)], 'frame 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
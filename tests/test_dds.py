@@ -0,0 +1,164 @@
+"""
+Known-answer tests of the DDS block decoder and encoder.
+
+Expected pixels and blocks are worked out by hand from the BC1/BC3 block layout and the DDS
+header fields from the DDS specification, so the scalar and the vectorized implementations are
+checked against the format rather than against each other.
+
+Usage: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from struct import pack, unpack_from
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_dds
+
+# Selectors 0, 1, 2, 3 in every row
+ROW_SELECTORS = pack('<I', 0xE4E4E4E4)
+
+# 3-bit alpha selectors 0..7 twice, packed little endian
+ALPHA_SELECTORS = b'\x88\xc6\xfa\x88\xc6\xfa'
+
+RED, BLUE, WHITE = 0xF800, 0x001F, 0xFFFF
+
+QUALITIES = (spr_dds.QUALITY_FAST, spr_dds.QUALITY_NORMAL, spr_dds.QUALITY_HIGH)
+
+
+def rgba(pixels):
+    return bytes(bytearray(v for pixel in pixels for v in pixel))
+
+
+def decoders():
+    yield 'python', spr_dds._decode_blocks_python
+    if spr_dds.numpy is not None:
+        yield 'numpy', spr_dds._decode_blocks_numpy
+
+
+def encoders():
+    yield 'python', spr_dds._encode_blocks_python
+    if spr_dds.numpy is not None:
+        yield 'numpy', spr_dds._encode_blocks_numpy
+
+
+def dds_file(width, height, fmt, blocks):
+    return pack(spr_dds.HEADER_STRUCT, *spr_dds.make_header(width, height, fmt)) + blocks
+
+
+class DecodeBlockTest(unittest.TestCase):
+
+    def check_block(self, fmt, block, expected):
+        for name, decode in decoders():
+            self.assertEqual(decode(block, fmt, 1, 1), rgba(expected), name)
+
+    def test_bc1_four_colors(self):
+        # c0 > c1: two endpoints and two colors at 1/3 and 2/3
+        block = pack('<2H', RED, BLUE) + ROW_SELECTORS
+        row = [(255, 0, 0, 255), (0, 0, 255, 255), (170, 0, 85, 255), (85, 0, 170, 255)]
+        self.check_block(spr_dds.FORMAT_BC1, block, row * 4)
+
+    def test_bc1_565_expansion(self):
+        # 5 and 6 bit channels are expanded by repeating their top bits
+        block = pack('<2H', 0x8410, 0x0000) + ROW_SELECTORS
+        row = [(132, 130, 132, 255), (0, 0, 0, 255), (88, 86, 88, 255), (44, 43, 44, 255)]
+        self.check_block(spr_dds.FORMAT_BC1, block, row * 4)
+
+    def test_bc1_three_colors_and_transparent(self):
+        # c0 <= c1: one color halfway between the endpoints and transparent black
+        block = pack('<2H', BLUE, RED) + ROW_SELECTORS
+        row = [(0, 0, 255, 255), (255, 0, 0, 255), (127, 0, 127, 255), (0, 0, 0, 0)]
+        self.check_block(spr_dds.FORMAT_BC1, block, row * 4)
+
+    def test_bc3_eight_alphas(self):
+        # a0 > a1: six alphas interpolated in sevenths, colors always use the four colors mode
+        block = pack('<2B', 255, 0) + ALPHA_SELECTORS + pack('<2HI', 0x0000, WHITE, 0xFFFFFFFF)
+        alphas = [255, 0, 218, 182, 145, 109, 72, 36]
+        self.check_block(spr_dds.FORMAT_BC3, block, [(170, 170, 170, alphas[p % 8]) for p in range(16)])
+
+    def test_bc3_six_alphas(self):
+        # a0 <= a1: four alphas interpolated in fifths, then 0 and 255
+        block = pack('<2B', 0, 255) + ALPHA_SELECTORS + pack('<2H', WHITE, 0x0000) + pack('<I', 0)
+        alphas = [0, 255, 51, 102, 153, 204, 0, 255]
+        self.check_block(spr_dds.FORMAT_BC3, block, [(255, 255, 255, alphas[p % 8]) for p in range(16)])
+
+
+class DecodeFileTest(unittest.TestCase):
+
+    def test_partial_block_is_cropped(self):
+        block = pack('<2H', RED, BLUE) + ROW_SELECTORS
+        width, height, data = spr_dds.decode(dds_file(2, 3, spr_dds.FORMAT_BC1, block))
+        self.assertEqual((width, height), (2, 3))
+        self.assertEqual(data, rgba([(255, 0, 0, 255), (0, 0, 255, 255)] * 3))
+
+    def test_truncated_frame(self):
+        block = pack('<2H', RED, BLUE) + ROW_SELECTORS
+        self.assertRaises(ImportError, spr_dds.decode, dds_file(8, 4, spr_dds.FORMAT_BC1, block))
+
+
+class EncodeBlockTest(unittest.TestCase):
+
+    def check_block(self, fmt, pixels, expected, qualities=QUALITIES):
+        for quality in qualities:
+            for name, encode in encoders():
+                self.assertEqual(encode(rgba(pixels), 4, 4, fmt, quality), expected, (name, quality))
+
+    def test_bc1_solid_color(self):
+        self.check_block(spr_dds.FORMAT_BC1, [(255, 0, 0, 255)] * 16, pack('<2HI', RED, RED, 0))
+
+    def test_bc1_opposite_channels(self):
+        # Red falls while blue rises, the endpoints lie on the other diagonal of the bounding box
+        pixels = [(255, 0, 0, 255), (0, 0, 255, 255)] * 8
+        self.check_block(spr_dds.FORMAT_BC1, pixels, pack('<2HI', RED, BLUE, 0x44444444),
+                         (spr_dds.QUALITY_NORMAL, spr_dds.QUALITY_HIGH))
+        # Fast endpoints are inset by 1/16 of the box: (239, 0, 16) and (16, 0, 239)
+        self.check_block(spr_dds.FORMAT_BC1, pixels, pack('<2HI', 0xE802, 0x101D, 0x44444444),
+                         (spr_dds.QUALITY_FAST,))
+
+    def test_bc3_solid_alpha(self):
+        pixels = [(255, 255, 255, 128)] * 16
+        self.check_block(spr_dds.FORMAT_BC3, pixels,
+                         pack('<2B', 128, 128) + b'\0' * 6 + pack('<2HI', WHITE, WHITE, 0))
+
+    def test_bc3_eight_alphas(self):
+        # Alpha 255 is the first endpoint, 0 is the second
+        pixels = [(255, 255, 255, 0), (255, 255, 255, 255)] * 8
+        self.check_block(spr_dds.FORMAT_BC3, pixels,
+                         pack('<2B', 255, 0) + b'\x41\x10\x04' * 2 + pack('<2HI', WHITE, WHITE, 0))
+
+    def test_bc3_six_alphas(self):
+        # High quality keeps 0 and 255 exact and interpolates between 100 and 200, selectors 6, 7, 0, 1
+        pixels = [(255, 255, 255, a) for a in (0, 255, 100, 200)] * 4
+        self.check_block(spr_dds.FORMAT_BC3, pixels,
+                         pack('<2B', 100, 200) + b'\x3e\xe2\x23' * 2 + pack('<2HI', WHITE, WHITE, 0),
+                         (spr_dds.QUALITY_HIGH,))
+
+
+class EncodeFileTest(unittest.TestCase):
+
+    def check_header(self, data, width, height, fourcc, linear_size):
+        # Offsets of DDS_HEADER fields after the magic number
+        self.assertEqual(data[:4], b'DDS ')
+        self.assertEqual(unpack_from('<5I', data, 4), (124, 0x81007, height, width, linear_size))
+        self.assertEqual(unpack_from('<2I4s', data, 76), (32, 0x4, fourcc))
+        self.assertEqual(unpack_from('<I', data, 108)[0], 0x1000)
+        self.assertEqual(len(data), 128 + linear_size)
+
+    def test_bc1_header(self):
+        data = spr_dds.encode(5, 3, rgba([(10, 20, 30, 255)] * 15))
+        self.check_header(data, 5, 3, b'DXT1', 16)
+
+    def test_bc3_header(self):
+        data = spr_dds.encode(5, 3, rgba([(10, 20, 30, 128)] * 15))
+        self.check_header(data, 5, 3, b'DXT5', 32)
+
+    def test_edge_pixels_are_repeated(self):
+        # Pixels past the texture repeat the last column, so a 1x1 texture encodes a solid block
+        data = spr_dds.encode(1, 1, rgba([(255, 0, 0, 255)]))
+        self.assertEqual(data[128:], pack('<2HI', RED, RED, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
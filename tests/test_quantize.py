@@ -0,0 +1,62 @@
+"""
+Tests of the median cut quantizer.
+
+Usage: python -m unittest discover tests
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'file-spr'))
+
+import spr_quantize
+
+
+def random_histogram(colors_number, seed=1):
+    rnd = random.Random(seed)
+    return dict((rnd.getrandbits(24), rnd.randint(1, 50)) for _ in range(colors_number))
+
+
+class MedianCutTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(spr_quantize.median_cut({}), b'\0\0\0')
+
+    def test_few_colors_are_exact(self):
+        histogram = {0xff0000: 3, 0x00ff00: 1, 0x0000ff: 2}
+        palette = spr_quantize.median_cut(histogram)
+        self.assertEqual(sorted(palette[i:i + 3] for i in range(0, len(palette), 3)),
+                         [b'\0\0\xff', b'\0\xff\0', b'\xff\0\0'])
+
+    def test_box_mean(self):
+        # Two boxes, each color is weighted by its count
+        histogram = {0x000000: 3, 0x000004: 1, 0xff0000: 5}
+        self.assertEqual(spr_quantize.median_cut(histogram, 2), b'\0\0\x01\xff\0\0')
+
+    @unittest.skipIf(spr_quantize.numpy is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        for colors_number in (2, 17, 300, 3000):
+            histogram = random_histogram(colors_number)
+            self.assertEqual(spr_quantize._median_cut_numpy(histogram, spr_quantize.MAX_COLORS),
+                             spr_quantize._median_cut_python(histogram, spr_quantize.MAX_COLORS), colors_number)
+
+    def test_reduced_histogram(self):
+        histogram = random_histogram(20000)
+        reduced = spr_quantize._reduce_histogram(histogram, 4096)
+        self.assertTrue(len(reduced) <= 4096)
+        self.assertEqual(sum(reduced.values()), sum(histogram.values()))
+
+
+class SamplePixelsTest(unittest.TestCase):
+
+    def test_every_step_pixel(self):
+        rgb = bytes(bytearray(range(30)))
+        self.assertEqual(spr_quantize.sample_pixels(rgb, b'abcdefghij', 4),
+                         (bytes(bytearray([0, 1, 2, 12, 13, 14, 24, 25, 26])), b'aei'))
+        self.assertEqual(spr_quantize.sample_pixels(rgb, None, 1), (rgb, None))
+
+
+if __name__ == '__main__':
+    unittest.main()